@@ -0,0 +1,174 @@
+import numpy as np
+
+from psen_processing import config
+
+BACKGROUND_MODES = ("average", "ema", "median")
+
+
+class BackgroundModel(object):
+    """
+    Background estimate over the last non-FEL profiles.
+
+    Modes:
+    - average: mean over the last "depth" profiles, kept as a running sum over a preallocated ring buffer.
+    - ema: exponential moving average with weight 2 / (depth + 1) for the newest profile.
+    - median: median over the last "depth" profiles.
+    """
+
+    def __init__(self, mode=config.DEFAULT_BACKGROUND_MODE, depth=config.DEFAULT_BACKGROUND_DEPTH):
+        self.mode = mode
+        self.depth = depth
+        self.requested_parameters = (mode, depth)
+
+        self.profile_shape = None
+        self.buffer = None
+        self.running_sum = None
+        self.estimate = None
+
+        self.index = 0
+        self.count = 0
+
+    def configure(self, mode, depth):
+        """
+        Request a new mode and depth of the model. Safe to call from any thread: the change is applied (and the model
+        reset, if any of them changed) by the next update_shape or add.
+        """
+        self.requested_parameters = (mode, depth)
+
+    def reset(self, profile_shape=None):
+        """
+        Drop all accumulated profiles.
+        :param profile_shape: Shape of the profiles to accumulate from now on, None to allocate on the next add.
+        """
+        self.profile_shape = profile_shape
+        self.index = 0
+        self.count = 0
+
+        if profile_shape is None:
+            self.buffer = None
+            self.running_sum = None
+            self.estimate = None
+            return
+
+        self.estimate = np.zeros(shape=profile_shape, dtype=config.BACKGROUND_DTYPE)
+
+        if self.mode == "ema":
+            self.buffer = None
+            self.running_sum = None
+        else:
+            self.buffer = np.zeros(shape=(self.depth,) + tuple(profile_shape), dtype=config.BACKGROUND_DTYPE)
+            self.running_sum = np.zeros(shape=profile_shape, dtype=config.BACKGROUND_DTYPE)
+
+    def update_shape(self, profile_shape):
+        """
+        Reset the model if the profile shape (the ROI) or the requested parameters changed.
+        """
+        requested_parameters = self.requested_parameters
+
+        if requested_parameters != (self.mode, self.depth):
+            self.mode, self.depth = requested_parameters
+            self.reset(profile_shape)
+
+        elif profile_shape != self.profile_shape:
+            self.reset(profile_shape)
+
+    def add(self, profile):
+        """
+        Add a background profile to the model.
+        """
+        self.update_shape(profile.shape)
+
+        if self.mode == "ema":
+            if self.count == 0:
+                self.estimate[:] = profile
+            else:
+                weight = 2 / (self.depth + 1)
+                self.estimate *= 1 - weight
+                self.estimate += weight * profile
+
+            self.count = min(self.count + 1, self.depth)
+            return
+
+        slot = self.buffer[self.index]
+
+        if self.mode == "average":
+            if self.count == self.depth:
+                self.running_sum -= slot
+
+            self.running_sum += profile
+
+        slot[:] = profile
+
+        self.index = (self.index + 1) % self.depth
+        self.count = min(self.count + 1, self.depth)
+
+        # Recompute the sum once per buffer wrap, so floating point errors cannot accumulate.
+        if self.mode == "average" and self.index == 0:
+            self.buffer.sum(axis=0, out=self.running_sum)
+
+    def get(self):
+        """
+        Get the current background estimate.
+        :return: Background profile or None, if no background was accumulated yet. The returned array is reused and
+        overwritten by the next call.
+        """
+        if self.count == 0:
+            return None
+
+        if self.mode == "average":
+            np.divide(self.running_sum, self.count, out=self.estimate)
+
+        elif self.mode == "median":
+            np.median(self.buffer[:self.count], axis=0, out=self.estimate)
+
+        return self.estimate
+
+    def __len__(self):
+        return self.count
+
+
+def get_background_estimates(profiles, n_previous, mode, depth):
+    """
+    Get the background estimates of a batch, as BackgroundModel.get returns them after adding the profiles in order.
+    :param profiles: 2D array with the background profiles (one per row), in the order they were acquired.
+    :param n_previous: Array with the number of background profiles added before each estimate.
+    :return: 2D array with one estimate per element of n_previous, NaN where no profile was added yet.
+    """
+    n_previous = np.asarray(n_previous, dtype=int)
+    profiles = np.asarray(profiles, dtype=config.BACKGROUND_DTYPE)
+
+    estimates = np.full((len(n_previous), profiles.shape[1]), np.nan, dtype=config.BACKGROUND_DTYPE)
+    available = n_previous > 0
+
+    if not available.any():
+        return estimates
+
+    if mode == "average":
+        running_sum = np.zeros((len(profiles) + 1, profiles.shape[1]), dtype=config.BACKGROUND_DTYPE)
+        np.cumsum(profiles, axis=0, out=running_sum[1:])
+
+        end = n_previous[available]
+        start = np.maximum(end - depth, 0)
+
+        estimates[available] = (running_sum[end] - running_sum[start]) / (end - start)[:, np.newaxis]
+
+    elif mode == "median":
+        for end in np.unique(n_previous[available]):
+            estimates[n_previous == end] = np.median(profiles[max(end - depth, 0):end], axis=0)
+
+    elif mode == "ema":
+        weight = 2 / (depth + 1)
+
+        states = np.empty_like(profiles)
+        states[0] = profiles[0]
+
+        for index in range(1, len(profiles)):
+            np.multiply(states[index - 1], 1 - weight, out=states[index])
+            states[index] += weight * profiles[index]
+
+        estimates[available] = states[n_previous[available] - 1]
+
+    else:
+        raise ValueError("Background mode must be one of %s, but %s was given." % (BACKGROUND_MODES, mode))
+
+    return estimates
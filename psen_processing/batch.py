@@ -0,0 +1,114 @@
+import argparse
+import logging
+
+import numpy as np
+
+from psen_processing import config
+from psen_processing.background import BACKGROUND_MODES
+from psen_processing.classification import SHOT_CLASSIFIER_MODES
+from psen_processing.edge_finder import EDGE_TYPES, PEAK_FITS
+from psen_processing.processor import process_batch
+
+_logger = logging.getLogger(__name__)
+
+
+def load_frames(filename):
+    """
+    Load the frames of a recorded run.
+    :param filename: .npy file with a 3D array of images (memory mapped), or .npz file with the "images" array, an
+    optional "pulse_ids" array and optional channel arrays (one value per image) for the shot classifier.
+    :return: Tuple (pulse_ids, images, channels).
+    """
+    if filename.endswith(".npy"):
+        images = np.load(filename, mmap_mode="r")
+        return np.arange(len(images)), images, {}
+
+    with np.load(filename) as frames:
+
+        if "images" not in frames:
+            raise ValueError("File %s does not contain an 'images' array." % filename)
+
+        images = frames["images"]
+        pulse_ids = frames["pulse_ids"] if "pulse_ids" in frames else np.arange(len(images))
+        channels = {name: frames[name] for name in frames.files if name not in ("images", "pulse_ids")}
+
+    return pulse_ids, images, channels
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PSEN batch processing of recorded frames.')
+
+    parser.add_argument("input_file", help="Recorded frames (.npy with a 3D image array, or .npz with 'images', "
+                                           "'pulse_ids' and channel arrays).")
+    parser.add_argument("output_file", help="Output .npz file with the processed data.")
+
+    parser.add_argument("--roi_signal", type=int, nargs=4, default=[],
+                        help="Signal ROI: offset_x size_x offset_y size_y.")
+    parser.add_argument("--roi_background", type=int, nargs=4, default=[],
+                        help="Background ROI: offset_x size_x offset_y size_y.")
+
+    parser.add_argument("--background_mode", default=config.DEFAULT_BACKGROUND_MODE, choices=BACKGROUND_MODES,
+                        help="Background estimation from the non FEL shots.")
+    parser.add_argument("--background_depth", type=int, default=config.DEFAULT_BACKGROUND_DEPTH,
+                        help="Number of non FEL shots used for the background.")
+
+    parser.add_argument("--shot_classifier_mode", default=config.DEFAULT_SHOT_CLASSIFIER_MODE,
+                        choices=SHOT_CLASSIFIER_MODES, help="How FEL shots are told apart from background shots.")
+    parser.add_argument("--fel_period", type=int, default=config.DEFAULT_FEL_PERIOD,
+                        help="FEL shots are the pulse ids with pulse_id %% fel_period == fel_phase ('modulo' mode).")
+    parser.add_argument("--fel_phase", type=int, default=config.DEFAULT_FEL_PHASE,
+                        help="Phase of the FEL shots ('modulo' mode).")
+    parser.add_argument("--fel_channel", help="Channel array of the input file which is true for FEL shots "
+                                              "('channel' mode).")
+    parser.add_argument("--fel_event_code", type=int,
+                        help="Index of the FEL event code, if the FEL channel is an event code array.")
+    parser.add_argument("--fel_intensity_threshold", type=float,
+                        help="Signal ROI intensity above which a shot is a FEL shot ('intensity' mode).")
+
+    parser.add_argument("--step_length", type=int, default=config.DEFAULT_EDGE_STEP_LENGTH,
+                        help="Length of the step searched for, in pixels.")
+    parser.add_argument("--edge_type", default=config.DEFAULT_EDGE_TYPE, choices=EDGE_TYPES, help="Type of the edge.")
+    parser.add_argument("--refinement", type=float, default=config.DEFAULT_EDGE_REFINEMENT,
+                        help="Sub-pixel step of the edge search.")
+    parser.add_argument("--peak_fit", default=config.DEFAULT_EDGE_PEAK_FIT, choices=PEAK_FITS,
+                        help="Fit the cross-correlation maximum for sub-pixel edge positions, instead of refining the "
+                             "profiles.")
+
+    parser.add_argument("--chunk_size", type=int, default=config.BATCH_CHUNK_SIZE,
+                        help="Maximum number of frames processed at once.")
+    parser.add_argument("--log_level", default=config.DEFAULT_LOGGING_LEVEL,
+                        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+                        help="Log level to use.")
+
+    arguments = parser.parse_args()
+
+    logging.basicConfig(level=arguments.log_level)
+
+    pulse_ids, images, channels = load_frames(arguments.input_file)
+    _logger.info("Loaded %d frames of shape %s from %s.", len(images), images.shape[1:], arguments.input_file)
+
+    result = process_batch(pulse_ids=pulse_ids,
+                           images=images,
+                           roi_signal=arguments.roi_signal,
+                           roi_background=arguments.roi_background,
+                           background_parameters={"mode": arguments.background_mode,
+                                                  "depth": arguments.background_depth},
+                           shot_classifier={"mode": arguments.shot_classifier_mode,
+                                            "period": arguments.fel_period,
+                                            "phase": arguments.fel_phase,
+                                            "channel": arguments.fel_channel,
+                                            "event_code": arguments.fel_event_code,
+                                            "threshold": arguments.fel_intensity_threshold},
+                           channels=channels,
+                           step_length=arguments.step_length,
+                           edge_type=arguments.edge_type,
+                           refinement=arguments.refinement,
+                           peak_fit=arguments.peak_fit,
+                           chunk_size=arguments.chunk_size)
+
+    np.savez(arguments.output_file, **result)
+    _logger.info("Saved the processed data to %s.", arguments.output_file)
+
+
+if __name__ == "__main__":
+    main()
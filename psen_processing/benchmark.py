@@ -0,0 +1,463 @@
+import argparse
+import json
+import math
+import tracemalloc
+from threading import Thread
+from time import monotonic, sleep
+from timeit import repeat
+
+import numpy as np
+
+from bsread import PULL, source
+from bsread.sender import sender
+from psen_processing import config
+from psen_processing.background import BackgroundModel
+from psen_processing.batch import load_frames
+from psen_processing.edge_finder import PEAK_FITS, find_edge
+from psen_processing.manager import ProcessingManager
+from psen_processing.metrics import ProcessingMetrics
+from psen_processing.processor import get_stream_processor, process_batch, process_frame
+from psen_processing.profiles import ProfileEngine, get_roi_x_profile
+from psen_processing.rois import RoiConfig
+
+# Stages of the compute stage, timed by process_frame.
+COMPUTE_STAGES = ("profiles", "background", "edge_finding")
+
+BENCHMARK_SUITES = ("profiles", "find_edge", "edge_refinement", "process_image", "process_batch", "stream_processor")
+
+
+def time_function(function, n_iterations):
+    """
+    Time the function.
+    :return: Dictionary with the mean and min time per call, in microseconds.
+    """
+    function()
+
+    timings = np.array(repeat(function, number=1, repeat=n_iterations)) * 1e6
+
+    return {"mean_us": float(timings.mean()),
+            "min_us": float(timings.min())}
+
+
+def get_latency_statistics(timings):
+    """
+    Summarize latencies.
+    :param timings: Latencies in seconds.
+    :return: Dictionary with the mean, percentiles and maximum, in microseconds.
+    """
+    timings = np.asarray(timings, dtype=float) * 1e6
+
+    if len(timings) == 0:
+        return {}
+
+    return {"mean_us": float(timings.mean()),
+            "p50_us": float(np.percentile(timings, 50)),
+            "p90_us": float(np.percentile(timings, 90)),
+            "p99_us": float(np.percentile(timings, 99)),
+            "max_us": float(timings.max())}
+
+
+def get_synthetic_frames(n_frames, image_shape, dtype, roi_signal, fel_period=config.DEFAULT_FEL_PERIOD):
+    """
+    Generate noise images with a falling step in the signal ROI of every FEL shot (pulse_id % fel_period == 0).
+    :return: Tuple (pulse_ids, images).
+    """
+    random = np.random.RandomState(0)
+
+    images = np.empty((n_frames,) + tuple(image_shape), dtype=dtype)
+    for image in images:
+        image[:] = random.randint(0, 100, size=image_shape, dtype="uint8")
+
+    if roi_signal:
+        offset_x, size_x, offset_y, size_y = roi_signal
+
+        for index in range(0, n_frames, fel_period):
+            edge_position = offset_x + random.randint(size_x // 4, max(size_x * 3 // 4, size_x // 4 + 1))
+            images[index, offset_y:offset_y + size_y, offset_x:edge_position] += 100
+
+    return np.arange(n_frames), images
+
+
+def measure_allocations(function):
+    """
+    Run the function once while tracing the memory allocations.
+    :return: Dictionary with the allocated and peak memory during the call, in bytes.
+    """
+    tracemalloc.start()
+
+    try:
+        start_memory, _ = tracemalloc.get_traced_memory()
+
+        function()
+
+        end_memory, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"retained_bytes": end_memory - start_memory,
+            "peak_bytes": peak_memory - start_memory}
+
+
+def benchmark_profiles(image_shape, dtype, roi_signal, roi_background, n_iterations):
+    """
+    Compare the X profiles of the signal and background ROIs computed with get_roi_x_profile and with ProfileEngine.
+    """
+    image = np.random.randint(0, 4096, size=image_shape).astype(dtype)
+    profile_engine = ProfileEngine()
+
+    def reference():
+        return get_roi_x_profile(image, roi_signal), get_roi_x_profile(image, roi_background)
+
+    def engine():
+        return profile_engine.get_x_profiles(image, [roi_signal, roi_background])
+
+    return {"parameters": {"image_shape": list(image_shape),
+                           "dtype": dtype,
+                           "roi_signal": roi_signal,
+                           "roi_background": roi_background,
+                           "n_iterations": n_iterations},
+            "get_roi_x_profile": time_function(reference, n_iterations),
+            "profile_engine": time_function(engine, n_iterations)}
+
+
+def benchmark_find_edge(profiles, step_length, refinement, n_iterations):
+    """
+    Time the edge finding on single profiles, as in the live processing, and on all the profiles at once.
+    """
+    profiles = np.asarray(profiles, dtype=float)
+
+    timings = []
+    for _ in range(n_iterations):
+        for profile in profiles:
+            start_time = monotonic()
+            find_edge(profile, step_length=step_length, refinement=refinement)
+            timings.append(monotonic() - start_time)
+
+    batch = time_function(lambda: find_edge(profiles, step_length=step_length, refinement=refinement), n_iterations)
+
+    return {"parameters": {"n_profiles": len(profiles),
+                           "profile_length": profiles.shape[1],
+                           "step_length": step_length,
+                           "refinement": refinement,
+                           "n_iterations": n_iterations},
+            "single_profile": get_latency_statistics(timings),
+            "single_profile_per_second": len(timings) / float(np.sum(timings)),
+            "batch": batch,
+            "batch_profiles_per_second": len(profiles) / (batch["mean_us"] * 1e-6),
+            "allocations": measure_allocations(lambda: find_edge(profiles[0], step_length=step_length,
+                                                                 refinement=refinement))}
+
+
+def get_synthetic_edges(n_profiles, profile_length, edge_width, noise, edge_type="falling"):
+    """
+    Generate profiles with a step of height 1 at a random sub-pixel position, blurred by a Gaussian of sigma edge_width,
+    with Gaussian noise. The edge position follows the find_edge convention: a sharp falling step at position e has
+    profile[:e] high.
+    :return: Tuple (profiles, edge positions).
+    """
+    random = np.random.RandomState(0)
+
+    edge_positions = random.uniform(profile_length / 4, profile_length * 3 / 4, n_profiles)
+
+    x = np.arange(profile_length) - (edge_positions[:, np.newaxis] - 0.5)
+    profiles = 0.5 * np.vectorize(math.erfc)(x / (max(edge_width, 1e-6) * math.sqrt(2)))
+
+    if edge_type == "rising":
+        profiles = 1 - profiles
+
+    profiles += random.normal(scale=noise, size=profiles.shape)
+
+    return profiles, edge_positions
+
+
+def benchmark_edge_refinement(profile_length, step_length, edge_width, noise, refinements, n_iterations,
+                              n_profiles=100):
+    """
+    Compare the accuracy and the speed of the sub-pixel edge finding: correlating profiles interpolated on each
+    refinement grid, and correlating at the native resolution with each peak fit.
+    """
+    profiles, edge_positions = get_synthetic_edges(n_profiles, profile_length, edge_width, noise)
+
+    methods = [("refinement_%g" % refinement, {"refinement": refinement}) for refinement in refinements]
+    methods += [(peak_fit, {"peak_fit": peak_fit}) for peak_fit in PEAK_FITS]
+
+    results = {}
+
+    for name, parameters in methods:
+        errors = find_edge(profiles, step_length=step_length, **parameters)["edge_pos"] - edge_positions
+        timing = time_function(lambda: find_edge(profiles, step_length=step_length, **parameters), n_iterations)
+
+        results[name] = {"rms_error": float(np.sqrt(np.mean(errors ** 2))),
+                         "max_error": float(np.max(np.abs(errors))),
+                         "bias": float(np.mean(errors)),
+                         "profiles_per_second": n_profiles / (timing["mean_us"] * 1e-6)}
+
+    return {"parameters": {"n_profiles": n_profiles,
+                           "profile_length": profile_length,
+                           "step_length": step_length,
+                           "edge_width": edge_width,
+                           "noise": noise,
+                           "n_iterations": n_iterations},
+            "methods": results}
+
+
+def benchmark_process_image(pulse_ids, images, roi_signal, roi_background, n_iterations):
+    """
+    Replay the frames through process_frame, as the compute stage does, with the latency of its stages (ROI profiles,
+    background and edge finding) recorded in the ProcessingMetrics histograms.
+    """
+    image_property_name = "BENCHMARK" + config.EPICS_PV_SUFFIX_IMAGE
+    roi_config = RoiConfig(roi_signal, roi_background)
+
+    metrics = ProcessingMetrics()
+    total_timings = []
+
+    for _ in range(n_iterations):
+        background = BackgroundModel()
+        roi_backgrounds = {}
+
+        for pulse_id, image in zip(pulse_ids, images):
+            start_time = monotonic()
+            process_frame(pulse_id, image, image_property_name, roi_config, background, metrics=metrics,
+                          roi_backgrounds=roi_backgrounds)
+            total_timings.append(monotonic() - start_time)
+
+    background = BackgroundModel()
+
+    def process_all():
+        for pulse_id, image in zip(pulse_ids, images):
+            process_frame(pulse_id, image, image_property_name, roi_config, background)
+
+    allocations = measure_allocations(process_all)
+
+    return {"parameters": {"n_frames": len(images),
+                           "image_shape": list(images.shape[1:]),
+                           "dtype": str(images.dtype),
+                           "roi_signal": roi_signal,
+                           "roi_background": roi_background,
+                           "n_iterations": n_iterations},
+            "frames_per_second": len(total_timings) / float(np.sum(total_timings)),
+            "latency": get_latency_statistics(total_timings),
+            "stages": {stage: metrics.latency[stage].get_summary() for stage in COMPUTE_STAGES},
+            "allocations_per_frame": {name: value // max(len(images), 1) for name, value in allocations.items()}}
+
+
+def benchmark_process_batch(pulse_ids, images, roi_signal, roi_background, step_length, refinement, n_iterations):
+    """
+    Time the batch processing of all the frames.
+    """
+    def process():
+        process_batch(pulse_ids, images, roi_signal, roi_background, step_length=step_length, refinement=refinement)
+
+    timing = time_function(process, n_iterations)
+
+    return {"parameters": {"n_frames": len(images),
+                           "step_length": step_length,
+                           "refinement": refinement,
+                           "n_iterations": n_iterations},
+            "batch": timing,
+            "frames_per_second": len(images) / (timing["mean_us"] * 1e-6),
+            "allocations": measure_allocations(process)}
+
+
+def benchmark_stream_processor(pulse_ids, images, roi_signal, roi_background, n_frames, rate, n_workers,
+                               input_stream_port, data_output_stream_port, image_output_stream_port,
+                               receive_timeout=5):
+    """
+    Replay the frames through a stream processor (created with get_stream_processor) over local bsread streams, and
+    measure the end to end throughput and latency (from sending the frame to receiving the processed data).
+    :param n_frames: Number of frames to send - the given frames are repeated as needed.
+    :param rate: Sending rate in Hz, 0 to send as fast as possible.
+    """
+    image_property_name = "BENCHMARK" + config.EPICS_PV_SUFFIX_IMAGE
+
+    stream_processor = get_stream_processor(input_stream_host="localhost",
+                                            input_stream_port=input_stream_port,
+                                            data_output_stream_port=data_output_stream_port,
+                                            image_output_stream_port=image_output_stream_port,
+                                            epics_pv_name_prefix="BENCHMARK",
+                                            n_workers=n_workers)
+
+    manager = ProcessingManager(stream_processor, roi_signal=roi_signal, roi_background=roi_background,
+                                image_forwarding_parameters={"mode": "off"})
+
+    # The pulse ids of repeated frames are shifted by a multiple of the FEL period, to keep the FEL/background pattern.
+    pulse_id_span = int(np.max(pulse_ids) - np.min(pulse_ids)) + 1
+    pulse_id_span += -pulse_id_span % config.DEFAULT_FEL_PERIOD
+
+    send_times = {}
+
+    def send_frames():
+        with sender(port=input_stream_port) as input_stream:
+            start_time = monotonic()
+
+            for index in range(n_frames):
+                if rate:
+                    sleep(max(0.0, start_time + index / rate - monotonic()))
+
+                pulse_id = int(pulse_ids[index % len(images)]) + (index // len(images)) * pulse_id_span
+
+                send_times[pulse_id] = monotonic()
+                input_stream.send(pulse_id=pulse_id, data={image_property_name: images[index % len(images)]})
+
+    receive_times = {}
+
+    manager.start()
+
+    try:
+        with source(host="localhost", port=data_output_stream_port, mode=PULL,
+                    receive_timeout=int(receive_timeout * 1000)) as output_stream:
+
+            send_thread = Thread(target=send_frames)
+            send_thread.start()
+
+            while len(receive_times) < n_frames:
+                message = output_stream.receive()
+
+                if message is None:
+                    break
+
+                receive_times[message.data.pulse_id] = monotonic()
+
+            send_thread.join()
+
+    finally:
+        manager.stop()
+
+    latencies = [receive_times[pulse_id] - send_times[pulse_id] for pulse_id in receive_times if pulse_id in send_times]
+
+    duration = max(receive_times.values()) - min(send_times.values()) if receive_times else 0
+
+    return {"parameters": {"n_frames": n_frames,
+                           "image_shape": list(images.shape[1:]),
+                           "dtype": str(images.dtype),
+                           "roi_signal": roi_signal,
+                           "roi_background": roi_background,
+                           "rate": rate,
+                           "n_workers": n_workers},
+            "n_received": len(receive_times),
+            "frames_per_second": len(receive_times) / duration if duration else 0,
+            "latency": get_latency_statistics(latencies),
+            "statistics": manager.get_statistics()}
+
+
+def compare_results(results, baseline):
+    """
+    Compare the throughputs of two benchmark results.
+    :return: Dictionary {suite: {metric: new / old}} for all the "..._per_second" metrics present in both.
+    """
+    comparison = {}
+
+    for suite, suite_results in results.items():
+        if not isinstance(suite_results, dict) or not isinstance(baseline.get(suite), dict):
+            continue
+
+        for metric, value in suite_results.items():
+            old_value = baseline[suite].get(metric)
+
+            if metric.endswith("per_second") and old_value:
+                comparison.setdefault(suite, {})[metric] = value / old_value
+
+    return comparison
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PSEN processing benchmarks.')
+
+    parser.add_argument("--suites", nargs="+", default=["profiles"], choices=BENCHMARK_SUITES + ("all",),
+                        help="Benchmarks to run.")
+
+    parser.add_argument("--image_shape", type=int, nargs=2, default=[2160, 2560], help="Image height and width.")
+    parser.add_argument("--dtype", default="uint16", help="Image dtype.")
+    parser.add_argument("--roi_signal", type=int, nargs=4, default=[0, 2560, 800, 400],
+                        help="Signal ROI: offset_x size_x offset_y size_y.")
+    parser.add_argument("--roi_background", type=int, nargs=4, default=[0, 2560, 1000, 400],
+                        help="Background ROI: offset_x size_x offset_y size_y.")
+    parser.add_argument("--iterations", type=int, default=100, help="Number of timed iterations.")
+
+    parser.add_argument("--input_file", help="Replay recorded frames (.npy or .npz, see psen_processing_batch) "
+                                             "instead of synthetic ones.")
+    parser.add_argument("--n_frames", type=int, default=16, help="Number of synthetic frames.")
+    parser.add_argument("--step_length", type=int, default=50, help="Step length of the edge finding.")
+    parser.add_argument("--refinement", type=float, default=1, help="Refinement of the edge finding.")
+
+    parser.add_argument("--refinements", type=float, nargs="+", default=[1, 0.1],
+                        help="Refinements compared with the peak fits in the edge_refinement benchmark.")
+    parser.add_argument("--edge_width", type=float, default=5,
+                        help="Sigma (pixels) of the blur of the synthetic edges of the edge_refinement benchmark.")
+    parser.add_argument("--edge_noise", type=float, default=0.01,
+                        help="Noise (relative to the edge height) of the synthetic edges of the edge_refinement "
+                             "benchmark.")
+
+    parser.add_argument("--stream_frames", type=int, default=1000, help="Frames sent to the stream processor.")
+    parser.add_argument("--stream_rate", type=float, default=100, help="Rate (Hz) of the frames sent to the stream "
+                                                                       "processor, 0 for as fast as possible.")
+    parser.add_argument("--n_workers", type=int, default=config.DEFAULT_N_WORKERS,
+                        help="Workers of the stream processor.")
+    parser.add_argument("--ports", type=int, nargs=3, default=[12000, 12001, 12002],
+                        help="Input, data output and image output stream ports of the stream processor.")
+
+    parser.add_argument("--output", help="Also save the results to this JSON file.")
+    parser.add_argument("--compare", help="JSON file with earlier results to compare the throughputs with.")
+
+    arguments = parser.parse_args()
+
+    suites = BENCHMARK_SUITES if "all" in arguments.suites else arguments.suites
+
+    if arguments.input_file:
+        pulse_ids, images, _ = load_frames(arguments.input_file)
+    else:
+        pulse_ids, images = get_synthetic_frames(arguments.n_frames, arguments.image_shape, arguments.dtype,
+                                                 arguments.roi_signal)
+
+    results = {}
+
+    if "profiles" in suites:
+        results["profiles"] = benchmark_profiles(image_shape=tuple(arguments.image_shape),
+                                                 dtype=arguments.dtype,
+                                                 roi_signal=arguments.roi_signal,
+                                                 roi_background=arguments.roi_background,
+                                                 n_iterations=arguments.iterations)
+
+    if "find_edge" in suites:
+        profiles = [get_roi_x_profile(image, arguments.roi_signal) for image in images]
+        results["find_edge"] = benchmark_find_edge(profiles, arguments.step_length, arguments.refinement,
+                                                   max(arguments.iterations // len(images), 1))
+
+    if "edge_refinement" in suites:
+        results["edge_refinement"] = benchmark_edge_refinement(images.shape[2], arguments.step_length,
+                                                               arguments.edge_width, arguments.edge_noise,
+                                                               arguments.refinements, arguments.iterations)
+
+    if "process_image" in suites:
+        results["process_image"] = benchmark_process_image(pulse_ids, images, arguments.roi_signal,
+                                                           arguments.roi_background,
+                                                           max(arguments.iterations // len(images), 1))
+
+    if "process_batch" in suites:
+        results["process_batch"] = benchmark_process_batch(pulse_ids, images, arguments.roi_signal,
+                                                           arguments.roi_background, arguments.step_length,
+                                                           arguments.refinement,
+                                                           max(arguments.iterations // len(images), 1))
+
+    if "stream_processor" in suites:
+        input_stream_port, data_output_stream_port, image_output_stream_port = arguments.ports
+        results["stream_processor"] = benchmark_stream_processor(pulse_ids, images, arguments.roi_signal,
+                                                                 arguments.roi_background, arguments.stream_frames,
+                                                                 arguments.stream_rate, arguments.n_workers,
+                                                                 input_stream_port, data_output_stream_port,
+                                                                 image_output_stream_port)
+
+    if arguments.compare:
+        with open(arguments.compare) as input_file:
+            results["comparison"] = compare_results(results, json.load(input_file))
+
+    if arguments.output:
+        with open(arguments.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+    print(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os
+import tempfile
+from logging import getLogger
+
+import numpy as np
+
+from psen_processing import config
+
+_logger = getLogger(__name__)
+
+CALIBRATION_TYPES = ("dark", "flat")
+
+
+def get_calibration_filename(directory, calibration_type):
+    return os.path.join(directory, calibration_type + ".npy")
+
+
+def load_calibration_frames(directory):
+    """
+    Load the persisted calibration frames, memory mapped.
+    :param directory: Calibration directory, None if the frames are not persisted.
+    :return: Dictionary {calibration type: frame} with the frames found.
+    """
+    frames = {}
+
+    if directory is None:
+        return frames
+
+    for calibration_type in CALIBRATION_TYPES:
+        filename = get_calibration_filename(directory, calibration_type)
+
+        if os.path.exists(filename):
+            frames[calibration_type] = np.load(filename, mmap_mode="r")
+            _logger.info("Loaded %s frame of shape %s from %s.", calibration_type, frames[calibration_type].shape,
+                         filename)
+
+    return frames
+
+
+def save_calibration_frame(directory, calibration_type, frame):
+    """
+    Save the calibration frame and load it back memory mapped.
+
+    The frame is written to a temporary file which then replaces the previous one: the active calibration maps the
+    previous file, which must not be truncated while the processing reads it.
+    :return: Memory mapped frame.
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = get_calibration_filename(directory, calibration_type)
+
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=calibration_type + ".", suffix=".npy.tmp",
+                                     delete=False) as temporary_file:
+        try:
+            np.save(temporary_file, frame)
+        except Exception:
+            os.remove(temporary_file.name)
+            raise
+
+    os.replace(temporary_file.name, filename)
+    _logger.info("Saved %s frame to %s.", calibration_type, filename)
+
+    return np.load(filename, mmap_mode="r")
+
+
+class Calibration(object):
+    """
+    Immutable dark and flat field correction: corrected = (raw - dark) * gain, with the gain normalizing the flat field
+    (minus the dark) to its mean. Like the ROI config, a change creates a new Calibration which replaces the old one.
+
+    The correction is applied only to the image blocks summed for the ROIs, never to the whole image.
+    """
+
+    __slots__ = ("dark", "flat", "enabled", "gain", "shape")
+
+    def __init__(self, dark=None, flat=None, enabled=True):
+        """
+        :param dark: Dark frame, None to not subtract a dark.
+        :param flat: Flat field frame (including the dark), None to not correct the pixel gain.
+        :param enabled: False to process the raw images.
+        """
+        set_attribute = super(Calibration, self).__setattr__
+
+        set_attribute("dark", dark)
+        set_attribute("flat", flat)
+        set_attribute("enabled", enabled)
+
+        gain = None
+
+        if flat is not None:
+            response = np.asarray(flat, dtype=config.CALIBRATION_DTYPE)
+
+            if dark is not None and dark.shape == flat.shape:
+                response = response - dark
+
+            # Pixels without response (dead pixels) get no signal.
+            valid = response > 0
+            gain = np.zeros(response.shape, dtype=config.CALIBRATION_DTYPE)
+
+            if valid.any():
+                np.divide(response[valid].mean(), response, out=gain, where=valid)
+
+        set_attribute("gain", gain)
+
+        shapes = set(frame.shape for frame in (dark, flat) if frame is not None)
+        set_attribute("shape", shapes.pop() if len(shapes) == 1 else None)
+
+    def is_active(self, image_shape):
+        """
+        Check if the correction applies to images of the given shape.
+        """
+        return self.enabled and self.shape is not None and self.shape == image_shape
+
+    def correct(self, block, rows, columns, out):
+        """
+        Correct a block of the image.
+        :param block: Raw pixels image[rows, columns].
+        :param out: Array of the block shape and CALIBRATION_DTYPE for the corrected pixels.
+        :return: out.
+        """
+        if self.dark is not None:
+            np.subtract(block, self.dark[rows, columns], out=out, dtype=out.dtype)
+        else:
+            out[:] = block
+
+        if self.gain is not None:
+            np.multiply(out, self.gain[rows, columns], out=out)
+
+        return out
+
+    def replace(self, **changes):
+        """
+        Get a new calibration with the given dark, flat and/or enabled changed.
+        """
+        return Calibration(dark=changes.get("dark", self.dark),
+                           flat=changes.get("flat", self.flat),
+                           enabled=changes.get("enabled", self.enabled))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Calibration is immutable, use replace to change it.")
+
+
+class CalibrationRecorder(object):
+    """
+    Averages the next images of the input stream into a calibration frame. Fed by the receive stage only.
+    """
+
+    def __init__(self, calibration_type, n_frames, on_complete):
+        """
+        :param calibration_type: One of CALIBRATION_TYPES.
+        :param n_frames: Number of images to average.
+        :param on_complete: Function called with (calibration type, frame) when all the images are recorded.
+        """
+        self.calibration_type = calibration_type
+        self.n_frames = n_frames
+        self.on_complete = on_complete
+
+        self.frame_sum = None
+        self.n_recorded = 0
+
+    @property
+    def done(self):
+        return self.n_recorded >= self.n_frames
+
+    def add(self, image):
+
+        if self.frame_sum is None or self.frame_sum.shape != image.shape:
+
+            if self.frame_sum is not None:
+                _logger.warning("Image shape changed to %s while recording the %s frame, restarting the recording.",
+                                image.shape, self.calibration_type)
+
+            self.frame_sum = np.zeros(image.shape, dtype="float64")
+            self.n_recorded = 0
+
+        self.frame_sum += image
+        self.n_recorded += 1
+
+        if self.done:
+            frame = (self.frame_sum / self.n_recorded).astype(config.CALIBRATION_DTYPE)
+            self.frame_sum = None
+
+            self.on_complete(self.calibration_type, frame)
+
+    def get_status(self):
+        return {"type": self.calibration_type,
+                "n_frames": self.n_frames,
+                "n_recorded": self.n_recorded}
@@ -0,0 +1,101 @@
+from logging import getLogger
+from time import time
+
+from psen_processing import config
+
+_logger = getLogger(__name__)
+
+CATCH_UP_MODES = ("off", "newest", "fel")
+
+
+def get_message_lag(timestamp, now=None):
+    """
+    Get the time since a message was acquired.
+    :param timestamp: Message timestamp (seconds, nanoseconds), with None values if the message has no timestamp.
+    :return: Lag in seconds, None if the message has no timestamp.
+    """
+    seconds, nanoseconds = timestamp
+
+    if seconds is None:
+        return None
+
+    return (time() if now is None else now) - seconds - (nanoseconds or 0) * 1e-9
+
+
+class CatchUp(object):
+    """
+    Detects when the processing falls behind the input stream, and skips frames in the receive stage until it caught
+    up, so the results stay fresh instead of complete.
+
+    The processing is behind when the compute queue is full, or when the lag of the input messages exceeds max_lag.
+    The lag is measured relative to the smallest lag seen since the start, so a constant offset between the clock of
+    the camera and the clock of this host is not counted as lag. The catch up ends when the queue is not full and the
+    lag is back under CATCH_UP_RESUME_LAG_FRACTION of max_lag. Used by the receive stage only.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.min_lag = None
+
+        self.lag = None
+        self.n_activations = 0
+        self.n_skipped = 0
+        self.last_skipped_pulse_id = None
+
+    def process(self, pulse_id, lag, queue_full, fel_shot, catch_up_parameters):
+        """
+        Decide if a received frame is processed.
+        :param lag: Time since the frame was acquired, see get_message_lag. None if not known.
+        :param queue_full: True if the compute queue is full.
+        :param fel_shot: Classification of the frame, None if it cannot be classified before the processing.
+        :param catch_up_parameters: Dictionary {"mode": one of CATCH_UP_MODES, "max_lag": seconds}:
+        - off: all the frames are processed.
+        - newest: no frame is processed while catching up, the processing resumes with the newest frames.
+        - fel: only the FEL shots are processed while catching up.
+        :return: True if the frame is processed, False if it is skipped.
+        """
+        if lag is not None:
+            if self.min_lag is None or lag < self.min_lag:
+                self.min_lag = lag
+
+            lag -= self.min_lag
+
+        self.lag = lag
+
+        mode = catch_up_parameters["mode"]
+
+        if mode == "off":
+            self.active = False
+            return True
+
+        max_lag = catch_up_parameters["max_lag"]
+
+        if not self.active:
+            if queue_full or (lag is not None and lag > max_lag):
+                self.active = True
+                self.n_activations += 1
+                _logger.warning("Processing is behind the input stream (lag %s s, compute queue full %s) at pulse_id "
+                                "%s, catching up in mode '%s'.", lag, queue_full, pulse_id, mode)
+
+        elif not queue_full and (lag is None or lag <= max_lag * config.CATCH_UP_RESUME_LAG_FRACTION):
+            self.active = False
+            _logger.info("Processing caught up with the input stream at pulse_id %s, skipped %d frames so far.",
+                         pulse_id, self.n_skipped)
+
+        if not self.active or (mode == "fel" and fel_shot):
+            return True
+
+        self.n_skipped += 1
+        self.last_skipped_pulse_id = pulse_id
+
+        return False
+
+    def get_summary(self):
+        """
+        Get the catch up state as a JSON serializable dictionary, to merge into the statistics.
+        """
+        return {"catch_up_active": self.active,
+                "catch_up_activations": self.n_activations,
+                "skipped_pulse_ids": self.n_skipped,
+                "last_skipped_pulse_id": self.last_skipped_pulse_id,
+                "input_lag": self.lag}
@@ -0,0 +1,131 @@
+from logging import getLogger
+
+import numpy as np
+
+_logger = getLogger(__name__)
+
+SHOT_CLASSIFIER_MODES = ("modulo", "channel", "intensity")
+
+# Channels already reported as array channels without event code, to log it only once per channel.
+_unclassifiable_channels = set()
+
+
+def _log_array_channel(channel_name):
+    if channel_name not in _unclassifiable_channels:
+        _unclassifiable_channels.add(channel_name)
+        _logger.warning("Shot classifier channel '%s' holds arrays but no event code is set, the shots are not "
+                        "classified.", channel_name)
+
+
+def get_classifier_channels(shot_classifier):
+    """
+    Get the input stream channels the shot classifier needs from each message.
+    :param shot_classifier: Shot classifier parameters.
+    :return: List of channel names.
+    """
+    if shot_classifier["mode"] == "channel":
+        return [shot_classifier["channel"]]
+
+    return []
+
+
+def classify_shot(pulse_id, signal_profile, channels, shot_classifier):
+    """
+    Decide if the image is a FEL shot (edge finding) or a background shot (background estimation).
+    :param pulse_id: Pulse id of the image.
+    :param signal_profile: X profile of the signal ROI, None if the signal ROI is not set.
+    :param channels: Dictionary {channel name: value} with the input channels of the message.
+    :param shot_classifier: Dictionary with the classifier parameters:
+    - modulo: FEL shot if pulse_id % period == phase.
+    - channel: FEL shot if the value of the channel is true. For array channels (event code arrays), the element at
+    the index event_code is used - without event_code, the shots of array channels are not classified.
+    - intensity: FEL shot if the integrated intensity of the signal ROI is above the threshold.
+    :return: True for FEL shots, False for background shots, None if the shot cannot be classified (the channel or the
+    signal ROI is missing).
+    """
+    mode = shot_classifier["mode"]
+
+    if mode == "modulo":
+        return pulse_id % shot_classifier["period"] == shot_classifier["phase"]
+
+    elif mode == "channel":
+        value = channels.get(shot_classifier["channel"]) if channels else None
+
+        if value is None:
+            return None
+
+        event_code = shot_classifier["event_code"]
+
+        if event_code is not None:
+            value = np.asarray(value).ravel()
+
+            if event_code >= len(value):
+                return None
+
+            value = value[event_code]
+
+        elif np.size(value) != 1:
+            _log_array_channel(shot_classifier["channel"])
+            return None
+
+        return bool(value)
+
+    elif mode == "intensity":
+        if signal_profile is None:
+            return None
+
+        return bool(signal_profile.sum() > shot_classifier["threshold"])
+
+    raise ValueError("Shot classifier mode must be one of %s, but %s was given." % (SHOT_CLASSIFIER_MODES, mode))
+
+
+def classify_shots(pulse_ids, signal_profiles, channels, shot_classifier):
+    """
+    Classify a batch of images, the same way as classify_shot.
+    :param pulse_ids: Array of pulse ids.
+    :param signal_profiles: 2D array with the signal ROI X profiles (one per row), None if the signal ROI is not set.
+    :param channels: Dictionary {channel name: array with one value (or event code array) per image}.
+    :param shot_classifier: Shot classifier parameters.
+    :return: Tuple of boolean arrays (fel_shots, background_shots). Unclassified shots are False in both.
+    """
+    pulse_ids = np.asarray(pulse_ids)
+    unclassified = np.zeros(len(pulse_ids), dtype=bool)
+
+    mode = shot_classifier["mode"]
+
+    if mode == "modulo":
+        fel_shots = pulse_ids % shot_classifier["period"] == shot_classifier["phase"]
+
+    elif mode == "channel":
+        values = channels.get(shot_classifier["channel"]) if channels else None
+
+        if values is None:
+            return unclassified, unclassified.copy()
+
+        values = np.asarray(values)
+        event_code = shot_classifier["event_code"]
+
+        if event_code is not None:
+            values = values.reshape(len(pulse_ids), -1)
+
+            if event_code >= values.shape[1]:
+                return unclassified, unclassified.copy()
+
+            values = values[:, event_code]
+
+        elif values.size != len(pulse_ids):
+            _log_array_channel(shot_classifier["channel"])
+            return unclassified, unclassified.copy()
+
+        fel_shots = values.reshape(len(pulse_ids)).astype(bool)
+
+    elif mode == "intensity":
+        if signal_profiles is None:
+            return unclassified, unclassified.copy()
+
+        fel_shots = signal_profiles.sum(axis=1) > shot_classifier["threshold"]
+
+    else:
+        raise ValueError("Shot classifier mode must be one of %s, but %s was given." % (SHOT_CLASSIFIER_MODES, mode))
+
+    return fel_shots, ~fel_shots
@@ -9,12 +9,91 @@ DEFAULT_IMAGE_OUTPUT_STREAM_PORT = 8889
 DEFAULT_ROI_SIGNAL = None
 DEFAULT_ROI_BACKGROUND = None
 
+# Defaults of the named ROIs parameters not given.
+DEFAULT_ROI_PROJECTION = "x"
+DEFAULT_ROI_EDGE_FINDING = False
+DEFAULT_ROI_MOMENTS = False
+
+# What to do with ROIs which do not fit in the image: "reject" or "clip" them.
+DEFAULT_ROI_BOUNDS_POLICY = "reject"
+
 PROCESSOR_START_TIMEOUT = 1
 
 INPUT_STREAM_QUEUE_SIZE = 100
 INPUT_STREAM_RECEIVE_TIMEOUT = 1
+# Decode only the input channels used by the processing, instead of all the channels of each message.
+DEFAULT_RAW_RECEIVE = True
 
 DATA_OUTPUT_STREAM_SEND_TIMEOUT = 1
 IMAGE_OUTPUT_STREAM_QUEUE_SIZE = 100
 
 EPICS_PV_SUFFIX_IMAGE = ":FPICTURE"
+
+# Kernels with more taps than this are correlated via FFT instead of directly.
+EDGE_FINDER_FFT_THRESHOLD = 24
+EDGE_FINDER_CACHE_SIZE = 32
+# Defaults of the edge finder parameters, and smallest refinement allowed in the live processing.
+DEFAULT_EDGE_STEP_LENGTH = 50
+DEFAULT_EDGE_TYPE = "falling"
+DEFAULT_EDGE_REFINEMENT = 1
+DEFAULT_EDGE_PEAK_FIT = None
+EDGE_FINDER_MIN_REFINEMENT = 0.01
+# Number of cross-correlation samples around the maximum fitted by the "parabolic" and "gaussian" peak fits (3 or 5).
+EDGE_FINDER_PEAK_FIT_POINTS = 3
+
+DEFAULT_BACKGROUND_MODE = "average"
+DEFAULT_BACKGROUND_DEPTH = 4
+BACKGROUND_MAX_DEPTH = 10000
+BACKGROUND_DTYPE = "float64"
+
+# Queues between the receive, compute and send stages of the stream processor.
+DEFAULT_PIPELINE_QUEUE_SIZE = 10
+DEFAULT_PIPELINE_DROP_POLICY = "block"
+PIPELINE_QUEUE_TIMEOUT = 0.1
+
+# Skip frames when the processing falls behind the input stream: "off", "newest" or "fel". The processing is behind
+# when the input message lag exceeds max_lag (seconds), and caught up when it is back under the resume fraction of it.
+DEFAULT_CATCH_UP_MODE = "off"
+DEFAULT_CATCH_UP_MAX_LAG = 1.0
+CATCH_UP_RESUME_LAG_FRACTION = 0.5
+
+# Queues in front of the data and image output streams, and ZMQ high-water mark (messages) of the data output stream.
+# Dropping the oldest results when an output is stuck keeps the processing going.
+DEFAULT_OUTPUT_QUEUE_SIZE = 10
+DEFAULT_OUTPUT_DROP_POLICY = "drop_oldest"
+DEFAULT_OUTPUT_HIGH_WATER_MARK = 100
+
+# Number of threads processing images in parallel, and maximum time a result waits for the results of earlier images.
+DEFAULT_N_WORKERS = 1
+DEFAULT_MAX_REORDER_LATENCY = 0.5
+
+PROFILE_CACHE_SIZE = 32
+# Accumulator for images which are not 8-32 bit integers.
+PROFILE_FLOAT_ACCUMULATOR_DTYPE = "float64"
+
+DEFAULT_IMAGE_FORWARDING_MODE = "all"
+DEFAULT_IMAGE_FORWARDING_DECIMATION = 10
+
+# Glob patterns of the input channels forwarded to the data output stream.
+DEFAULT_FORWARDED_CHANNELS = []
+CHANNEL_FORWARDING_CACHE_SIZE = 32
+
+# FEL shots are the pulse ids with pulse_id % period == phase, unless another shot classifier is selected.
+DEFAULT_SHOT_CLASSIFIER_MODE = "modulo"
+DEFAULT_FEL_PERIOD = 4
+DEFAULT_FEL_PHASE = 0
+
+# Upper bounds (seconds) of the latency histogram buckets of each processing stage.
+LATENCY_HISTOGRAM_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+# Windows (seconds) of the frame rates.
+STATISTICS_RATE_WINDOWS = (1, 10, 60)
+PROMETHEUS_METRICS_PREFIX = "psen_processing_"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Number of frames processed together by the batch processing, to bound the memory use.
+BATCH_CHUNK_SIZE = 100
+
+# Dark and flat field calibration frames: directory to persist them in (None to keep them in memory only).
+DEFAULT_CALIBRATION_DIRECTORY = None
+CALIBRATION_DTYPE = "float32"
+DEFAULT_CALIBRATION_N_FRAMES = 100
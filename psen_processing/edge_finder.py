@@ -0,0 +1,254 @@
+from functools import lru_cache
+
+import numpy as np
+
+from psen_processing import config
+
+EDGE_TYPES = ("falling", "rising")
+PEAK_FITS = ("parabolic", "gaussian")
+
+
+def get_default_edge_finder_parameters():
+    """
+    Get the default keyword arguments of find_edge in the live processing.
+    """
+    return {"step_length": config.DEFAULT_EDGE_STEP_LENGTH,
+            "edge_type": config.DEFAULT_EDGE_TYPE,
+            "refinement": config.DEFAULT_EDGE_REFINEMENT,
+            "peak_fit": config.DEFAULT_EDGE_PEAK_FIT}
+
+
+@lru_cache(maxsize=config.EDGE_FINDER_CACHE_SIZE)
+def get_refinement_grid(data_length, refinement):
+    """
+    Get the interpolation indices and weights to resample a profile on the refinement grid.
+    Resampling with them is equivalent to np.interp(np.arange(0, data_length - 1, refinement), ...).
+    :param data_length: Number of samples in the original profile.
+    :param refinement: Step of the refinement grid, in original samples.
+    :return: Lower sample indices, weights of the upper samples.
+    """
+    x = np.arange(0, data_length - 1, refinement)
+
+    lower_index = np.floor(x).astype(int)
+    upper_weight = x - lower_index
+
+    lower_index.flags.writeable = False
+    upper_weight.flags.writeable = False
+
+    return lower_index, upper_weight
+
+
+@lru_cache(maxsize=config.EDGE_FINDER_CACHE_SIZE)
+def get_step_kernel(step_length, edge_type, refinement):
+    """
+    Get the refined step waveform used to correlate with the profiles.
+    :param step_length: Length of the step, in original samples.
+    :param edge_type: 'rising' or 'falling'.
+    :param refinement: Step of the refinement grid, in original samples.
+    :return: Read only kernel array.
+    """
+    step_waveform = np.ones(shape=(step_length,))
+    if edge_type == 'rising':
+        step_waveform[: int(step_length / 2)] = -1
+    elif edge_type == 'falling':
+        step_waveform[int(step_length / 2):] = -1
+
+    step_waveform = np.interp(
+        x=np.arange(0, step_length - 1, refinement),
+        xp=np.arange(step_length),
+        fp=step_waveform,
+    )
+
+    step_waveform.flags.writeable = False
+
+    return step_waveform
+
+
+@lru_cache(maxsize=config.EDGE_FINDER_CACHE_SIZE)
+def get_fft_length(data_length):
+    """
+    Get the smallest 5-smooth length (2^a * 3^b * 5^c) not smaller than data_length, for fast FFTs.
+    """
+    fft_length = data_length
+
+    while True:
+        remainder = fft_length
+        for factor in (2, 3, 5):
+            while remainder % factor == 0:
+                remainder //= factor
+
+        if remainder == 1:
+            return fft_length
+
+        fft_length += 1
+
+
+@lru_cache(maxsize=config.EDGE_FINDER_CACHE_SIZE)
+def get_step_kernel_spectrum(step_length, edge_type, refinement, fft_length):
+    """
+    Get the conjugated spectrum of the step kernel, as used in the FFT cross-correlation.
+    """
+    kernel = get_step_kernel(step_length, edge_type, refinement)
+
+    spectrum = np.conj(np.fft.rfft(kernel, n=fft_length))
+    spectrum.flags.writeable = False
+
+    return spectrum
+
+
+def refine_profiles(data, refinement):
+    """
+    Linearly interpolate all the profiles (rows of data) on the refinement grid in one operation.
+    :param data: 2D array of profiles.
+    :param refinement: Step of the refinement grid, in original samples.
+    :return: 2D array of refined profiles.
+    """
+    if refinement == 1:
+        return data[:, :-1]
+
+    lower_index, upper_weight = get_refinement_grid(data.shape[1], refinement)
+
+    lower_values = data.take(lower_index, axis=1)
+    upper_values = data.take(lower_index + 1, axis=1)
+
+    upper_values -= lower_values
+    upper_values *= upper_weight
+    upper_values += lower_values
+
+    return upper_values
+
+
+def correlate_profiles(data, step_length, edge_type, refinement):
+    """
+    Cross-correlate all the (refined) profiles with the step kernel, equivalent to np.correlate(mode='valid') per row.
+    Short kernels are correlated directly, longer ones via FFT.
+    :return: 2D array of cross-correlations.
+    """
+    kernel = get_step_kernel(step_length, edge_type, refinement)
+
+    n_taps = len(kernel)
+    n_points = data.shape[1] - n_taps + 1
+
+    if n_taps > config.EDGE_FINDER_FFT_THRESHOLD:
+        fft_length = get_fft_length(data.shape[1])
+        kernel_spectrum = get_step_kernel_spectrum(step_length, edge_type, refinement, fft_length)
+
+        spectrum = np.fft.rfft(data, n=fft_length, axis=1)
+        spectrum *= kernel_spectrum
+
+        return np.fft.irfft(spectrum, n=fft_length, axis=1)[:, :n_points]
+
+    xcorr = data[:, :n_points] * kernel[0]
+    buffer = np.empty_like(xcorr)
+
+    for tap in range(1, n_taps):
+        np.multiply(data[:, tap:tap + n_points], kernel[tap], out=buffer)
+        xcorr += buffer
+
+    return xcorr
+
+
+@lru_cache(maxsize=config.EDGE_FINDER_CACHE_SIZE)
+def get_peak_fit_weights(n_points):
+    """
+    Get the least squares weights of a parabola a * x^2 + b * x + c through n_points samples centered on the maximum:
+    b = samples.dot(linear weights), a = samples.dot(quadratic weights).
+    :param n_points: Odd number of samples.
+    :return: Read only linear weights, quadratic weights.
+    """
+    x = np.arange(n_points, dtype=float) - n_points // 2
+
+    # With symmetric samples, the linear and the quadratic terms are fitted independently.
+    centered_squares = x ** 2 - np.mean(x ** 2)
+
+    linear_weights = x / np.sum(x ** 2)
+    quadratic_weights = centered_squares / np.sum(centered_squares ** 2)
+
+    linear_weights.flags.writeable = False
+    quadratic_weights.flags.writeable = False
+
+    return linear_weights, quadratic_weights
+
+
+def fit_peaks(xcorr, peak_index, peak_fit, n_points=config.EDGE_FINDER_PEAK_FIT_POINTS):
+    """
+    Get the sub-sample position of the cross-correlation maxima, by fitting the samples around them.
+    :param xcorr: 2D array of cross-correlations.
+    :param peak_index: Index of the maximum of each cross-correlation.
+    :param peak_fit: "parabolic" (parabola through the samples) or "gaussian" (parabola through the logarithm of the
+    samples, parabolic for peaks with samples which are not positive).
+    :param n_points: Number of samples fitted, 3 or 5.
+    :return: Offset of each maximum from its peak index, in samples, between -0.5 and 0.5. Maxima too close to the end
+    of the cross-correlation, or without a peak shape, keep an offset of 0.
+    """
+    half_width = n_points // 2
+    offsets = np.zeros(len(peak_index))
+
+    rows = np.flatnonzero((peak_index >= half_width) & (peak_index < xcorr.shape[1] - half_width))
+
+    if len(rows) == 0:
+        return offsets
+
+    samples = xcorr[rows[:, np.newaxis], peak_index[rows, np.newaxis] + np.arange(-half_width, half_width + 1)]
+
+    if peak_fit == "gaussian":
+        positive = np.all(samples > 0, axis=1)
+        samples[positive] = np.log(samples[positive])
+
+    linear_weights, quadratic_weights = get_peak_fit_weights(n_points)
+
+    linear = samples.dot(linear_weights)
+    quadratic = samples.dot(quadratic_weights)
+
+    # Only a negative curvature is a maximum.
+    peaks = quadratic < 0
+    offsets[rows[peaks]] = np.clip(-linear[peaks] / (2 * quadratic[peaks]), -0.5, 0.5)
+
+    return offsets
+
+
+def find_edge(data, step_length=50, edge_type='falling', refinement=1, peak_fit=None):
+    """
+    Find the position of the step edge in each profile.
+    :param data: 1D profile or 2D array of profiles (one per row).
+    :param step_length: Length of the step, in samples.
+    :param edge_type: 'rising' or 'falling'.
+    :param refinement: Sub-pixel step used to interpolate the profiles before correlating them.
+    :param peak_fit: None for the edge at the maximum of the cross-correlation, "parabolic" or "gaussian" to fit the
+    samples around the maximum. With a peak fit, the refinement is usually left at 1: the fit gives sub-pixel
+    positions at the cost of the correlation at the native resolution.
+    :return: Dictionary with 'edge_pos' and 'xcorr_ampl' - scalars for a 1D profile, arrays otherwise. Profiles shorter
+    than the step give NaN values.
+    """
+    data = np.asarray(data, dtype=float)
+
+    single_profile = data.ndim == 1
+    data = np.atleast_2d(data)
+
+    refined_data = refine_profiles(data, refinement)
+    n_taps = len(get_step_kernel(step_length, edge_type, refinement))
+
+    if refined_data.shape[1] < n_taps or n_taps == 0:
+        edge_position = np.full(data.shape[0], np.nan)
+        xcorr_amplitude = np.full(data.shape[0], np.nan)
+
+    else:
+        xcorr = correlate_profiles(refined_data, step_length, edge_type, refinement)
+
+        peak_index = np.argmax(xcorr, axis=1)
+        xcorr_amplitude = xcorr[np.arange(len(xcorr)), peak_index]
+
+        edge_position = peak_index.astype(float)
+
+        if peak_fit is not None:
+            edge_position += fit_peaks(xcorr, peak_index, peak_fit)
+
+        edge_position *= refinement
+
+        # correct edge_position for step_length
+        edge_position += np.floor(step_length / 2)
+
+    if single_profile:
+        return {'edge_pos': edge_position[0], 'xcorr_ampl': xcorr_amplitude[0]}
+
+    return {'edge_pos': edge_position, 'xcorr_ampl': xcorr_amplitude}
@@ -0,0 +1,74 @@
+from fnmatch import fnmatchcase
+from functools import lru_cache
+
+import numpy as np
+
+from psen_processing import config
+
+IMAGE_FORWARDING_MODES = ("all", "off", "decimate", "fel", "roi")
+
+
+def get_rois_union(rois):
+    """
+    Get the bounding box of all the given ROIs.
+    :param rois: List of ROIs [offset_x, size_x, offset_y, size_y], or empty lists.
+    :return: Bounding ROI [offset_x, size_x, offset_y, size_y], or [] if no ROI is set.
+    """
+    rois = [roi for roi in rois if roi]
+
+    if not rois:
+        return []
+
+    x_start = min(roi[0] for roi in rois)
+    x_end = max(roi[0] + roi[1] for roi in rois)
+    y_start = min(roi[2] for roi in rois)
+    y_end = max(roi[2] + roi[3] for roi in rois)
+
+    return [x_start, x_end - x_start, y_start, y_end - y_start]
+
+
+@lru_cache(maxsize=config.CHANNEL_FORWARDING_CACHE_SIZE)
+def get_forwarded_channels(patterns, channel_names, image_property_name):
+    """
+    Get the input channels forwarded to the data output stream. Cached, so the patterns are matched only when the
+    patterns or the channels of the input stream change.
+    :param patterns: Tuple of glob patterns (case sensitive, as the channel names).
+    :param channel_names: Tuple with the names of the channels in the input message.
+    :param image_property_name: Name of the image channel, which is only sent on the image output stream.
+    :return: Tuple with the names of the forwarded channels, in the input order.
+    """
+    return tuple(name for name in channel_names
+                 if name != image_property_name and any(fnmatchcase(name, pattern) for pattern in patterns))
+
+
+def get_forwarded_image(sequence, fel_shot, image, image_property_name, roi_config, image_forwarding):
+    """
+    Get the data to send on the image output stream.
+    :param sequence: Index of the image since the processing started.
+    :param fel_shot: True if the image is a FEL shot.
+    :param roi_config: RoiConfig with the ROIs.
+    :param image_forwarding: Dictionary {"mode": one of IMAGE_FORWARDING_MODES, "decimation": N}:
+    - all: every image.
+    - off: no images.
+    - decimate: every Nth image.
+    - fel: only FEL shots.
+    - roi: every image, cropped to the union of all the ROIs: signal, background and named ROIs.
+    :return: Data to send, or None if the image is not forwarded.
+    """
+    mode = image_forwarding["mode"]
+
+    if mode == "off":
+        return None
+
+    elif mode == "decimate" and sequence % image_forwarding["decimation"] != 0:
+        return None
+
+    elif mode == "fel" and not fel_shot:
+        return None
+
+    elif mode == "roi":
+        if roi_config.crop:
+            return {image_property_name: image[roi_config.crop_slices],
+                    image_property_name + ".image_roi": np.array(roi_config.crop, dtype="int64")}
+
+    return {image_property_name: image}
@@ -1,34 +1,84 @@
-from threading import Event, Thread
+import os
+from threading import Event, Lock, Thread
 
 from logging import getLogger
 
-from copy import deepcopy
-
 from psen_processing import config
-from psen_processing.utils import validate_roi
+from psen_processing.calibration import CALIBRATION_TYPES, Calibration, CalibrationRecorder, \
+    get_calibration_filename, load_calibration_frames, save_calibration_frame
+from psen_processing.edge_finder import get_step_kernel
+from psen_processing.metrics import ProcessingStatistics
+from psen_processing.rois import ROI_BOUNDS_POLICIES, RoiConfig
+from psen_processing.utils import validate_roi, validate_background_parameters, validate_image_forwarding_parameters, \
+    validate_shot_classifier_parameters, validate_named_roi, validate_edge_finder_parameters, \
+    validate_calibration_parameters, validate_channel_forwarding_parameters, validate_catch_up_parameters, \
+    get_default_processing_parameters
 
 _logger = getLogger(__name__)
 
 
 class ProcessingManager(object):
 
-    def __init__(self, stream_processor, roi_signal=None, roi_background=None, auto_start=False):
+    def __init__(self, stream_processor, roi_signal=None, roi_background=None, background_parameters=None,
+                 image_forwarding_parameters=None, shot_classifier_parameters=None,
+                 roi_bounds_policy=config.DEFAULT_ROI_BOUNDS_POLICY, rois=None, edge_finder_parameters=None,
+                 calibration_directory=config.DEFAULT_CALIBRATION_DIRECTORY, channel_forwarding_parameters=None,
+                 catch_up_parameters=None, auto_start=False):
 
         self.stream_processor = stream_processor
         self.auto_start = auto_start
 
+        if roi_bounds_policy not in ROI_BOUNDS_POLICIES:
+            raise ValueError("ROI bounds policy must be one of %s, but %s was given." %
+                             (ROI_BOUNDS_POLICIES, roi_bounds_policy))
+        self.roi_bounds_policy = roi_bounds_policy
+
+        self.processing_parameters = get_default_processing_parameters()
+
         if roi_background is None:
             roi_background = config.DEFAULT_ROI_BACKGROUND or []
-        self.roi_background = roi_background
 
         if roi_signal is None:
             roi_signal = config.DEFAULT_ROI_SIGNAL or []
-        self.roi_signal = roi_signal
+
+        self.processing_parameters["rois"] = RoiConfig(roi_signal, roi_background)
+
+        if rois is not None:
+            self.set_rois(rois)
+
+        if edge_finder_parameters is not None:
+            self.set_edge_finder_parameters(edge_finder_parameters)
+
+        if background_parameters is not None:
+            self.set_background_parameters(background_parameters)
+        if image_forwarding_parameters is not None:
+            self.set_image_forwarding_parameters(image_forwarding_parameters)
+
+        if channel_forwarding_parameters is not None:
+            self.set_channel_forwarding_parameters(channel_forwarding_parameters)
+
+        if shot_classifier_parameters is not None:
+            self.set_shot_classifier_parameters(shot_classifier_parameters)
+
+        if catch_up_parameters is not None:
+            self.set_catch_up_parameters(catch_up_parameters)
+
+        # Calibration frames are recorded by the receive stage, and saved and applied in their own thread, so the
+        # calibration is updated from other threads too.
+        self.calibration_lock = Lock()
+        self.calibration_directory = calibration_directory
+        self.processing_parameters["calibration"] = Calibration(**load_calibration_frames(calibration_directory))
+
+        # Recorded frames are saved one at a time, and only applied if no newer recording or deletion of their type
+        # was requested meanwhile: {calibration type: number of requests}.
+        self.calibration_save_lock = Lock()
+        self.calibration_requests = dict.fromkeys(CALIBRATION_TYPES, 0)
+        self.calibration_thread = None
 
         self.processing_thread = None
         self.running_flag = None
 
-        self.statistics = {}
+        self.statistics = ProcessingStatistics()
 
         if auto_start:
             self.start()
@@ -42,7 +92,7 @@ class ProcessingManager(object):
         self.running_flag = Event()
 
         self.processing_thread = Thread(target=self.stream_processor,
-                                        args=(self.running_flag, self.roi_signal, self.roi_background, self.statistics))
+                                        args=(self.running_flag, self.statistics, self.processing_parameters))
 
         self.processing_thread.start()
 
@@ -67,10 +117,7 @@ class ProcessingManager(object):
 
         validate_roi(roi_background)
 
-        _logger.info("Setting ROI background to %s.", roi_background)
-
-        self.roi_background.clear()
-        self.roi_background.extend(roi_background)
+        self._update_rois(roi_background=roi_background)
 
     def set_roi_signal(self, roi_signal):
 
@@ -79,19 +126,293 @@ class ProcessingManager(object):
 
         validate_roi(roi_signal)
 
-        _logger.info("Setting ROI signal to %s.", roi_signal)
+        self._update_rois(roi_signal=roi_signal)
+
+    def _update_rois(self, **rois):
+
+        # ROIs set before the first image is received are clipped by the stream processor.
+        image_shape = self.processing_parameters["image_shape"]
+
+        if image_shape is not None and self.roi_bounds_policy == "reject":
+            for name, roi in rois.items():
+                if name == "named_rois":
+                    for roi_name, roi_parameters in roi.items():
+                        validate_named_roi(roi_name, roi_parameters, image_shape)
+                elif name != "edge_finder":
+                    validate_roi(roi, image_shape)
+
+        # The ROIs are kept as they were set, the stream processor clips them to the shape of each image.
+        roi_config = self.processing_parameters["rois"].replace(**rois)
+
+        _logger.info("Setting ROIs to %s.", roi_config)
+
+        # A new immutable config replaces the old one, so the processing thread never sees a partial update.
+        self.processing_parameters["rois"] = roi_config
+
+    def _get_named_roi_parameters(self, name, roi_parameters, current_parameters=None):
+
+        if not isinstance(roi_parameters, dict):
+            raise ValueError("ROI %s must be a dictionary, but %s was given." % (name, roi_parameters))
+
+        # Parameters not given keep their current value, or get the default one for new ROIs.
+        new_parameters = current_parameters or {"roi": [],
+                                                "projection": config.DEFAULT_ROI_PROJECTION,
+                                                "edge_finding": config.DEFAULT_ROI_EDGE_FINDING,
+                                                "moments": config.DEFAULT_ROI_MOMENTS}
+        new_parameters.update(roi_parameters)
+
+        validate_named_roi(name, new_parameters)
+
+        return new_parameters
+
+    def set_rois(self, rois):
+        """
+        Replace all the named ROIs.
+        :param rois: Dictionary {name: {"roi": ROI, "projection": "x"|"y"|"sum", "edge_finding": bool,
+        "moments": bool}}.
+        """
+        if not rois:
+            rois = {}
+
+        if not isinstance(rois, dict):
+            raise ValueError("ROIs must be a dictionary {name: ROI parameters}, but %s was given." % rois)
+
+        named_rois = {name: self._get_named_roi_parameters(name, roi_parameters)
+                      for name, roi_parameters in rois.items()}
+
+        self._update_rois(named_rois=named_rois)
+
+    def set_roi(self, name, roi_parameters):
+        """
+        Add or change a named ROI.
+        :param roi_parameters: Dictionary with the ROI parameters to change.
+        """
+        named_rois = self.get_rois()
+        named_rois[name] = self._get_named_roi_parameters(name, roi_parameters, named_rois.get(name))
+
+        self._update_rois(named_rois=named_rois)
+
+    def delete_roi(self, name):
+        named_rois = self.get_rois()
+
+        if name not in named_rois:
+            raise ValueError("ROI %s does not exist." % name)
+
+        del named_rois[name]
+
+        self._update_rois(named_rois=named_rois)
+
+    def get_rois(self):
+        return self.processing_parameters["rois"].get_named_rois()
+
+    def get_roi(self, name):
+        named_rois = self.get_rois()
+
+        if name not in named_rois:
+            raise ValueError("ROI %s does not exist." % name)
+
+        return named_rois[name]
+
+    def record_calibration(self, calibration_type, n_frames=config.DEFAULT_CALIBRATION_N_FRAMES):
+        """
+        Record a calibration frame, averaging the next n_frames images of the input stream. The frame is saved in the
+        calibration directory and used, in a separate thread, when the recording is complete.
+        :param calibration_type: "dark" or "flat".
+        """
+        if calibration_type not in CALIBRATION_TYPES:
+            raise ValueError("Calibration type must be one of %s, but %s was given." %
+                             (CALIBRATION_TYPES, calibration_type))
+
+        if not isinstance(n_frames, int) or isinstance(n_frames, bool) or n_frames < 1:
+            raise ValueError("Number of calibration frames must be a positive integer, but %s was given." % n_frames)
+
+        _logger.info("Recording %s frame from %d images.", calibration_type, n_frames)
+
+        self.calibration_requests[calibration_type] += 1
+        request = self.calibration_requests[calibration_type]
+
+        def on_complete(recorded_type, frame):
+            self._set_calibration_frame(request, recorded_type, frame)
+
+        self.processing_parameters["calibration_recorder"] = CalibrationRecorder(calibration_type, n_frames,
+                                                                                 on_complete)
+
+    def _set_calibration_frame(self, request, calibration_type, frame):
+
+        # Called from the receive stage: saving the frame and computing the calibration must not stall the input.
+        self.calibration_thread = Thread(target=self._save_calibration_frame, args=(request, calibration_type, frame),
+                                         daemon=True)
+        self.calibration_thread.start()
+
+    def _save_calibration_frame(self, request, calibration_type, frame):
 
-        self.roi_signal.clear()
-        self.roi_signal.extend(roi_signal)
+        with self.calibration_save_lock:
+            if self.calibration_requests[calibration_type] != request:
+                _logger.info("Discarding the recorded %s frame, replaced by a newer request.", calibration_type)
+                return
+
+            if self.calibration_directory is not None:
+                frame = save_calibration_frame(self.calibration_directory, calibration_type, frame)
+
+            self._update_calibration(**{calibration_type: frame})
+
+    def _update_calibration(self, **changes):
+
+        with self.calibration_lock:
+            calibration = self.processing_parameters["calibration"].replace(**changes)
+
+            _logger.info("Setting calibration to dark of shape %s, flat of shape %s, enabled %s.",
+                         None if calibration.dark is None else calibration.dark.shape,
+                         None if calibration.flat is None else calibration.flat.shape, calibration.enabled)
+
+            # Like the ROI config, a new calibration replaces the old one.
+            self.processing_parameters["calibration"] = calibration
+
+    def delete_calibration(self, calibration_type):
+        """
+        Stop using the calibration frame, and delete it from the calibration directory.
+        """
+        if calibration_type not in CALIBRATION_TYPES:
+            raise ValueError("Calibration type must be one of %s, but %s was given." %
+                             (CALIBRATION_TYPES, calibration_type))
+
+        calibration_recorder = self.processing_parameters["calibration_recorder"]
+        if calibration_recorder is not None and calibration_recorder.calibration_type == calibration_type:
+            self.processing_parameters["calibration_recorder"] = None
+
+        # Waits for a frame being saved, and discards the recorded frames not saved yet.
+        with self.calibration_save_lock:
+            self.calibration_requests[calibration_type] += 1
+
+            if self.calibration_directory is not None:
+                filename = get_calibration_filename(self.calibration_directory, calibration_type)
+
+                if os.path.exists(filename):
+                    os.remove(filename)
+
+            self._update_calibration(**{calibration_type: None})
+
+    def set_calibration_parameters(self, calibration_parameters):
+        """
+        :param calibration_parameters: Dictionary {"enabled": bool}.
+        """
+        if not calibration_parameters:
+            calibration_parameters = {}
+
+        validate_calibration_parameters(calibration_parameters)
+
+        self._update_calibration(**calibration_parameters)
+
+    def get_calibration(self):
+        calibration = self.processing_parameters["calibration"]
+        calibration_recorder = self.processing_parameters["calibration_recorder"]
+
+        status = {"enabled": calibration.enabled,
+                  "recording": calibration_recorder.get_status()
+                  if calibration_recorder is not None and not calibration_recorder.done else None}
+
+        for calibration_type in CALIBRATION_TYPES:
+            frame = getattr(calibration, calibration_type)
+
+            status[calibration_type] = None if frame is None else {
+                "shape": list(frame.shape),
+                "filename": get_calibration_filename(self.calibration_directory, calibration_type)
+                if self.calibration_directory is not None else None}
+
+        return status
+
+    def set_edge_finder_parameters(self, edge_finder_parameters):
+        """
+        :param edge_finder_parameters: Dictionary with the edge finder parameters to change.
+        """
+        if not edge_finder_parameters:
+            edge_finder_parameters = {}
+
+        if not isinstance(edge_finder_parameters, dict):
+            raise ValueError("Edge finder parameters must be a dictionary, but %s was given." % edge_finder_parameters)
+
+        # Parameters not given keep their current value.
+        new_parameters = self.get_edge_finder_parameters()
+        new_parameters.update(edge_finder_parameters)
+
+        validate_edge_finder_parameters(new_parameters)
+
+        # The kernel is built once here, so the processing finds it in the cache.
+        get_step_kernel(new_parameters["step_length"], new_parameters["edge_type"], new_parameters["refinement"])
+
+        # Applied together with the ROIs, so each image is processed with one version of both.
+        self._update_rois(edge_finder=new_parameters)
+
+    def get_edge_finder_parameters(self):
+        return dict(self.processing_parameters["rois"].edge_finder)
+
+    def _update_processing_parameters(self, name, parameters, validate):
+
+        if not parameters:
+            parameters = {}
+
+        if not isinstance(parameters, dict):
+            raise ValueError("%s parameters must be a dictionary, but %s was given." %
+                             (name.replace("_", " ").capitalize(), parameters))
+
+        # Parameters not given keep their current value.
+        new_parameters = dict(self.processing_parameters[name])
+        new_parameters.update(parameters)
+
+        validate(new_parameters)
+
+        _logger.info("Setting %s parameters to %s.", name.replace("_", " "), new_parameters)
+
+        # Replace the whole dictionary, so the processing thread never sees a partial update.
+        self.processing_parameters[name] = new_parameters
+
+    def set_background_parameters(self, background_parameters):
+        self._update_processing_parameters("background", background_parameters, validate_background_parameters)
+
+    def get_background_parameters(self):
+        return self.processing_parameters["background"]
+
+    def set_image_forwarding_parameters(self, image_forwarding_parameters):
+        self._update_processing_parameters("image_forwarding", image_forwarding_parameters,
+                                           validate_image_forwarding_parameters)
+
+    def get_image_forwarding_parameters(self):
+        return self.processing_parameters["image_forwarding"]
+
+    def set_channel_forwarding_parameters(self, channel_forwarding_parameters):
+        self._update_processing_parameters("channel_forwarding", channel_forwarding_parameters,
+                                           validate_channel_forwarding_parameters)
+
+    def get_channel_forwarding_parameters(self):
+        return self.processing_parameters["channel_forwarding"]
+
+    def set_catch_up_parameters(self, catch_up_parameters):
+        self._update_processing_parameters("catch_up", catch_up_parameters, validate_catch_up_parameters)
+
+    def get_catch_up_parameters(self):
+        return self.processing_parameters["catch_up"]
+
+    def set_shot_classifier_parameters(self, shot_classifier_parameters):
+        self._update_processing_parameters("shot_classifier", shot_classifier_parameters,
+                                           validate_shot_classifier_parameters)
+
+    def get_shot_classifier_parameters(self):
+        return self.processing_parameters["shot_classifier"]
 
     def get_roi_background(self):
-        return self.roi_background
+        return list(self.processing_parameters["rois"].roi_background)
 
     def get_roi_signal(self):
-        return self.roi_signal
+        return list(self.processing_parameters["rois"].roi_signal)
+
+    def get_roi_version(self):
+        return self.processing_parameters["rois"].version
+
+    def get_image_shape(self):
+        return self.processing_parameters["image_shape"]
 
     def get_statistics(self):
-        return deepcopy(self.statistics)
+        return self.statistics.snapshot()
 
     def _is_running(self):
         return self.processing_thread and self.processing_thread.is_alive()
@@ -0,0 +1,316 @@
+import datetime
+from bisect import bisect_left
+from threading import Lock, local
+from time import monotonic, time
+
+from psen_processing import config
+
+# Stages of the processing with a latency histogram.
+LATENCY_STAGES = ("receive_wait", "profiles", "background", "edge_finding", "data_send", "image_send")
+
+# Statistics exported as Prometheus counters (named with the "_total" suffix), the other numbers are gauges.
+PROMETHEUS_COUNTER_SUFFIXES = ("_dropped", "_gaps", "_pulse_ids", "_images", "_changes", "_activations")
+
+
+class LatencyHistogram(object):
+    """
+    Histogram of latencies with fixed buckets.
+
+    Each thread observes into its own counts, so parallel workers never lose updates and never need a lock. The
+    counts of all the threads are summed when the histogram is read.
+    """
+
+    def __init__(self, buckets=config.LATENCY_HISTOGRAM_BUCKETS):
+        """
+        :param buckets: Increasing upper bounds of the buckets, in seconds. Larger latencies go in an overflow bucket.
+        """
+        self.buckets = tuple(buckets)
+
+        self.local = local()
+        self.shards = []
+        self.shards_lock = Lock()
+
+    def _get_shard(self):
+        shard = getattr(self.local, "shard", None)
+
+        if shard is None:
+            # [counts per bucket + overflow bucket, sum of the latencies]
+            shard = self.local.shard = [[0] * (len(self.buckets) + 1), 0.0]
+
+            with self.shards_lock:
+                self.shards.append(shard)
+
+        return shard
+
+    def observe(self, latency):
+        """
+        Add a latency, in seconds.
+        """
+        shard = self._get_shard()
+
+        shard[0][bisect_left(self.buckets, latency)] += 1
+        shard[1] += latency
+
+    def get_summary(self):
+        """
+        Get the histogram.
+        :return: Dictionary with the "count", "sum" (seconds), "mean_us" and the cumulative "buckets"
+        [[upper bound, count], ...], the last upper bound being "+Inf".
+        """
+        with self.shards_lock:
+            shards = list(self.shards)
+
+        counts = [0] * (len(self.buckets) + 1)
+        latency_sum = 0.0
+
+        for shard_counts, shard_sum in shards:
+            counts = [count + shard_count for count, shard_count in zip(counts, shard_counts)]
+            latency_sum += shard_sum
+
+        cumulative_counts = []
+        total = 0
+        for count in counts:
+            total += count
+            cumulative_counts.append(total)
+
+        return {"count": total,
+                "sum": latency_sum,
+                "mean_us": latency_sum / total * 1e6 if total else None,
+                "buckets": [[upper_bound, count] for upper_bound, count in
+                            zip(list(self.buckets) + ["+Inf"], cumulative_counts)]}
+
+
+class RateMeter(object):
+    """
+    Counts events in one second slots, to get the event rate over sliding windows. Must be updated from one thread.
+    """
+
+    def __init__(self, max_window=max(config.STATISTICS_RATE_WINDOWS)):
+        self.n_slots = max_window + 1
+
+        self.counts = [0] * self.n_slots
+        self.seconds = [None] * self.n_slots
+
+    def mark(self, now=None):
+        """
+        Record an event.
+        :param now: Monotonic time of the event, None for the current time.
+        """
+        second = int(monotonic() if now is None else now)
+        slot = second % self.n_slots
+
+        if self.seconds[slot] != second:
+            self.seconds[slot] = second
+            self.counts[slot] = 0
+
+        self.counts[slot] += 1
+
+    def get_rate(self, window, now=None):
+        """
+        Get the average rate over the last complete seconds.
+        :param window: Number of seconds to average over.
+        :return: Events per second.
+        """
+        current_second = int(monotonic() if now is None else now)
+        n_events = 0
+
+        for second in range(current_second - window, current_second):
+            slot = second % self.n_slots
+
+            if self.seconds[slot] == second:
+                n_events += self.counts[slot]
+
+        return n_events / window
+
+
+class ProcessingMetrics(object):
+    """
+    Latency histograms, frame rate and counters of one processing run.
+    """
+
+    def __init__(self):
+        self.latency = {stage: LatencyHistogram() for stage in LATENCY_STAGES}
+        self.sent_frames = RateMeter()
+
+        self.data_output_dropped = 0
+        self.image_output_dropped = 0
+        self.data_output_layout_changes = 0
+
+        self.last_received_pulse_id = None
+        self.pulse_id_gaps = 0
+        self.missing_pulse_ids = 0
+
+    def observe(self, stage, latency):
+        self.latency[stage].observe(latency)
+
+    def check_pulse_id(self, pulse_id):
+        """
+        Count the gaps in the pulse ids of the input stream. Called from the receive stage only.
+        """
+        last_pulse_id = self.last_received_pulse_id
+
+        if last_pulse_id is not None and pulse_id > last_pulse_id + 1:
+            self.pulse_id_gaps += 1
+            self.missing_pulse_ids += pulse_id - last_pulse_id - 1
+
+        self.last_received_pulse_id = pulse_id
+
+    def get_summary(self):
+        """
+        Get the metrics as a JSON serializable dictionary, to merge into the statistics.
+        """
+        now = monotonic()
+
+        return {"frames_per_second": {"%ds" % window: self.sent_frames.get_rate(window, now)
+                                      for window in config.STATISTICS_RATE_WINDOWS},
+                "data_output_dropped": self.data_output_dropped,
+                "image_output_dropped": self.image_output_dropped,
+                "data_output_layout_changes": self.data_output_layout_changes,
+                "pulse_id_gaps": self.pulse_id_gaps,
+                "missing_pulse_ids": self.missing_pulse_ids,
+                "latency": {stage: histogram.get_summary() for stage, histogram in self.latency.items()}}
+
+
+class ProcessingStatistics(object):
+    """
+    Statistics shared between the processing threads and the REST interface.
+
+    The hot loop only stores numbers: each group of values written together is published as one immutable tuple, so
+    updates need no lock and a reader never sees half of an update. Everything else (queue occupancies, metrics
+    summaries, time formatting) is computed only when a snapshot is requested. The reset at the start of the
+    processing is done under a lock, so a snapshot has either the previous or the new run's values.
+    """
+
+    __slots__ = ("lock", "start_time", "start_monotonic_time", "last_sent", "sources", "values")
+
+    def __init__(self):
+        self.lock = Lock()
+
+        self.start_time = None
+        self.start_monotonic_time = None
+
+        # (pulse_id, monotonic send time, number of sent frames) of the last sent frame.
+        self.last_sent = (None, None, 0)
+
+        # Functions returning dictionaries to add to the snapshots.
+        self.sources = ()
+
+        # Other values, set with statistics[name] = value.
+        self.values = {}
+
+    def start(self, sources=()):
+        """
+        Reset the statistics at the start of the processing, before the processing stages run.
+        :param sources: Functions returning dictionaries of statistics, called for each snapshot.
+        """
+        with self.lock:
+            self.last_sent = (None, None, 0)
+            self.sources = tuple(sources)
+
+            self.start_monotonic_time = monotonic()
+            self.start_time = time()
+
+    def frame_sent(self, pulse_id):
+        """
+        Record a sent frame. Called from the send stage only.
+        """
+        self.last_sent = (pulse_id, monotonic(), self.last_sent[2] + 1)
+
+    @staticmethod
+    def _format_time(monotonic_time, start_time, start_monotonic_time):
+        if monotonic_time is None:
+            return None
+
+        return str(datetime.datetime.fromtimestamp(start_time + monotonic_time - start_monotonic_time))
+
+    def snapshot(self):
+        """
+        Get the statistics as a JSON serializable dictionary. Empty if the processing was never started.
+        """
+        statistics = dict(self.values)
+
+        with self.lock:
+            start_time, start_monotonic_time, last_sent, sources = (self.start_time, self.start_monotonic_time,
+                                                                    self.last_sent, self.sources)
+
+        if start_time is None:
+            return statistics
+
+        last_sent_pulse_id, last_sent_time, n_processed_images = last_sent
+
+        statistics["processing_start_time"] = str(datetime.datetime.fromtimestamp(start_time))
+        statistics["last_sent_pulse_id"] = last_sent_pulse_id
+        statistics["last_sent_time"] = self._format_time(last_sent_time, start_time, start_monotonic_time)
+        statistics["n_processed_images"] = n_processed_images
+
+        for source in sources:
+            statistics.update(source())
+
+        return statistics
+
+    def __setitem__(self, name, value):
+        self.values[name] = value
+
+    def __getitem__(self, name):
+        return self.values[name]
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+
+def format_prometheus_metrics(labeled_statistics):
+    """
+    Format processing statistics in the Prometheus text format.
+    :param labeled_statistics: List of (labels, statistics) - statistics as returned by ProcessingManager.get_statistics
+    and a dictionary of labels added to all its samples, e.g. {"camera": "SARES11-SPEC125-M2"}.
+    :return: Metrics text.
+    """
+    # Samples of the same metric must be grouped under a single TYPE line: {metric name: (type, [sample lines])}
+    metrics = {}
+
+    def add_sample(name, metric_type, value, labels):
+        metric_name = config.PROMETHEUS_METRICS_PREFIX + name
+        labels_text = ",".join('%s="%s"' % (label_name, label_value)
+                               for label_name, label_value in sorted(labels.items()))
+
+        metrics.setdefault(metric_name, (metric_type, []))[1].append(
+            "%s%s %s" % (metric_name, "{%s}" % labels_text if labels_text else "", value))
+
+    for labels, statistics in labeled_statistics:
+
+        for name, value in sorted(statistics.items()):
+
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+
+            if name.endswith(PROMETHEUS_COUNTER_SUFFIXES):
+                add_sample(name + "_total", "counter", value, labels)
+            else:
+                add_sample(name, "gauge", value, labels)
+
+        for window, rate in sorted(statistics.get("frames_per_second", {}).items()):
+            add_sample("frames_per_second", "gauge", rate, dict(labels, window=window))
+
+        for stage, histogram in sorted(statistics.get("latency", {}).items()):
+            stage_labels = dict(labels, stage=stage)
+
+            for upper_bound, count in histogram["buckets"]:
+                add_sample("latency_seconds_bucket", "histogram", count, dict(stage_labels, le=upper_bound))
+
+            add_sample("latency_seconds_sum", "histogram", histogram["sum"], stage_labels)
+            add_sample("latency_seconds_count", "histogram", histogram["count"], stage_labels)
+
+    lines = []
+    histogram_name = config.PROMETHEUS_METRICS_PREFIX + "latency_seconds"
+
+    for metric_name, (metric_type, samples) in sorted(metrics.items()):
+
+        if metric_type != "histogram":
+            lines.append("# TYPE %s %s" % (metric_name, metric_type))
+
+        elif metric_name == histogram_name + "_bucket":
+            lines.append("# TYPE %s histogram" % histogram_name)
+
+        lines.extend(samples)
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def get_value_type(value):
+    """
+    Get the type of a data output value, as it is described in the bsread data header.
+    :return: Tuple (dtype name, shape).
+    """
+    if isinstance(value, (np.ndarray, np.generic)):
+        return value.dtype.str, value.shape
+
+    return type(value).__name__, ()
+
+
+class OutputLayout(object):
+    """
+    Channels of the data output stream messages for one configuration: ROI config, image shape and dtype, calibration
+    and input channels. Messages with the same layout are described by the same bsread data header, so the data header
+    is only checked and rebuilt by the sender when the layout changes.
+    """
+
+    __slots__ = ("key", "channels")
+
+    def __init__(self, key, data):
+        """
+        :param key: Configuration of the layout, see get_output_layout_key.
+        :param data: First message with this layout.
+        """
+        self.key = key
+        self.channels = tuple((name,) + get_value_type(value) for name, value in data.items())
+
+    def __len__(self):
+        return len(self.channels)
+
+
+def get_output_layout_key(roi_config, image, calibration, processed_data, forwarded_data):
+    """
+    Get the configuration the layout of a data output message depends on. Only cheap to compare values are used: the
+    processed channels have the same types and shapes for the same ROI config version, image shape and dtype and
+    calibration, and the forwarded input channels are described by their types.
+    :param processed_data: Processed channels of the message.
+    :param forwarded_data: Forwarded input channels of the message, before the processed channels are merged in.
+    """
+    return (roi_config.version, image.shape, image.dtype.str, calibration is not None, tuple(processed_data),
+            tuple(forwarded_data), tuple(get_value_type(value) for value in forwarded_data.values()))
@@ -0,0 +1,239 @@
+from collections import deque
+from heapq import heappop, heappush
+from logging import getLogger
+from threading import Condition, Lock, Thread
+from time import monotonic
+
+_logger = getLogger(__name__)
+
+DROP_POLICIES = ("block", "drop_oldest", "drop_newest")
+
+
+class StageQueue(object):
+    """
+    Bounded queue connecting two processing stages.
+
+    When the queue is full, the drop policy decides what happens with a new item:
+    - block: the producer waits until there is space (or the put times out).
+    - drop_oldest: the oldest queued item is discarded to make space.
+    - drop_newest: the new item is discarded.
+    """
+
+    def __init__(self, max_size, drop_policy="block"):
+
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError("Drop policy must be one of %s, but %s was given." % (DROP_POLICIES, drop_policy))
+
+        if max_size < 1:
+            raise ValueError("Queue size must be at least 1, but %s was given." % max_size)
+
+        self.max_size = max_size
+        self.drop_policy = drop_policy
+
+        self.items = deque()
+        self.condition = Condition()
+
+        self.n_dropped = 0
+
+    def put(self, item, timeout=None):
+        """
+        Add an item to the queue.
+        :param item: Item to add, cannot be None.
+        :param timeout: Maximum time to wait for space with the "block" policy.
+        :return: True if the item was queued, False if it was dropped or the put timed out.
+        """
+        with self.condition:
+
+            if len(self.items) >= self.max_size:
+
+                if self.drop_policy == "drop_newest":
+                    self.n_dropped += 1
+                    return False
+
+                elif self.drop_policy == "drop_oldest":
+                    self.items.popleft()
+                    self.n_dropped += 1
+
+                elif not self.condition.wait_for(lambda: len(self.items) < self.max_size, timeout):
+                    return False
+
+            self.items.append(item)
+            self.condition.notify_all()
+
+            return True
+
+    def get(self, timeout=None):
+        """
+        Remove and return the oldest item in the queue.
+        :param timeout: Maximum time to wait for an item.
+        :return: The item, or None if no item arrived in time.
+        """
+        with self.condition:
+
+            if not self.condition.wait_for(lambda: self.items, timeout):
+                return None
+
+            item = self.items.popleft()
+            self.condition.notify_all()
+
+            return item
+
+    def __len__(self):
+        return len(self.items)
+
+
+def put_while_running(stage_queue, item, running_flag, timeout):
+    """
+    Put the item in the queue, retrying blocked puts until it is queued or the running flag is cleared.
+    :return: True if the item was queued.
+    """
+    while running_flag.is_set():
+
+        if stage_queue.put(item, timeout=timeout):
+            return True
+
+        if stage_queue.drop_policy != "block":
+            return False
+
+    return False
+
+
+class Sequencer(object):
+    """
+    Lets parallel workers run a critical section in the order of their sequence numbers (0, 1, 2...).
+    Every sequence number must take its turn exactly once, otherwise the following ones wait until the running flag
+    is cleared.
+    """
+
+    def __init__(self, running_flag=None, timeout=None):
+        """
+        :param running_flag: Event cleared to stop the waiting workers, None to wait for the turn in any case.
+        :param timeout: Interval (seconds) at which the waiting workers check the running flag.
+        """
+        self.next_sequence = 0
+        self.condition = Condition()
+
+        self.running_flag = running_flag
+        self.timeout = timeout
+
+    def turn(self, sequence):
+        return SequencerTurn(self, sequence)
+
+
+class SequencerTurn(object):
+    """
+    Context manager waiting for the turn of one sequence number, and passing it to the next one on exit.
+    """
+
+    def __init__(self, sequencer, sequence):
+        self.sequencer = sequencer
+        self.sequence = sequence
+
+        self.done = False
+
+    def __enter__(self):
+        sequencer = self.sequencer
+
+        with sequencer.condition:
+            while not sequencer.condition.wait_for(lambda: sequencer.next_sequence == self.sequence,
+                                                   sequencer.timeout):
+
+                # The processing stopped: the results are not used anymore, so the order does not matter.
+                if sequencer.running_flag is not None and not sequencer.running_flag.is_set():
+                    _logger.warning("Processing stopped while sequence %d waited for its turn.", self.sequence)
+                    break
+
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        with self.sequencer.condition:
+            self.sequencer.next_sequence += 1
+            self.sequencer.condition.notify_all()
+
+        self.done = True
+
+
+class ReorderBuffer(object):
+    """
+    Restores the order of the results produced by parallel workers.
+
+    Results are passed to the output in sequence order. If a result is missing for more than max_latency seconds, the
+    results after it are released anyway, and the late result is dropped when it arrives.
+    """
+
+    def __init__(self, output, max_latency):
+        """
+        :param output: Function called with each result, in order.
+        :param max_latency: Maximum time a result waits for the results before it, in seconds.
+        """
+        self.output = output
+        self.max_latency = max_latency
+
+        self.results = []
+        self.next_sequence = 0
+        self.lock = Lock()
+
+        self.n_dropped = 0
+
+    def add(self, sequence, result):
+        """
+        Add the result and output all the results which are ready.
+        """
+        with self.lock:
+
+            if sequence < self.next_sequence:
+                self.n_dropped += 1
+                return
+
+            heappush(self.results, (sequence, monotonic(), result))
+            self._output_ready()
+
+    def flush(self):
+        """
+        Output the results which waited longer than max_latency.
+        """
+        with self.lock:
+            self._output_ready()
+
+    def _output_ready(self):
+        now = monotonic()
+
+        while self.results:
+            sequence, arrival_time, result = self.results[0]
+
+            if sequence != self.next_sequence and now - arrival_time < self.max_latency:
+                break
+
+            heappop(self.results)
+            self.next_sequence = sequence + 1
+
+            # Called under the lock, so parallel workers cannot interleave their outputs.
+            self.output(result)
+
+    def __len__(self):
+        return len(self.results)
+
+
+class StageThread(Thread):
+    """
+    Thread running one processing stage. An error in the stage clears the running flag, so all the other stages
+    stop as well, and is kept to be re-raised by the caller.
+    """
+
+    def __init__(self, name, stage, running_flag):
+        super(StageThread, self).__init__(name=name)
+
+        self.stage = stage
+        self.running_flag = running_flag
+
+        self.error = None
+
+    def run(self):
+        try:
+            self.stage()
+
+        except Exception as e:
+            _logger.exception("Error in the %s stage. Stopping the processing.", self.name)
+
+            self.error = e
+            self.running_flag.clear()
@@ -1,167 +1,385 @@
-import datetime
-from collections import deque
+from itertools import count
 from logging import getLogger
+from threading import Lock
+from time import monotonic
 
 import numpy as np
 from zmq import Again
 
-from bsread import PULL, json, source
+from bsread import PULL, source
 from bsread.sender import sender
 from psen_processing import config
-from psen_processing.utils import append_message_data
+from psen_processing.background import BackgroundModel, get_background_estimates
+from psen_processing.catch_up import CatchUp, get_message_lag
+from psen_processing.classification import classify_shot, classify_shots, get_classifier_channels
+from psen_processing.edge_finder import find_edge
+from psen_processing.forwarding import get_forwarded_channels, get_forwarded_image
+from psen_processing.metrics import ProcessingMetrics
+from psen_processing.output import OutputLayout, get_output_layout_key
+from psen_processing.pipeline import StageQueue, StageThread, ReorderBuffer, Sequencer, put_while_running
+from psen_processing.profiles import ProfileEngine, get_batch_x_profiles, get_profile_moments, get_roi_x_profile
+from psen_processing.receiver import RawMessageHandler
+from psen_processing.rois import RoiConfig
+from psen_processing.utils import append_message_data, get_default_processing_parameters, \
+    validate_background_parameters, validate_roi, validate_shot_classifier_parameters
 
 _logger = getLogger(__name__)
 
-background = deque(maxlen=4)
+# Only holds per thread scratch buffers, so it can be shared by all the processors.
+profile_engine = ProfileEngine()
+
+
+def subtract_background(fel_shot, signal_profile, background):
+    """
+    Update the background with background shots and subtract it from FEL shots.
+    :param fel_shot: True for FEL shots, False for background shots, None for unclassified shots (ignored).
+    :return: Background subtracted signal profile for FEL shots with an available background, None otherwise.
+    """
+    # A different profile shape means the ROI changed - the old background is not valid anymore.
+    background.update_shape(signal_profile.shape)
+
+    if fel_shot:
+        avg_background = background.get()
+
+        if avg_background is not None:
+            return signal_profile - avg_background
+
+    elif fel_shot is not None:
+        background.add(signal_profile)
+
+    return None
+
+
+def process_image(pulse_id, image, image_property_name, roi_signal, roi_background, background, background_turn=None,
+                  shot_classifier=None, channels=None, metrics=None):
+    """
+    Process the image.
+    :param background_turn: Context manager to enter around the background update, when images are processed in
+    parallel. The background must be updated in the order the images were received.
+    :param shot_classifier: Shot classifier parameters, None for the default ones.
+    :param channels: Dictionary with the input channels needed by the shot classifier.
+    :param metrics: ProcessingMetrics to record the latency of the processing stages in, None to not record them.
+    :return: Dictionary with the processed data.
+    """
+    return process_frame(pulse_id, image, image_property_name, RoiConfig(roi_signal, roi_background), background,
+                         background_turn, shot_classifier, channels, metrics)
+
+
+def subtract_backgrounds(fel_shot, edge_rois, background, roi_backgrounds):
+    """
+    Update the backgrounds and subtract them from FEL shots, for all the ROIs with edge finding.
+    :param edge_rois: List of (output channel prefix, profile, background key): the key is None for the signal ROI
+    (background), or (name, ROI) for named ROIs (roi_backgrounds[key]).
+    :param roi_backgrounds: Dictionary {(name, ROI): BackgroundModel}. Models of new named ROIs are added with the same
+    parameters as the signal ROI background, models of removed or changed ROIs are dropped.
+    :return: List with the background subtracted profile (or None) of each ROI.
+    """
+    edge_profiles = []
+
+    for _, profile, key in edge_rois:
+
+        if key is None:
+            model = background
+        else:
+            model = roi_backgrounds.get(key)
 
+            if model is None:
+                model = roi_backgrounds[key] = BackgroundModel(*background.requested_parameters)
+            else:
+                model.configure(*background.requested_parameters)
 
-def get_roi_x_profile(image, roi):
-    offset_x, size_x, offset_y, size_y = roi
-    roi_image = image[offset_y:offset_y + size_y, offset_x:offset_x + size_x]
+        edge_profiles.append(subtract_background(fel_shot, profile, model))
 
-    return roi_image.sum(0)
+    used_keys = set(key for _, _, key in edge_rois if key is not None)
 
+    if len(roi_backgrounds) > len(used_keys):
+        for key in [key for key in roi_backgrounds if key not in used_keys]:
+            del roi_backgrounds[key]
 
-def find_edge(data, step_length=50, edge_type='falling', refinement=1):
-    # refine data
-    def _interp(fp, xp, x):  # utility function to be used with apply_along_axis
-        return np.interp(x, xp, fp)
+    return edge_profiles
 
-    data_length = data.shape[1]
-    refined_data = np.apply_along_axis(
-        _interp,
-        axis=1,
-        arr=data,
-        x=np.arange(0, data_length - 1, refinement),
-        xp=np.arange(data_length),
-    )
 
-    # prepare a step function and refine it
-    step_waveform = np.ones(shape=(step_length,))
-    if edge_type == 'rising':
-        step_waveform[: int(step_length / 2)] = -1
-    elif edge_type == 'falling':
-        step_waveform[int(step_length / 2) :] = -1
+def process_frame(pulse_id, image, image_property_name, roi_config, background, background_turn=None,
+                  shot_classifier=None, channels=None, metrics=None, roi_backgrounds=None, calibration=None):
+    """
+    Process the image with a prepared ROI configuration, the same way as process_image. All the ROIs, including the
+    named ones, are projected in a single pass over the image.
+    :param roi_config: RoiConfig with the ROIs to process.
+    :param roi_backgrounds: Dictionary {(name, ROI): BackgroundModel} with the backgrounds of the named ROIs with edge
+    finding, kept between images. None to start with empty backgrounds.
+    :param calibration: Calibration active for the image shape, to correct the ROIs with. None to process the raw image.
+    :return: Dictionary with the processed data.
+    """
+    if shot_classifier is None:
+        shot_classifier = get_default_processing_parameters()["shot_classifier"]
 
-    step_waveform = np.interp(
-        x=np.arange(0, step_length - 1, refinement),
-        xp=np.arange(step_length),
-        fp=step_waveform,
-    )
+    if roi_backgrounds is None:
+        roi_backgrounds = {}
 
-    # find edges
-    xcorr = np.apply_along_axis(np.correlate, 1, refined_data, v=step_waveform, mode='valid')
-    edge_position = np.argmax(xcorr, axis=1).astype(float) * refinement
-    xcorr_amplitude = np.amax(xcorr, axis=1)
+    processed_data = dict()
 
-    # correct edge_position for step_length
-    edge_position += np.floor(step_length / 2)
+    processed_data[image_property_name + ".processing_parameters"] = roi_config.processing_parameters
 
-    return {'edge_pos': edge_position, 'xcorr_ampl': xcorr_amplitude}
+    start_time = monotonic()
+    profiles = profile_engine.get_projections(image, roi_config.rois, roi_config.projections, calibration)
+    signal_profile, background_profile = profiles[:2]
 
+    if metrics is not None:
+        metrics.observe("profiles", monotonic() - start_time)
 
-def process_image(pulse_id, image, image_property_name, roi_signal, roi_background):
-    processed_data = dict()
+    fel_shot = classify_shot(pulse_id, signal_profile, channels, shot_classifier)
 
-    processed_data[image_property_name + ".processing_parameters"] = json.dumps({"roi_signal": roi_signal,
-                                                                                 "roi_background": roi_background})
+    if fel_shot is not None:
+        processed_data[image_property_name + ".fel_shot"] = fel_shot
 
-    if roi_signal:
-        signal_profile = get_roi_x_profile(image, roi_signal)
+    edge_rois = []
+
+    if roi_config.roi_signal:
         processed_data[image_property_name + ".roi_signal_x_profile"] = signal_profile
+        edge_rois.append((image_property_name + ".", signal_profile, None))
 
-        if pulse_id%4 == 0:
-            # fel shot
-            if background:
-                avg_background = sum(background) / len(background)
-                output = find_edge(signal_profile - avg_background)
-            else:
-                output['edge_pos'] = np.nan
-                output['xcorr_ampl'] = np.nan
-        else:
-            background.append(signal_profile)
-            output['edge_pos'] = np.nan
-            output['xcorr_ampl'] = np.nan
+    if roi_config.roi_background:
+        processed_data[image_property_name + ".roi_background_x_profile"] = background_profile
 
-        processed_data[image_property_name + ".edge_position"] = output['edge_pos']
-        processed_data[image_property_name + ".cross_correlation_amplitude"] = output['xcorr_ampl']
+    for (name, roi, projection, edge_finding, moments), profile in zip(roi_config.named_rois, profiles[2:]):
 
-    if roi_background:
-        processed_data[image_property_name + ".roi_background_x_profile"] = get_roi_x_profile(image, roi_background)
+        # Named ROIs completely outside of the image are empty.
+        if not roi:
+            continue
 
-    return processed_data
+        channel_prefix = image_property_name + ".roi_" + name + "_"
 
+        if moments:
+            x_profile, y_profile, intensity, max_pixel = profile
+            profile = x_profile if projection == "x" else y_profile if projection == "y" else intensity
 
-def get_stream_processor(input_stream_host, input_stream_port, data_output_stream_port,
-                         image_output_stream_port, epics_pv_name_prefix):
-    def stream_processor(running_flag, roi_signal, roi_background, statistics):
-        try:
-            running_flag.set()
+            x_center, x_rms = get_profile_moments(x_profile, roi[0])
+            y_center, y_rms = get_profile_moments(y_profile, roi[2])
+
+            processed_data[channel_prefix + "x_profile"] = x_profile
+            processed_data[channel_prefix + "y_profile"] = y_profile
+            processed_data[channel_prefix + "intensity"] = intensity
+            processed_data[channel_prefix + "max_pixel"] = max_pixel
+            processed_data[channel_prefix + "x_center"] = x_center
+            processed_data[channel_prefix + "y_center"] = y_center
+            processed_data[channel_prefix + "x_rms"] = x_rms
+            processed_data[channel_prefix + "y_rms"] = y_rms
+
+        processed_data[channel_prefix + ("sum" if projection == "sum" else projection + "_profile")] = profile
 
-            _logger.info("Connecting to input_stream_host %s and input_stream_port %s.",
-                         input_stream_host, input_stream_port)
+        if edge_finding:
+            edge_rois.append((channel_prefix, profile, (name, roi)))
 
-            _logger.info("Sending out data on stream port %s.", data_output_stream_port)
+    if not edge_rois:
+        return processed_data
 
-            with source(host=input_stream_host, port=input_stream_port, mode=PULL,
-                        queue_size=config.INPUT_STREAM_QUEUE_SIZE,
-                        receive_timeout=config.INPUT_STREAM_RECEIVE_TIMEOUT) as input_stream:
+    # The time waiting for the background turn is not part of the background update.
+    if background_turn is None:
+        start_time = monotonic()
+        edge_profiles = subtract_backgrounds(fel_shot, edge_rois, background, roi_backgrounds)
+    else:
+        with background_turn:
+            start_time = monotonic()
+            edge_profiles = subtract_backgrounds(fel_shot, edge_rois, background, roi_backgrounds)
 
-                with sender(port=data_output_stream_port,
-                            send_timeout=config.DATA_OUTPUT_STREAM_SEND_TIMEOUT) as data_output_stream:
+    if metrics is not None:
+        metrics.observe("background", monotonic() - start_time)
 
-                    with sender(port=image_output_stream_port, block=False,
-                                queue_size=config.IMAGE_OUTPUT_STREAM_QUEUE_SIZE) as image_output_stream:
+    for (channel_prefix, _, _), edge_profile in zip(edge_rois, edge_profiles):
 
-                        statistics["processing_start_time"] = str(datetime.datetime.now())
-                        statistics["last_sent_pulse_id"] = None
-                        statistics["last_sent_time"] = None
-                        statistics["n_processed_images"] = 0
+        if edge_profile is not None:
+            start_time = monotonic()
+            output = find_edge(edge_profile, **roi_config.edge_finder)
 
-                        image_property_name = epics_pv_name_prefix + config.EPICS_PV_SUFFIX_IMAGE
+            if metrics is not None:
+                metrics.observe("edge_finding", monotonic() - start_time)
+        else:
+            output = {'edge_pos': np.nan, 'xcorr_ampl': np.nan}
+
+        processed_data[channel_prefix + "edge_position"] = output['edge_pos']
+        processed_data[channel_prefix + "cross_correlation_amplitude"] = output['xcorr_ampl']
+
+    return processed_data
+
+
+def process_batch(pulse_ids, images, roi_signal, roi_background, background_parameters=None, shot_classifier=None,
+                  channels=None, step_length=50, edge_type="falling", refinement=1, peak_fit=None,
+                  chunk_size=config.BATCH_CHUNK_SIZE):
+    """
+    Process a batch of images at once, with the same results as process_image called on each image in order (starting
+    with an empty background). The profiles of all the images are stacked, so the background estimation and the edge
+    finding run on whole arrays instead of image by image.
+    :param pulse_ids: Array with the pulse id of each image.
+    :param images: 3D array of images, in the order they were acquired. Can be memory mapped.
+    :param background_parameters: Background parameters, None for the default ones.
+    :param shot_classifier: Shot classifier parameters, None for the default ones.
+    :param channels: Dictionary {channel name: array with one value per image} for the shot classifier.
+    :param peak_fit: Sub-pixel fit of the cross-correlation maximum, see find_edge.
+    :param chunk_size: Maximum number of images summed or edge searched at once.
+    :return: Dictionary with the arrays "pulse_id", "fel_shot", "background_shot", and if the corresponding ROI is set,
+    "roi_signal_x_profile", "edge_position", "cross_correlation_amplitude" and "roi_background_x_profile".
+    """
+    default_parameters = get_default_processing_parameters()
+
+    background_parameters = background_parameters or default_parameters["background"]
+    shot_classifier = shot_classifier or default_parameters["shot_classifier"]
+
+    validate_roi(roi_signal)
+    validate_roi(roi_background)
+    validate_background_parameters(background_parameters)
+    validate_shot_classifier_parameters(shot_classifier)
+
+    pulse_ids = np.asarray(pulse_ids)
+    images = np.asarray(images) if not isinstance(images, np.ndarray) else images
+
+    if images.ndim != 3 or len(images) != len(pulse_ids):
+        raise ValueError("Images must be a 3D array with one image per pulse id, but an array of shape %s was given "
+                         "for %d pulse ids." % (images.shape, len(pulse_ids)))
+
+    signal_profiles = get_batch_x_profiles(images, roi_signal, chunk_size) if roi_signal else None
+
+    fel_shots, background_shots = classify_shots(pulse_ids, signal_profiles, channels, shot_classifier)
+
+    result = {"pulse_id": pulse_ids,
+              "fel_shot": fel_shots,
+              "background_shot": background_shots}
+
+    if roi_signal:
+        result["roi_signal_x_profile"] = signal_profiles
 
-                        _logger.info("Using image property name '%s'.", image_property_name)
+        edge_position = np.full(len(pulse_ids), np.nan)
+        xcorr_amplitude = np.full(len(pulse_ids), np.nan)
 
-                        while running_flag.is_set():
+        # Number of background shots acquired before each FEL shot.
+        fel_indices = np.flatnonzero(fel_shots)
+        n_previous = np.cumsum(background_shots)[fel_indices] - background_shots[fel_indices]
 
-                            message = input_stream.receive()
+        fel_indices = fel_indices[n_previous > 0]
 
-                            if message is None:
-                                continue
+        background_estimates = get_background_estimates(signal_profiles[background_shots], n_previous[n_previous > 0],
+                                                        background_parameters["mode"],
+                                                        background_parameters["depth"])
 
-                            pulse_id = message.data.pulse_id
-                            timestamp = (message.data.global_timestamp, message.data.global_timestamp_offset)
+        for start in range(0, len(fel_indices), chunk_size):
+            indices = fel_indices[start:start + chunk_size]
+            edge_profiles = signal_profiles[indices] - background_estimates[start:start + chunk_size]
 
-                            _logger.debug("Received message with pulse_id %s", pulse_id)
+            output = find_edge(edge_profiles, step_length=step_length, edge_type=edge_type, refinement=refinement,
+                               peak_fit=peak_fit)
 
-                            image = message.data.data[image_property_name].value
-                            processed_data = process_image(pulse_id, image, image_property_name, roi_signal, roi_background)
+            edge_position[indices] = output['edge_pos']
+            xcorr_amplitude[indices] = output['xcorr_ampl']
+
+        result["edge_position"] = edge_position
+        result["cross_correlation_amplitude"] = xcorr_amplitude
+
+    if roi_background:
+        result["roi_background_x_profile"] = get_batch_x_profiles(images, roi_background, chunk_size)
+
+    return result
+
+
+class StreamProcessor(object):
+    """
+    Processes the images of one camera stream. All the processing state (background) belongs to the instance, so
+    multiple processors can run in the same process without interfering with each other.
+
+    The processing runs in stages connected by bounded queues: receive (input stream), compute (a pool of n_workers
+    threads), data send and image send (one thread per output stream), so a slow output does not stall receiving and
+    processing. The output queues have their own size and drop policy, by default dropping the oldest results instead
+    of blocking the processing. The results of parallel workers are sent out in the order the images were received.
+    """
+
+    def __init__(self, input_stream_host, input_stream_port, data_output_stream_port, image_output_stream_port,
+                 epics_pv_name_prefix, queue_size=config.DEFAULT_PIPELINE_QUEUE_SIZE,
+                 drop_policy=config.DEFAULT_PIPELINE_DROP_POLICY, n_workers=config.DEFAULT_N_WORKERS,
+                 max_reorder_latency=config.DEFAULT_MAX_REORDER_LATENCY, raw_receive=config.DEFAULT_RAW_RECEIVE,
+                 output_queue_size=config.DEFAULT_OUTPUT_QUEUE_SIZE,
+                 output_drop_policy=config.DEFAULT_OUTPUT_DROP_POLICY,
+                 output_high_water_mark=config.DEFAULT_OUTPUT_HIGH_WATER_MARK):
+
+        self.input_stream_host = input_stream_host
+        self.input_stream_port = input_stream_port
+        self.data_output_stream_port = data_output_stream_port
+        self.image_output_stream_port = image_output_stream_port
+        self.epics_pv_name_prefix = epics_pv_name_prefix
+
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.n_workers = n_workers
+        self.max_reorder_latency = max_reorder_latency
+        self.raw_receive = raw_receive
+        self.output_queue_size = output_queue_size
+        self.output_drop_policy = output_drop_policy
+        self.output_high_water_mark = output_high_water_mark
+
+        self.image_property_name = epics_pv_name_prefix + config.EPICS_PV_SUFFIX_IMAGE
+
+        self.background = BackgroundModel()
+        self.metrics = ProcessingMetrics()
+        self.catch_up = CatchUp()
+
+        # Backgrounds of the named ROIs with edge finding: {(name, ROI): BackgroundModel}
+        self.roi_backgrounds = {}
+
+        # (ROI config, image shape, ROI config resolved for the image shape) of the last resolved ROIs.
+        self.resolved_rois = None
+
+        # Last calibration not matching the image shape, to warn only once about it.
+        self.mismatched_calibration = None
+
+        # Layout of the last data output message.
+        self.output_layout = None
+
+        # Pipeline of the current run, created on every (re)start.
+        self.compute_queue = None
+        self.data_output_queue = None
+        self.image_output_queue = None
+        self.reorder_buffer = None
+        self.sequencer = None
+        self.dispatch_lock = None
+        self.sequence_counter = None
+
+    def __call__(self, running_flag, statistics, processing_parameters=None):
+        try:
+            if processing_parameters is None:
+                processing_parameters = get_default_processing_parameters()
+
+            self.reset_pipeline(running_flag)
+
+            # The statistics are reset before the processing is reported as started.
+            statistics.start(sources=[self.get_pipeline_statistics, self.metrics.get_summary,
+                                      self.catch_up.get_summary])
+            running_flag.set()
 
-                            # Send out processed data.
-                            try:
-                                data_output_stream.send(pulse_id=pulse_id,
-                                                        timestamp=timestamp,
-                                                        data=processed_data)
+            _logger.info("Using image property name '%s'.", self.image_property_name)
+            _logger.info("Processing images with %d workers.", self.n_workers)
 
-                                _logger.debug("Sent data message with pulse_id %s", pulse_id)
+            def compute():
+                self.compute(running_flag, processing_parameters)
 
-                                statistics["last_sent_pulse_id"] = pulse_id
-                                statistics["last_sent_time"] = str(datetime.datetime.now())
-                                statistics["n_processed_images"] = statistics.get("n_processed_images", 0) + 1
+            stages = [StageThread("receive", lambda: self.receive(running_flag, processing_parameters), running_flag),
+                      StageThread("data_send", lambda: self.send_data(running_flag, statistics), running_flag),
+                      StageThread("image_send", lambda: self.send_images(running_flag), running_flag)]
 
-                            except Again:
-                                pass
+            # The calling thread is the first worker.
+            stages.extend(StageThread("compute_%d" % index, compute, running_flag)
+                          for index in range(1, self.n_workers))
 
-                            # Send out image.
-                            try:
-                                image_output_stream.send(pulse_id=pulse_id,
-                                                         timestamp=timestamp,
-                                                         data={image_property_name: image})
+            for stage in stages:
+                stage.start()
 
-                                _logger.debug("Sent image message with pulse_id %s", pulse_id)
+            try:
+                compute()
+            finally:
+                running_flag.clear()
 
-                            except Again:
-                                pass
+                for stage in stages:
+                    stage.join()
+
+            for stage in stages:
+                if stage.error is not None:
+                    raise stage.error
 
         except Exception as e:
             _logger.error("Error while processing the stream. Exiting. Error: ", e)
@@ -175,4 +393,337 @@ def get_stream_processor(input_stream_host, input_stream_port, data_output_strea
 
             raise
 
-    return stream_processor
+    def reset_pipeline(self, running_flag):
+        """
+        Create the queues and the state of a processing run, so every (re)start begins empty.
+        """
+        self.compute_queue = StageQueue(self.queue_size, self.drop_policy)
+        self.data_output_queue = StageQueue(self.output_queue_size, self.output_drop_policy)
+        self.image_output_queue = StageQueue(self.output_queue_size, self.output_drop_policy)
+
+        self.reorder_buffer = ReorderBuffer(output=lambda result: self.queue_output(result, running_flag),
+                                            max_latency=self.max_reorder_latency)
+        self.sequencer = Sequencer(running_flag, config.PIPELINE_QUEUE_TIMEOUT)
+        self.dispatch_lock = Lock()
+        self.sequence_counter = count()
+        self.metrics = ProcessingMetrics()
+        self.catch_up = CatchUp()
+        self.resolved_rois = None
+        self.mismatched_calibration = None
+        self.output_layout = None
+
+        self.background.reset()
+        self.roi_backgrounds = {}
+
+    def receive(self, running_flag, processing_parameters):
+
+        _logger.info("Connecting to input_stream_host %s and input_stream_port %s.",
+                     self.input_stream_host, self.input_stream_port)
+
+        with source(host=self.input_stream_host, port=self.input_stream_port, mode=PULL,
+                    queue_size=config.INPUT_STREAM_QUEUE_SIZE,
+                    receive_timeout=config.INPUT_STREAM_RECEIVE_TIMEOUT) as input_stream:
+
+            receive_handler = None
+
+            # Only the channels used by the processing are decoded.
+            if self.raw_receive:
+                receive_handler = RawMessageHandler(
+                    lambda channel_names: self.get_decoded_channels(channel_names, processing_parameters)).receive
+
+            wait_start_time = monotonic()
+
+            while running_flag.is_set():
+
+                message = input_stream.receive(handler=receive_handler)
+
+                if message is None:
+                    continue
+
+                self.metrics.observe("receive_wait", monotonic() - wait_start_time)
+
+                pulse_id = message.data.pulse_id
+                self.metrics.check_pulse_id(pulse_id)
+                timestamp = (message.data.global_timestamp, message.data.global_timestamp_offset)
+
+                _logger.debug("Received message with pulse_id %s", pulse_id)
+
+                image = message.data.data[self.image_property_name].value
+                shot_classifier = processing_parameters["shot_classifier"]
+
+                channels = {}
+                for channel_name in get_classifier_channels(shot_classifier):
+                    if channel_name in message.data.data:
+                        channels[channel_name] = message.data.data[channel_name].value
+
+                # Calibration frames are recorded from the raw images, before any processing.
+                calibration_recorder = processing_parameters["calibration_recorder"]
+                if calibration_recorder is not None and not calibration_recorder.done:
+                    calibration_recorder.add(image)
+
+                catch_up_parameters = processing_parameters["catch_up"]
+
+                # Without a profile, only the shots classified by pulse_id or channel are known to be FEL shots.
+                fel_shot = None
+                if catch_up_parameters["mode"] == "fel":
+                    fel_shot = classify_shot(pulse_id, None, channels, shot_classifier)
+
+                if not self.catch_up.process(pulse_id, get_message_lag(timestamp),
+                                             len(self.compute_queue) >= self.queue_size, fel_shot,
+                                             catch_up_parameters):
+                    wait_start_time = monotonic()
+                    continue
+
+                # The forwarded channels reference the received values, they are not copied.
+                forwarded_data = {}
+                forwarded_patterns = processing_parameters["channel_forwarding"]["channels"]
+
+                if forwarded_patterns:
+                    append_message_data(message, forwarded_data,
+                                        get_forwarded_channels(tuple(forwarded_patterns), tuple(message.data.data),
+                                                               self.image_property_name))
+
+                put_while_running(self.compute_queue, (pulse_id, timestamp, image, channels, forwarded_data),
+                                  running_flag, config.PIPELINE_QUEUE_TIMEOUT)
+
+                wait_start_time = monotonic()
+
+    def get_decoded_channels(self, channel_names, processing_parameters):
+        """
+        Get the input channels the receive stage needs: the image, the shot classifier channels and the forwarded
+        channels.
+        :param channel_names: Tuple with the names of the channels in the input stream.
+        :return: Tuple with the names of the channels to decode.
+        """
+        return ((self.image_property_name,) +
+                tuple(get_classifier_channels(processing_parameters["shot_classifier"])) +
+                get_forwarded_channels(tuple(processing_parameters["channel_forwarding"]["channels"]), channel_names,
+                                       self.image_property_name))
+
+    def compute(self, running_flag, processing_parameters):
+
+        while running_flag.is_set():
+
+            # Sequence numbers are given in the order the frames leave the queue.
+            with self.dispatch_lock:
+                frame = self.compute_queue.get(timeout=config.PIPELINE_QUEUE_TIMEOUT)
+                sequence = next(self.sequence_counter) if frame is not None else None
+
+            if frame is None:
+                self.reorder_buffer.flush()
+                continue
+
+            pulse_id, timestamp, image, channels, forwarded_data = frame
+            background_turn = self.sequencer.turn(sequence)
+
+            # Everything after taking the turn must pass it, even if the frame fails.
+            try:
+                # The ROI config is read once, so the whole frame is processed with the same ROIs.
+                roi_config = processing_parameters["rois"]
+
+                if roi_config.image_shape != image.shape:
+                    roi_config = self.resolve_rois(roi_config, image.shape, processing_parameters)
+
+                calibration = self.get_calibration(processing_parameters["calibration"], image.shape)
+
+                background_parameters = processing_parameters["background"]
+                self.background.configure(background_parameters["mode"], background_parameters["depth"])
+
+                processed_data = process_frame(pulse_id, image, self.image_property_name, roi_config,
+                                               self.background, background_turn,
+                                               processing_parameters["shot_classifier"], channels, self.metrics,
+                                               self.roi_backgrounds, calibration)
+
+            finally:
+                # Frames without background update still have to pass their turn.
+                if not background_turn.done:
+                    with background_turn:
+                        pass
+
+            layout_key = get_output_layout_key(roi_config, image, calibration, processed_data, forwarded_data)
+
+            # The processed data takes precedence over forwarded channels with the same name.
+            if forwarded_data:
+                forwarded_data.update(processed_data)
+                processed_data = forwarded_data
+
+            output_layout = self.get_output_layout(layout_key, processed_data)
+
+            fel_shot = processed_data.get(self.image_property_name + ".fel_shot", False)
+            image_data = get_forwarded_image(sequence, fel_shot, image, self.image_property_name, roi_config,
+                                             processing_parameters["image_forwarding"])
+
+            self.reorder_buffer.add(sequence, (pulse_id, timestamp, processed_data, output_layout, image_data))
+
+    def resolve_rois(self, roi_config, image_shape, processing_parameters):
+        """
+        Get the ROI config clipped to the image shape. Only done when the ROIs or the image shape change: the resolved
+        config is cached, the config set by the manager is never clipped.
+        """
+        resolved_rois = self.resolved_rois
+
+        if resolved_rois is not None and resolved_rois[0] is roi_config and resolved_rois[1] == image_shape:
+            return resolved_rois[2]
+
+        resolved_config = roi_config.resolve(image_shape)
+
+        if resolved_config.rois != roi_config.rois:
+            _logger.warning("ROIs %s do not fit in the image of shape %s, using %s.",
+                            roi_config, image_shape, resolved_config)
+
+        if processing_parameters["image_shape"] != image_shape:
+            _logger.info("Receiving images of shape %s.", image_shape)
+            processing_parameters["image_shape"] = image_shape
+
+        self.resolved_rois = (roi_config, image_shape, resolved_config)
+
+        return resolved_config
+
+    def get_output_layout(self, layout_key, processed_data):
+        """
+        Get the layout of the data output message, reused for all the messages of the same configuration.
+        """
+        output_layout = self.output_layout
+
+        if output_layout is None or output_layout.key != layout_key:
+            output_layout = self.output_layout = OutputLayout(layout_key, processed_data)
+            _logger.info("Sending %d channels on the data output stream.", len(output_layout))
+
+        return output_layout
+
+    def get_calibration(self, calibration, image_shape):
+        """
+        Get the calibration to correct the image with, None if it does not apply to the image.
+        """
+        if calibration.is_active(image_shape):
+            return calibration
+
+        if calibration.enabled and calibration.shape is not None and self.mismatched_calibration is not calibration:
+            _logger.warning("Calibration frames of shape %s do not match the image shape %s, processing the raw "
+                            "images.", calibration.shape, image_shape)
+            self.mismatched_calibration = calibration
+
+        return None
+
+    def queue_output(self, result, running_flag):
+        """
+        Queue a processed frame for the output streams. Called in the order the images were received.
+        """
+        pulse_id, timestamp, processed_data, output_layout, image_data = result
+
+        put_while_running(self.data_output_queue, (pulse_id, timestamp, processed_data, output_layout), running_flag,
+                          config.PIPELINE_QUEUE_TIMEOUT)
+
+        if image_data is not None:
+            put_while_running(self.image_output_queue, (pulse_id, timestamp, image_data), running_flag,
+                              config.PIPELINE_QUEUE_TIMEOUT)
+
+    def send_data(self, running_flag, statistics):
+
+        _logger.info("Sending out data on stream port %s.", self.data_output_stream_port)
+
+        with sender(port=self.data_output_stream_port, queue_size=self.output_high_water_mark,
+                    send_timeout=config.DATA_OUTPUT_STREAM_SEND_TIMEOUT) as data_output_stream:
+
+            # Layout of the last message sent, described by the current data header of the sender.
+            sent_layout = None
+
+            while running_flag.is_set():
+
+                output = self.data_output_queue.get(timeout=config.PIPELINE_QUEUE_TIMEOUT)
+
+                if output is None:
+                    continue
+
+                pulse_id, timestamp, processed_data, output_layout = output
+
+                # The sender checks the data against its data header only when the layout changes.
+                check_data = output_layout is not sent_layout
+
+                start_time = monotonic()
+                try:
+                    data_output_stream.send(pulse_id=pulse_id,
+                                            timestamp=timestamp,
+                                            data=processed_data,
+                                            check_data=check_data)
+
+                    if check_data:
+                        self.metrics.data_output_layout_changes += 1
+                        sent_layout = output_layout
+
+                    _logger.debug("Sent data message with pulse_id %s", pulse_id)
+
+                    self.metrics.sent_frames.mark()
+                    statistics.frame_sent(pulse_id)
+
+                except Again:
+                    self.metrics.data_output_dropped += 1
+
+                self.metrics.observe("data_send", monotonic() - start_time)
+
+    def send_images(self, running_flag):
+
+        _logger.info("Sending out images on stream port %s.", self.image_output_stream_port)
+
+        with sender(port=self.image_output_stream_port, block=False,
+                    queue_size=config.IMAGE_OUTPUT_STREAM_QUEUE_SIZE) as image_output_stream:
+
+            while running_flag.is_set():
+
+                output = self.image_output_queue.get(timeout=config.PIPELINE_QUEUE_TIMEOUT)
+
+                if output is None:
+                    continue
+
+                pulse_id, timestamp, image_data = output
+
+                start_time = monotonic()
+                try:
+                    image_output_stream.send(pulse_id=pulse_id,
+                                             timestamp=timestamp,
+                                             data=image_data)
+
+                    _logger.debug("Sent image message with pulse_id %s", pulse_id)
+
+                except Again:
+                    self.metrics.image_output_dropped += 1
+
+                self.metrics.observe("image_send", monotonic() - start_time)
+
+    def get_pipeline_statistics(self):
+        """
+        Get the occupancy and the number of dropped frames of the pipeline queues and the reorder buffer.
+        """
+        return {"compute_queue_occupancy": len(self.compute_queue),
+                "compute_queue_dropped": self.compute_queue.n_dropped,
+                "data_output_queue_occupancy": len(self.data_output_queue),
+                "data_output_queue_dropped": self.data_output_queue.n_dropped,
+                "image_output_queue_occupancy": len(self.image_output_queue),
+                "image_output_queue_dropped": self.image_output_queue.n_dropped,
+                "reorder_buffer_occupancy": len(self.reorder_buffer),
+                "reorder_buffer_dropped": self.reorder_buffer.n_dropped}
+
+
+def get_stream_processor(input_stream_host, input_stream_port, data_output_stream_port,
+                         image_output_stream_port, epics_pv_name_prefix,
+                         queue_size=config.DEFAULT_PIPELINE_QUEUE_SIZE,
+                         drop_policy=config.DEFAULT_PIPELINE_DROP_POLICY,
+                         n_workers=config.DEFAULT_N_WORKERS,
+                         max_reorder_latency=config.DEFAULT_MAX_REORDER_LATENCY,
+                         raw_receive=config.DEFAULT_RAW_RECEIVE,
+                         output_queue_size=config.DEFAULT_OUTPUT_QUEUE_SIZE,
+                         output_drop_policy=config.DEFAULT_OUTPUT_DROP_POLICY,
+                         output_high_water_mark=config.DEFAULT_OUTPUT_HIGH_WATER_MARK):
+    return StreamProcessor(input_stream_host=input_stream_host,
+                           input_stream_port=input_stream_port,
+                           data_output_stream_port=data_output_stream_port,
+                           image_output_stream_port=image_output_stream_port,
+                           epics_pv_name_prefix=epics_pv_name_prefix,
+                           queue_size=queue_size,
+                           drop_policy=drop_policy,
+                           n_workers=n_workers,
+                           max_reorder_latency=max_reorder_latency,
+                           raw_receive=raw_receive,
+                           output_queue_size=output_queue_size,
+                           output_drop_policy=output_drop_policy,
+                           output_high_water_mark=output_high_water_mark)
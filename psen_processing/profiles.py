@@ -0,0 +1,301 @@
+from functools import lru_cache
+from threading import local
+
+import numpy as np
+
+from psen_processing import config
+
+
+def get_roi_x_profile(image, roi):
+    offset_x, size_x, offset_y, size_y = roi
+    roi_image = image[offset_y:offset_y + size_y, offset_x:offset_x + size_x]
+
+    return roi_image.sum(0)
+
+
+@lru_cache(maxsize=config.PROFILE_CACHE_SIZE)
+def get_accumulator_dtype(image_dtype, n_rows):
+    """
+    Get the narrowest dtype able to sum n_rows pixels of the image dtype without overflow.
+    Narrower accumulators mean less memory traffic and wider SIMD operations.
+    """
+    image_dtype = np.dtype(image_dtype)
+
+    if image_dtype.kind in "ui":
+        image_info = np.iinfo(image_dtype)
+
+        for accumulator_dtype in ((np.uint32, np.uint64) if image_dtype.kind == "u" else (np.int32, np.int64)):
+            accumulator_info = np.iinfo(accumulator_dtype)
+
+            if image_info.max * n_rows <= accumulator_info.max and image_info.min * n_rows >= accumulator_info.min:
+                return np.dtype(accumulator_dtype)
+
+    return np.dtype(config.PROFILE_FLOAT_ACCUMULATOR_DTYPE)
+
+
+def get_batch_x_profiles(images, roi, chunk_size=config.BATCH_CHUNK_SIZE):
+    """
+    Sum the columns of the ROI in a batch of images.
+    :param images: 3D array of images (can be memory mapped - only the ROI of chunk_size images is read at once).
+    :param roi: ROI [offset_x, size_x, offset_y, size_y].
+    :return: 2D array with one X profile per image.
+    """
+    offset_x, size_x, offset_y, size_y = roi
+    roi_images = images[:, offset_y:offset_y + size_y, offset_x:offset_x + size_x]
+
+    accumulator_dtype = get_accumulator_dtype(images.dtype, roi_images.shape[1])
+    profiles = np.empty((roi_images.shape[0], roi_images.shape[2]), dtype=accumulator_dtype)
+
+    for start in range(0, len(profiles), chunk_size):
+        np.sum(roi_images[start:start + chunk_size], axis=1, dtype=accumulator_dtype,
+               out=profiles[start:start + chunk_size])
+
+    return profiles
+
+
+ROI_PROJECTIONS = ("x", "y", "sum")
+
+
+@lru_cache(maxsize=config.PROFILE_CACHE_SIZE)
+def get_pixel_positions(offset, length):
+    """
+    Get the image coordinates of the elements of a profile.
+    """
+    positions = np.arange(offset, offset + length, dtype=np.float64)
+    positions.flags.writeable = False
+
+    return positions
+
+
+def get_profile_moments(profile, offset):
+    """
+    Get the center of mass and the RMS width of a profile.
+    :param profile: X or Y profile.
+    :param offset: Image coordinate of the first element of the profile.
+    :return: Tuple (center, RMS width), in image pixels. NaN for profiles without intensity.
+    """
+    total = profile.sum(dtype=np.float64)
+
+    if total == 0:
+        return np.nan, np.nan
+
+    positions = get_pixel_positions(offset, len(profile))
+
+    center = positions.dot(profile) / total
+    variance = ((positions - center) ** 2).dot(profile) / total
+
+    return center, np.sqrt(max(variance, 0))
+
+
+class ProfilePlan(object):
+    """
+    Precomputed way to project multiple ROIs in one pass over the image.
+
+    The image rows are split in bands at every ROI row boundary. In each band, the column ranges of the ROIs covering it
+    are merged into groups, and the columns of each group are summed only once. ROIs sharing rows therefore read each
+    pixel only once for their X profiles. Y profiles sum the rows of their part of the band.
+    """
+
+    def __init__(self, rois, image_shape, projections=None):
+        """
+        :param rois: List of ROIs [offset_x, size_x, offset_y, size_y], or empty lists.
+        :param image_shape: Shape of the images, to clip the ROIs the same way numpy slicing does.
+        :param projections: Projection of each ROI, one of ROI_PROJECTIONS or "moments". None for X profiles of all the
+        ROIs.
+        """
+        height, width = image_shape
+
+        self.projections = tuple(projections) if projections is not None else ("x",) * len(rois)
+
+        # Clipped [x_start, x_end, y_start, y_end) of each ROI, None for empty ROIs.
+        self.bounds = []
+
+        for roi in rois:
+            if not roi:
+                self.bounds.append(None)
+                continue
+
+            offset_x, size_x, offset_y, size_y = roi
+            self.bounds.append((min(offset_x, width), min(offset_x + size_x, width),
+                                min(offset_y, height), min(offset_y + size_y, height)))
+
+        # "sum" projections are the sum of their X profile, "moments" have an X profile and a Y profile.
+        self.profile_lengths = [(bounds[3] - bounds[2] if projection == "y" else bounds[1] - bounds[0]) if bounds else 0
+                                for bounds, projection in zip(self.bounds, self.projections)]
+
+        # Operations: (rows, group columns, [(roi index, start in group, end in group, first contribution)])
+        self.operations = []
+
+        active_bounds = [(index, bounds) for index, bounds in enumerate(self.bounds)
+                         if bounds and bounds[1] > bounds[0] and bounds[3] > bounds[2]]
+
+        row_boundaries = sorted(set(row for _, bounds in active_bounds for row in bounds[2:]))
+        initialized = set()
+
+        for y_start, y_end in zip(row_boundaries[:-1], row_boundaries[1:]):
+
+            covering = sorted((bounds[0], bounds[1], index) for index, bounds in active_bounds
+                              if bounds[2] <= y_start and y_end <= bounds[3])
+
+            groups = []
+            for x_start, x_end, index in covering:
+                if groups and x_start <= groups[-1][1]:
+                    groups[-1][1] = max(groups[-1][1], x_end)
+                    groups[-1][2].append((index, x_start, x_end))
+                else:
+                    groups.append([x_start, x_end, [(index, x_start, x_end)]])
+
+            for group_start, group_end, members in groups:
+                targets = []
+
+                for index, x_start, x_end in members:
+                    targets.append((index, x_start - group_start, x_end - group_start, index not in initialized))
+                    initialized.add(index)
+
+                self.operations.append((slice(y_start, y_end), slice(group_start, group_end), targets))
+
+        self.initialized = initialized
+
+
+@lru_cache(maxsize=config.PROFILE_CACHE_SIZE)
+def get_profile_plan(rois, image_shape, projections=None):
+    """
+    Get the cached profile plan.
+    :param rois: Tuple of ROI tuples.
+    :param image_shape: Shape of the images.
+    :param projections: Tuple with the projection of each ROI, None for X profiles.
+    """
+    return ProfilePlan(rois, image_shape, projections)
+
+
+class ProfileEngine(object):
+    """
+    Computes the projections of multiple ROIs with a fused pass over the image. Partial sums go into reused, per thread
+    scratch buffers; only the returned profiles are allocated per image, because they are handed over to the send stage.
+    """
+
+    def __init__(self):
+        self.local = local()
+
+    def _get_scratch(self, length, dtype):
+        buffers = getattr(self.local, "buffers", None)
+
+        if buffers is None:
+            buffers = self.local.buffers = {}
+
+        key = (length, dtype)
+        if key not in buffers:
+            buffers[key] = np.empty(length, dtype=dtype)
+
+        return buffers[key]
+
+    def get_x_profiles(self, image, rois):
+        """
+        Sum the columns of each ROI.
+        :param image: 2D image.
+        :param rois: List of ROIs [offset_x, size_x, offset_y, size_y], empty ROIs give None.
+        :return: List of X profiles, in the same order as the ROIs.
+        """
+        return self.get_projections(image, rois)
+
+    def get_projections(self, image, rois, projections=None, calibration=None):
+        """
+        Project each ROI.
+        :param image: 2D image.
+        :param rois: List of ROIs [offset_x, size_x, offset_y, size_y], empty ROIs give None.
+        :param projections: Projection of each ROI: "x" (sum of the columns), "y" (sum of the rows), "sum" (sum of all
+        the pixels) or "moments" (all of them, and the maximum pixel). None for X profiles of all the ROIs.
+        :param calibration: Calibration to correct the summed pixels with, None to sum the raw pixels. Only the blocks
+        of the image covered by the ROIs are corrected.
+        :return: List of projections (1D arrays, scalars for "sum", tuples (x profile, y profile, sum, maximum pixel)
+        for "moments"), in the same order as the ROIs.
+        """
+        plan = get_profile_plan(tuple(tuple(roi) if roi else () for roi in rois), image.shape,
+                                tuple(projections) if projections is not None else None)
+
+        height, width = image.shape
+
+        # Corrected pixels are floats.
+        pixel_dtype = np.dtype(config.CALIBRATION_DTYPE) if calibration is not None else image.dtype
+
+        accumulator_dtype = get_accumulator_dtype(pixel_dtype, height)
+        row_dtype = get_accumulator_dtype(pixel_dtype, width)
+
+        profiles = []
+
+        # Y profiles and maximum pixels of the "moments" projections: {roi index: value}
+        y_profiles = {}
+        max_pixels = {}
+
+        for index, roi in enumerate(rois):
+
+            if not roi:
+                profiles.append(None)
+                continue
+
+            projection = plan.projections[index]
+            dtype = row_dtype if projection == "y" else accumulator_dtype
+
+            # ROIs outside of the image are not summed, but still give a profile of zeros (as numpy does).
+            allocate = np.empty if index in plan.initialized else np.zeros
+            profiles.append(allocate(plan.profile_lengths[index], dtype=dtype))
+
+            if projection == "moments":
+                bounds = plan.bounds[index]
+                y_profiles[index] = allocate(bounds[3] - bounds[2], dtype=row_dtype)
+                max_pixels[index] = None
+
+        for rows, columns, targets in plan.operations:
+            block = image[rows, columns]
+            group_sum = None
+
+            if calibration is not None:
+                block = calibration.correct(block, rows, columns, self._get_scratch(block.shape, pixel_dtype))
+
+            for index, start, end, first in targets:
+
+                projection = plan.projections[index]
+
+                if projection == "y" or projection == "moments":
+                    roi_block = block[:, start:end]
+                    y_profile = profiles[index] if projection == "y" else y_profiles[index]
+
+                    row_start = rows.start - plan.bounds[index][2]
+                    np.sum(roi_block, axis=1, dtype=row_dtype, out=y_profile[row_start:row_start + block.shape[0]])
+
+                    if projection == "y":
+                        continue
+
+                    block_max = roi_block.max()
+                    if max_pixels[index] is None or block_max > max_pixels[index]:
+                        max_pixels[index] = block_max
+
+                if group_sum is None:
+
+                    if first and len(targets) == 1:
+                        np.sum(block, axis=0, dtype=accumulator_dtype, out=profiles[index])
+                        continue
+
+                    group_sum = self._get_scratch(block.shape[1], accumulator_dtype)
+                    np.sum(block, axis=0, dtype=accumulator_dtype, out=group_sum)
+
+                if first:
+                    profiles[index][:] = group_sum[start:end]
+                else:
+                    profiles[index] += group_sum[start:end]
+
+        sum_dtype = get_accumulator_dtype(pixel_dtype, height * width)
+
+        for index, projection in enumerate(plan.projections):
+
+            if profiles[index] is None:
+                continue
+
+            if projection == "sum":
+                profiles[index] = profiles[index].sum(dtype=sum_dtype)
+
+            elif projection == "moments":
+                profiles[index] = (profiles[index], y_profiles[index], profiles[index].sum(dtype=sum_dtype),
+                                   max_pixels[index])
+
+        return profiles
@@ -0,0 +1,179 @@
+import json
+from collections import namedtuple
+from logging import getLogger
+
+import numpy as np
+
+_logger = getLogger(__name__)
+
+# bsread type names which are not numpy dtype names.
+BSREAD_TYPES = {"double": "float64",
+                "float": "float32",
+                "long": "int64",
+                "ulong": "uint64",
+                "integer": "int32",
+                "int": "int32",
+                "uint": "uint32",
+                "short": "int16",
+                "ushort": "uint16",
+                "char": "int8",
+                "uchar": "uint8",
+                "bool": "bool"}
+
+CHANNEL_COMPRESSIONS = (None, "none", "bitshuffle_lz4", "lz4")
+
+# Same attributes as the decoded bsread messages, for the parts the processor reads.
+ChannelValue = namedtuple("ChannelValue", ["value"])
+MessageData = namedtuple("MessageData", ["pulse_id", "global_timestamp", "global_timestamp_offset", "data"])
+Message = namedtuple("Message", ["data"])
+
+
+def decompress(raw_data, compression, dtype):
+    """
+    Decompress a bsread data frame. The compression libraries are needed only if the stream is compressed.
+    :return: Uncompressed bytes or 1D array of the dtype.
+    """
+    if compression == "bitshuffle_lz4":
+        from bitshuffle import decompress_lz4
+
+        # Header: uncompressed size (8 bytes) and block size (4 bytes), both big endian, in bytes.
+        n_bytes = int.from_bytes(raw_data[:8], "big")
+        block_size = int.from_bytes(raw_data[8:12], "big") // dtype.itemsize
+
+        return decompress_lz4(np.frombuffer(raw_data, dtype=np.uint8, offset=12), (n_bytes // dtype.itemsize,),
+                              dtype, block_size)
+
+    elif compression == "lz4":
+        from lz4.block import decompress as decompress_block
+
+        # Header: uncompressed size (4 bytes, big endian).
+        return decompress_block(raw_data[4:], uncompressed_size=int.from_bytes(raw_data[:4], "big"))
+
+    return raw_data
+
+
+class ChannelDecoder(object):
+    """
+    Decodes the data frames of one channel, as described by its entry in the bsread data header.
+    """
+
+    def __init__(self, channel):
+        """
+        :param channel: Data header entry {"name", "type", "shape", "encoding", "compression"}.
+        """
+        self.name = channel["name"]
+        self.type = channel.get("type", "float64")
+        self.compression = channel.get("compression")
+
+        if self.compression not in CHANNEL_COMPRESSIONS:
+            raise ValueError("Compression of channel '%s' must be one of %s, but %s was given." %
+                             (self.name, CHANNEL_COMPRESSIONS, self.compression))
+
+        byte_order = ">" if channel.get("encoding") == "big" else "<"
+        self.dtype = np.dtype(BSREAD_TYPES.get(self.type, self.type) if self.type != "string" else "uint8")
+        self.dtype = self.dtype.newbyteorder(byte_order)
+
+        # bsread gives the shape as [width, height], numpy as (height, width).
+        self.shape = tuple(reversed(channel.get("shape") or [1]))
+
+    def decode(self, raw_data):
+        """
+        Decode a data frame. Uncompressed frames are not copied, the value is a read only view of the frame.
+        :return: Decoded value, None for an empty frame (channel without value in this message).
+        """
+        if not raw_data:
+            return None
+
+        data = decompress(raw_data, self.compression, self.dtype)
+
+        if self.type == "string":
+            return bytes(data).decode()
+
+        if not isinstance(data, np.ndarray):
+            data = np.frombuffer(data, dtype=self.dtype)
+
+        if self.shape == (1,):
+            return data[0]
+
+        return data.reshape(self.shape)
+
+
+class RawMessageHandler(object):
+    """
+    bsread receive handler which decodes only the channels the processing needs.
+
+    The data header is parsed only when its hash in the main header changes; for the other messages the frame is
+    received but not parsed. The frames of the channels which are not needed are received and dropped undecoded.
+    """
+
+    def __init__(self, get_channels):
+        """
+        :param get_channels: Function (tuple with the channel names of the stream) -> tuple with the names of the
+        channels to decode. Called for every message, so it should be cached on its arguments.
+        """
+        self.get_channels = get_channels
+
+        self.header_hash = None
+        self.channel_names = None
+        self.decoders = None
+
+        # Decoders of the requested channels {frame index: decoder}, for the last (header hash, requested channels).
+        self.plan_key = None
+        self.plan = None
+
+    def _parse_data_header(self, raw_data_header, compression):
+        data_header = json.loads(bytes(decompress(raw_data_header, compression, np.dtype("uint8"))).decode())
+
+        self.decoders = [ChannelDecoder(channel) for channel in data_header["channels"]]
+        self.channel_names = tuple(decoder.name for decoder in self.decoders)
+
+        _logger.info("Received new data header with %d channels.", len(self.decoders))
+
+    def _get_plan(self, requested_channels):
+        plan_key = (self.header_hash, requested_channels)
+
+        if plan_key != self.plan_key:
+            requested_channels = set(requested_channels)
+            self.plan = {index: decoder for index, decoder in enumerate(self.decoders)
+                         if decoder.name in requested_channels}
+            self.plan_key = plan_key
+
+        return self.plan
+
+    def receive(self, receiver):
+        """
+        Receive one message.
+        :param receiver: Multipart message receiver bsread passes to the handlers, with next(as_json) and has_more().
+        :return: Message with the requested channels only.
+        """
+        main_header = receiver.next(as_json=True)
+        raw_data_header = receiver.next()
+
+        if main_header["hash"] != self.header_hash or self.decoders is None:
+            self._parse_data_header(raw_data_header, main_header.get("dh_compression"))
+            self.header_hash = main_header["hash"]
+
+        plan = self._get_plan(tuple(self.get_channels(self.channel_names)))
+
+        data = {}
+        index = 0
+
+        # Each channel has a data and a timestamp frame. The channel timestamps are not used.
+        while receiver.has_more():
+            raw_data = receiver.next()
+
+            if receiver.has_more():
+                receiver.next()
+
+            decoder = plan.get(index)
+            if decoder is not None:
+                data[decoder.name] = ChannelValue(decoder.decode(raw_data))
+
+            index += 1
+
+        global_timestamp = main_header.get("global_timestamp", {})
+
+        return Message(MessageData(pulse_id=main_header["pulse_id"],
+                                   global_timestamp=global_timestamp.get("sec"),
+                                   global_timestamp_offset=global_timestamp.get("ns"),
+                                   data=data))
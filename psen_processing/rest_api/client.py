@@ -11,13 +11,16 @@ def validate_response(server_response):
 
 
 class PsenProcessingClient(object):
-    def __init__(self, address="http://sf-daqsync-02:11000/"):
+    def __init__(self, address="http://sf-daqsync-02:11000/", camera=None):
         """
         :param address: Address of the PSEN Processing service, e.g. http://localhost:11000
+        :param camera: Name of the camera to control, when the service is running in multi camera mode.
         """
 
-        self.api_address_format = address.rstrip("/") + config.API_PREFIX + "%s"
+        self.api_root_address = address.rstrip("/") + config.API_PREFIX
+        self.api_address_format = self.api_root_address + ("/" + camera if camera else "") + "%s"
         self.address = address
+        self.camera = camera
 
     def get_address(self):
         """
@@ -25,6 +28,22 @@ class PsenProcessingClient(object):
         """
         return self.address
 
+    def get_camera(self):
+        """
+        Return the name of the controlled camera (None in single camera mode).
+        """
+        return self.camera
+
+    def get_cameras(self):
+        """
+        Get the cameras of a multi camera service.
+        :return: Dictionary {camera_name: camera_status}.
+        """
+        rest_endpoint = "/cameras"
+
+        server_response = requests.get(self.api_root_address + rest_endpoint).json()
+        return validate_response(server_response)["cameras"]
+
     def start(self):
         """
         Start the processing.
@@ -65,6 +84,18 @@ class PsenProcessingClient(object):
         server_response = requests.get(self.api_address_format % rest_endpoint).json()
         return validate_response(server_response)["statistics"]
 
+    def get_metrics(self):
+        """
+        Get the statistics of the processing in the Prometheus text format.
+        :return: Metrics text.
+        """
+        rest_endpoint = "/metrics"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint)
+        server_response.raise_for_status()
+
+        return server_response.text
+
     def get_roi_signal(self):
         """
         Get the ROI for the signal.
@@ -106,3 +137,252 @@ class PsenProcessingClient(object):
 
         server_response = requests.post(self.api_address_format % rest_endpoint, json=roi).json()
         return validate_response(server_response)["roi_background"]
+
+    def get_rois(self):
+        """
+        Get the named ROIs.
+        :return: Dictionary {name: {"roi": ROI, "projection": "x"|"y"|"sum", "edge_finding": bool, "moments": bool}}.
+        """
+        rest_endpoint = "/rois"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["rois"]
+
+    def set_rois(self, rois):
+        """
+        Replace all the named ROIs.
+        :param rois: Dictionary {name: {"roi": ROI, "projection": "x"|"y"|"sum", "edge_finding": bool,
+        "moments": bool}}, all but the ROI can be omitted.
+        :return: Named ROIs.
+        """
+        rest_endpoint = "/rois"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint, json=rois).json()
+        return validate_response(server_response)["rois"]
+
+    def get_roi(self, name):
+        """
+        Get a named ROI.
+        :param name: Name of the ROI.
+        :return: Dictionary {"roi": ROI, "projection": "x"|"y"|"sum", "edge_finding": bool, "moments": bool}.
+        """
+        rest_endpoint = "/rois/%s" % name
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["roi"]
+
+    def set_roi(self, name, roi=None, projection=None, edge_finding=None, moments=None):
+        """
+        Add or change a named ROI. The parameters not given keep their current (or, for new ROIs, default) value.
+        :param name: Name of the ROI.
+        :param roi: List of 4 elements: [offset_x, size_x, offset_y, size_y].
+        :param projection: "x" (X profile), "y" (Y profile) or "sum" (sum of the ROI).
+        :param edge_finding: True to find the edge in the profile of the ROI.
+        :param moments: True to add the X and Y profiles, intensity, maximum pixel, center of mass and RMS width.
+        :return: ROI parameters.
+        """
+        rest_endpoint = "/rois/%s" % name
+
+        roi_parameters = {key: value for key, value in (("roi", roi), ("projection", projection),
+                                                         ("edge_finding", edge_finding), ("moments", moments))
+                          if value is not None}
+
+        server_response = requests.post(self.api_address_format % rest_endpoint, json=roi_parameters).json()
+        return validate_response(server_response)["roi"]
+
+    def delete_roi(self, name):
+        """
+        Delete a named ROI.
+        :param name: Name of the ROI.
+        :return: Remaining named ROIs.
+        """
+        rest_endpoint = "/rois/%s" % name
+
+        server_response = requests.delete(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["rois"]
+
+    def get_background_parameters(self):
+        """
+        Get the parameters of the background estimation.
+        :return: Background parameters as a dictionary.
+        """
+        rest_endpoint = "/background"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["background"]
+
+    def set_background_parameters(self, background_parameters):
+        """
+        Set the parameters of the background estimation.
+        :param background_parameters: Dictionary with "mode" ("average", "ema" or "median") and/or "depth" (number of
+        background shots). Parameters not given keep their current value.
+        :return: Background parameters as a dictionary.
+        """
+        rest_endpoint = "/background"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint, json=background_parameters).json()
+        return validate_response(server_response)["background"]
+
+    def get_image_forwarding_parameters(self):
+        """
+        Get the parameters of the image forwarding to the image output stream.
+        :return: Image forwarding parameters as a dictionary.
+        """
+        rest_endpoint = "/image_forwarding"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["image_forwarding"]
+
+    def set_image_forwarding_parameters(self, image_forwarding_parameters):
+        """
+        Set the parameters of the image forwarding to the image output stream.
+        :param image_forwarding_parameters: Dictionary with "mode" ("all", "off", "decimate", "fel" or "roi") and/or
+        "decimation" (forward every Nth image in "decimate" mode). Parameters not given keep their current value.
+        :return: Image forwarding parameters as a dictionary.
+        """
+        rest_endpoint = "/image_forwarding"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint,
+                                        json=image_forwarding_parameters).json()
+        return validate_response(server_response)["image_forwarding"]
+
+    def get_channel_forwarding_parameters(self):
+        """
+        Get the input channels forwarded to the data output stream.
+        :return: Channel forwarding parameters as a dictionary.
+        """
+        rest_endpoint = "/channel_forwarding"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["channel_forwarding"]
+
+    def set_channel_forwarding_parameters(self, channel_forwarding_parameters):
+        """
+        Set the input channels forwarded to the data output stream.
+        :param channel_forwarding_parameters: Dictionary with "channels" (list of glob patterns of the channel names,
+        e.g. ["*"] for all of them or [] for none). Parameters not given keep their current value.
+        :return: Channel forwarding parameters as a dictionary.
+        """
+        rest_endpoint = "/channel_forwarding"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint,
+                                        json=channel_forwarding_parameters).json()
+        return validate_response(server_response)["channel_forwarding"]
+
+    def get_catch_up_parameters(self):
+        """
+        Get the frame skipping applied when the processing falls behind the input stream.
+        :return: Catch up parameters as a dictionary.
+        """
+        rest_endpoint = "/catch_up"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["catch_up"]
+
+    def set_catch_up_parameters(self, catch_up_parameters):
+        """
+        Set the frame skipping applied when the processing falls behind the input stream.
+        :param catch_up_parameters: Dictionary with "mode" ("off" to process all the frames, "newest" to skip frames
+        until the processing caught up, or "fel" to process only the FEL shots until then) and/or "max_lag" (lag of the
+        input messages in seconds above which the processing is behind). Parameters not given keep their current value.
+        :return: Catch up parameters as a dictionary.
+        """
+        rest_endpoint = "/catch_up"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint, json=catch_up_parameters).json()
+        return validate_response(server_response)["catch_up"]
+
+    def get_shot_classifier_parameters(self):
+        """
+        Get the parameters of the FEL/background shot classification.
+        :return: Shot classifier parameters as a dictionary.
+        """
+        rest_endpoint = "/shot_classifier"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["shot_classifier"]
+
+    def set_shot_classifier_parameters(self, shot_classifier_parameters):
+        """
+        Set the parameters of the FEL/background shot classification.
+        :param shot_classifier_parameters: Dictionary with "mode" ("modulo", "channel" or "intensity") and the
+        parameters of the mode: "period" and "phase" (modulo), "channel" and "event_code" (channel), "threshold"
+        (intensity). Parameters not given keep their current value.
+        :return: Shot classifier parameters as a dictionary.
+        """
+        rest_endpoint = "/shot_classifier"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint,
+                                        json=shot_classifier_parameters).json()
+        return validate_response(server_response)["shot_classifier"]
+
+    def get_edge_finder_parameters(self):
+        """
+        Get the parameters of the edge finding in the signal ROI and the named ROIs.
+        :return: Edge finder parameters as a dictionary.
+        """
+        rest_endpoint = "/edge_finder"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["edge_finder"]
+
+    def set_edge_finder_parameters(self, edge_finder_parameters):
+        """
+        Set the parameters of the edge finding in the signal ROI and the named ROIs.
+        :param edge_finder_parameters: Dictionary with "step_length" (length of the step, in pixels), "edge_type"
+        ("falling" or "rising"), "refinement" (sub-pixel step of the interpolated profiles) and/or "peak_fit" (None,
+        "parabolic" or "gaussian"). Parameters not given keep their current value.
+        :return: Edge finder parameters as a dictionary.
+        """
+        rest_endpoint = "/edge_finder"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint, json=edge_finder_parameters).json()
+        return validate_response(server_response)["edge_finder"]
+
+    def get_calibration(self):
+        """
+        Get the status of the dark and flat field correction.
+        :return: Dictionary with "enabled", "dark" and "flat" (None or the "shape" and "filename" of the frame) and
+        "recording" (None or the "type", "n_frames" and "n_recorded" of the frame being recorded).
+        """
+        rest_endpoint = "/calibration"
+
+        server_response = requests.get(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["calibration"]
+
+    def set_calibration_parameters(self, calibration_parameters):
+        """
+        Enable or disable the dark and flat field correction.
+        :param calibration_parameters: Dictionary with "enabled" (False to process the raw images).
+        :return: Calibration status.
+        """
+        rest_endpoint = "/calibration"
+
+        server_response = requests.post(self.api_address_format % rest_endpoint, json=calibration_parameters).json()
+        return validate_response(server_response)["calibration"]
+
+    def record_calibration(self, calibration_type, n_frames=None):
+        """
+        Record a calibration frame from the next images of the input stream. The frame is used when the recording is
+        complete.
+        :param calibration_type: "dark" (no beam) or "flat" (uniform illumination).
+        :param n_frames: Number of images to average, None for the server default.
+        :return: Calibration status.
+        """
+        rest_endpoint = "/calibration/%s" % calibration_type
+
+        parameters = {"n_frames": n_frames} if n_frames is not None else {}
+
+        server_response = requests.post(self.api_address_format % rest_endpoint, json=parameters).json()
+        return validate_response(server_response)["calibration"]
+
+    def delete_calibration(self, calibration_type):
+        """
+        Stop using a calibration frame and delete it.
+        :param calibration_type: "dark" or "flat".
+        :return: Calibration status.
+        """
+        rest_endpoint = "/calibration/%s" % calibration_type
+
+        server_response = requests.delete(self.api_address_format % rest_endpoint).json()
+        return validate_response(server_response)["calibration"]
@@ -5,14 +5,81 @@ import bottle
 from bottle import request, response
 
 from psen_processing import config
+from psen_processing.metrics import format_prometheus_metrics
 
 _logger = logging.getLogger(__name__)
 
 
 def register_rest_interface(app, instance_manager):
+    """
+    Register the REST interface on the bottle app.
+    :param app: Bottle app.
+    :param instance_manager: ProcessingManager or, for a multi camera host, a dictionary
+    {camera_name: ProcessingManager}. In the latter case, each camera is exposed under /<camera_name>/...
+    """
 
     api_root_address = config.API_PREFIX
 
+    if isinstance(instance_manager, dict):
+
+        for camera_name, camera_manager in instance_manager.items():
+            register_processing_interface(app, camera_manager, api_root_address + "/" + camera_name)
+
+        @app.get(api_root_address + "/cameras")
+        def get_cameras():
+            cameras_status = {camera_name: camera_manager.get_status()
+                              for camera_name, camera_manager in instance_manager.items()}
+
+            return {"state": "ok",
+                    "status": "processing" if "processing" in cameras_status.values() else "stopped",
+                    "cameras": cameras_status}
+
+        @app.get(api_root_address + "/metrics")
+        def get_all_metrics():
+            response.content_type = config.PROMETHEUS_CONTENT_TYPE
+
+            return format_prometheus_metrics([({"camera": camera_name}, camera_manager.get_statistics())
+                                              for camera_name, camera_manager in sorted(instance_manager.items())])
+
+    else:
+        register_processing_interface(app, instance_manager, api_root_address)
+
+    @app.error(405)
+    def method_not_allowed(res):
+
+        if request.method == 'OPTIONS':
+            new_res = bottle.HTTPResponse()
+            new_res.set_header('Access-Control-Allow-Origin', '*')
+            new_res.set_header('Access-Control-Allow-Methods', 'PUT, GET, POST, DELETE, OPTIONS')
+            new_res.set_header('Access-Control-Allow-Headers', 'Origin, Accept, Content-Type')
+            return new_res
+
+        res.headers['Allow'] += ', OPTIONS'
+        return request.app.default_error_handler(res)
+
+    @app.hook('after_request')
+    def enable_cors():
+
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'PUT, GET, POST, DELETE, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = \
+            'Origin, Accept, Content-Type, X-Requested-With, X-CSRF-Token'
+
+    @app.error(500)
+    def error_handler_500(error):
+
+        response.content_type = 'application/json'
+        response.status = 200
+
+        return json.dumps({"state": "error",
+                           "status": str(error.exception)})
+
+
+def register_processing_interface(app, instance_manager, api_root_address):
+    """
+    Register the processing endpoints of one ProcessingManager under the given root address.
+    """
+
     @app.post(api_root_address + "/start")
     def start():
 
@@ -67,39 +134,188 @@ def register_rest_interface(app, instance_manager):
                 "status": instance_manager.get_status(),
                 "roi_signal": instance_manager.get_roi_signal()}
 
-    @app.get(api_root_address + "/statistics")
-    def get_statistics():
+    @app.get(api_root_address + "/rois")
+    def get_rois():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "rois": instance_manager.get_rois()}
+
+    @app.post(api_root_address + "/rois")
+    def set_rois():
+
+        rois = request.json
+        instance_manager.set_rois(rois)
 
         return {"state": "ok",
                 "status": instance_manager.get_status(),
-                "statistics": instance_manager.get_statistics()}
+                "rois": instance_manager.get_rois()}
 
-    @app.error(405)
-    def method_not_allowed(res):
+    @app.get(api_root_address + "/rois/<roi_name>")
+    def get_roi(roi_name):
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "roi": instance_manager.get_roi(roi_name)}
 
-        if request.method == 'OPTIONS':
-            new_res = bottle.HTTPResponse()
-            new_res.set_header('Access-Control-Allow-Origin', '*')
-            new_res.set_header('Access-Control-Allow-Methods', 'PUT, GET, POST, DELETE, OPTIONS')
-            new_res.set_header('Access-Control-Allow-Headers', 'Origin, Accept, Content-Type')
-            return new_res
+    @app.post(api_root_address + "/rois/<roi_name>")
+    def set_roi(roi_name):
 
-        res.headers['Allow'] += ', OPTIONS'
-        return request.app.default_error_handler(res)
+        roi_parameters = request.json
+        instance_manager.set_roi(roi_name, roi_parameters)
 
-    @app.hook('after_request')
-    def enable_cors():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "roi": instance_manager.get_roi(roi_name)}
 
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'PUT, GET, POST, DELETE, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = \
-            'Origin, Accept, Content-Type, X-Requested-With, X-CSRF-Token'
+    @app.delete(api_root_address + "/rois/<roi_name>")
+    def delete_roi(roi_name):
 
-    @app.error(500)
-    def error_handler_500(error):
+        instance_manager.delete_roi(roi_name)
 
-        response.content_type = 'application/json'
-        response.status = 200
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "rois": instance_manager.get_rois()}
 
-        return json.dumps({"state": "error",
-                           "status": str(error.exception)})
+    @app.get(api_root_address + "/background")
+    def get_background_parameters():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "background": instance_manager.get_background_parameters()}
+
+    @app.post(api_root_address + "/background")
+    def set_background_parameters():
+
+        background_parameters = request.json
+        instance_manager.set_background_parameters(background_parameters)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "background": instance_manager.get_background_parameters()}
+
+    @app.get(api_root_address + "/image_forwarding")
+    def get_image_forwarding_parameters():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "image_forwarding": instance_manager.get_image_forwarding_parameters()}
+
+    @app.post(api_root_address + "/image_forwarding")
+    def set_image_forwarding_parameters():
+
+        image_forwarding_parameters = request.json
+        instance_manager.set_image_forwarding_parameters(image_forwarding_parameters)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "image_forwarding": instance_manager.get_image_forwarding_parameters()}
+
+    @app.get(api_root_address + "/channel_forwarding")
+    def get_channel_forwarding_parameters():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "channel_forwarding": instance_manager.get_channel_forwarding_parameters()}
+
+    @app.post(api_root_address + "/channel_forwarding")
+    def set_channel_forwarding_parameters():
+
+        channel_forwarding_parameters = request.json
+        instance_manager.set_channel_forwarding_parameters(channel_forwarding_parameters)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "channel_forwarding": instance_manager.get_channel_forwarding_parameters()}
+
+    @app.get(api_root_address + "/catch_up")
+    def get_catch_up_parameters():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "catch_up": instance_manager.get_catch_up_parameters()}
+
+    @app.post(api_root_address + "/catch_up")
+    def set_catch_up_parameters():
+
+        catch_up_parameters = request.json
+        instance_manager.set_catch_up_parameters(catch_up_parameters)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "catch_up": instance_manager.get_catch_up_parameters()}
+
+    @app.get(api_root_address + "/shot_classifier")
+    def get_shot_classifier_parameters():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "shot_classifier": instance_manager.get_shot_classifier_parameters()}
+
+    @app.post(api_root_address + "/shot_classifier")
+    def set_shot_classifier_parameters():
+
+        shot_classifier_parameters = request.json
+        instance_manager.set_shot_classifier_parameters(shot_classifier_parameters)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "shot_classifier": instance_manager.get_shot_classifier_parameters()}
+
+    @app.get(api_root_address + "/edge_finder")
+    def get_edge_finder_parameters():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "edge_finder": instance_manager.get_edge_finder_parameters()}
+
+    @app.post(api_root_address + "/edge_finder")
+    def set_edge_finder_parameters():
+
+        edge_finder_parameters = request.json
+        instance_manager.set_edge_finder_parameters(edge_finder_parameters)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "edge_finder": instance_manager.get_edge_finder_parameters()}
+
+    @app.get(api_root_address + "/calibration")
+    def get_calibration():
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "calibration": instance_manager.get_calibration()}
+
+    @app.post(api_root_address + "/calibration")
+    def set_calibration_parameters():
+
+        calibration_parameters = request.json
+        instance_manager.set_calibration_parameters(calibration_parameters)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "calibration": instance_manager.get_calibration()}
+
+    @app.post(api_root_address + "/calibration/<calibration_type>")
+    def record_calibration(calibration_type):
+
+        parameters = request.json or {}
+        instance_manager.record_calibration(calibration_type,
+                                            parameters.get("n_frames", config.DEFAULT_CALIBRATION_N_FRAMES))
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "calibration": instance_manager.get_calibration()}
+
+    @app.delete(api_root_address + "/calibration/<calibration_type>")
+    def delete_calibration(calibration_type):
+
+        instance_manager.delete_calibration(calibration_type)
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "calibration": instance_manager.get_calibration()}
+
+    @app.get(api_root_address + "/statistics")
+    def get_statistics():
+
+        return {"state": "ok",
+                "status": instance_manager.get_status(),
+                "statistics": instance_manager.get_statistics()}
+
+    @app.get(api_root_address + "/metrics")
+    def get_metrics():
+        response.content_type = config.PROMETHEUS_CONTENT_TYPE
+
+        return format_prometheus_metrics([({}, instance_manager.get_statistics())])
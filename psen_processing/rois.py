@@ -0,0 +1,142 @@
+import json
+
+from psen_processing.edge_finder import get_default_edge_finder_parameters
+from psen_processing.forwarding import get_rois_union
+
+ROI_BOUNDS_POLICIES = ("reject", "clip")
+
+
+def get_roi_slices(roi):
+    """
+    Get the slices selecting the ROI in an image.
+    :param roi: [offset_x, size_x, offset_y, size_y] or empty.
+    :return: Tuple (row slice, column slice), None for an empty ROI.
+    """
+    if not roi:
+        return None
+
+    offset_x, size_x, offset_y, size_y = roi
+
+    return slice(offset_y, offset_y + size_y), slice(offset_x, offset_x + size_x)
+
+
+def clip_roi(roi, image_shape):
+    """
+    Clip the ROI to the image.
+    :param roi: [offset_x, size_x, offset_y, size_y] or empty.
+    :param image_shape: Shape of the image (height, width).
+    :return: The part of the ROI inside the image, empty if the ROI is empty or completely outside of the image.
+    """
+    if not roi:
+        return []
+
+    offset_x, size_x, offset_y, size_y = roi
+    height, width = image_shape
+
+    if offset_x >= width or offset_y >= height:
+        return []
+
+    return [offset_x, min(size_x, width - offset_x), offset_y, min(size_y, height - offset_y)]
+
+
+class RoiConfig(object):
+    """
+    Immutable ROI configuration: the signal and background ROIs, any number of named ROIs, and the parameters of the
+    edge finder applied to their profiles.
+
+    A ROI change creates a new RoiConfig with the next version, which replaces the old one with a single assignment.
+    The processing reads the config once per image, so it never sees a half updated ROI, and everything derived from
+    the ROIs (crop slices, serialized processing parameters) is computed only once per change.
+
+    A config resolved for an image shape has its ROIs clipped to the image, so the processing of images with this
+    shape needs no bounds checks.
+    """
+
+    __slots__ = ("version", "image_shape", "roi_signal", "roi_background", "named_rois", "edge_finder", "rois",
+                 "projections", "crop", "crop_slices", "processing_parameters")
+
+    def __init__(self, roi_signal=(), roi_background=(), named_rois=None, version=0, image_shape=None,
+                 edge_finder=None):
+        """
+        :param roi_signal: Validated signal ROI [offset_x, size_x, offset_y, size_y] or empty.
+        :param roi_background: Validated background ROI, same format.
+        :param named_rois: Validated named ROIs {name: {"roi": ROI, "projection": "x"|"y"|"sum", "edge_finding": bool,
+        "moments": bool}}.
+        :param version: Version of the configuration, sent with the processed data.
+        :param image_shape: Shape of the images the ROIs fit in, None if not resolved for an image shape.
+        :param edge_finder: Validated edge finder parameters {"step_length": int, "edge_type": "falling"|"rising",
+        "refinement": float, "peak_fit": None|"parabolic"|"gaussian"}, None for the default ones.
+        """
+        set_attribute = super(RoiConfig, self).__setattr__
+
+        set_attribute("version", version)
+        set_attribute("image_shape", image_shape)
+        set_attribute("roi_signal", tuple(roi_signal or ()))
+        set_attribute("roi_background", tuple(roi_background or ()))
+
+        # ((name, ROI, projection, edge finding, moments), ...)
+        set_attribute("named_rois", tuple((name, tuple(parameters["roi"] or ()), parameters["projection"],
+                                           parameters["edge_finding"], parameters["moments"])
+                                          for name, parameters in (named_rois or {}).items()))
+
+        # Keyword arguments of find_edge.
+        set_attribute("edge_finder", dict(edge_finder or get_default_edge_finder_parameters()))
+
+        # All the ROIs and their projections, for a single pass over the image: signal, background, named ROIs.
+        set_attribute("rois", (self.roi_signal, self.roi_background) + tuple(roi[1] for roi in self.named_rois))
+        set_attribute("projections", ("x", "x") + tuple("moments" if roi[4] else roi[2] for roi in self.named_rois))
+
+        # Part of the image forwarded in the "roi" image forwarding mode.
+        set_attribute("crop", get_rois_union(self.rois))
+        set_attribute("crop_slices", get_roi_slices(self.crop))
+
+        set_attribute("processing_parameters", json.dumps({"roi_signal": list(self.roi_signal),
+                                                           "roi_background": list(self.roi_background),
+                                                           "rois": self.get_named_rois(),
+                                                           "edge_finder": self.edge_finder,
+                                                           "roi_version": version}))
+
+    def get_named_rois(self):
+        """
+        Get the named ROIs, in the format they are set.
+        :return: Dictionary {name: {"roi": ROI, "projection": projection, "edge_finding": bool, "moments": bool}}.
+        """
+        return {name: {"roi": list(roi), "projection": projection, "edge_finding": edge_finding, "moments": moments}
+                for name, roi, projection, edge_finding, moments in self.named_rois}
+
+    def replace(self, **rois):
+        """
+        Get a new config with the given ROIs changed and the next version.
+        :param rois: roi_signal, roi_background, named_rois and/or edge_finder.
+        """
+        return RoiConfig(roi_signal=rois.get("roi_signal", self.roi_signal),
+                         roi_background=rois.get("roi_background", self.roi_background),
+                         named_rois=rois.get("named_rois", self.get_named_rois()),
+                         version=self.version + 1,
+                         edge_finder=rois.get("edge_finder", self.edge_finder))
+
+    def resolve(self, image_shape):
+        """
+        Get the config for images of the given shape, with the ROIs clipped to the image. The version stays the same.
+        :param image_shape: Shape of the image (height, width).
+        """
+        image_shape = tuple(image_shape)
+
+        named_rois = self.get_named_rois()
+        for parameters in named_rois.values():
+            parameters["roi"] = clip_roi(parameters["roi"], image_shape)
+
+        return RoiConfig(roi_signal=clip_roi(self.roi_signal, image_shape),
+                         roi_background=clip_roi(self.roi_background, image_shape),
+                         named_rois=named_rois,
+                         version=self.version,
+                         image_shape=image_shape,
+                         edge_finder=self.edge_finder)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RoiConfig is immutable, use replace to change it.")
+
+    def __repr__(self):
+        return "RoiConfig(roi_signal=%s, roi_background=%s, named_rois=%s, edge_finder=%s, version=%d)" % \
+               (list(self.roi_signal), list(self.roi_background), self.get_named_rois(), self.edge_finder,
+                self.version)
@@ -4,20 +4,47 @@ import logging
 import bottle
 
 from psen_processing import config
+from psen_processing.background import BACKGROUND_MODES
+from psen_processing.catch_up import CATCH_UP_MODES
+from psen_processing.classification import SHOT_CLASSIFIER_MODES
+from psen_processing.edge_finder import EDGE_TYPES, PEAK_FITS
+from psen_processing.forwarding import IMAGE_FORWARDING_MODES
 from psen_processing.manager import ProcessingManager
+from psen_processing.pipeline import DROP_POLICIES
 from psen_processing.processor import get_stream_processor
+from psen_processing.rois import ROI_BOUNDS_POLICIES
 from psen_processing.rest_api.server import register_rest_interface
-from psen_processing.utils import get_host_port_from_stream_address
+from psen_processing.utils import get_host_port_from_stream_address, load_cameras_config
 
 _logger = logging.getLogger(__name__)
 
 
 def start_processing(input_stream, data_output_stream_port, image_output_stream_port, rest_api_interface, rest_api_port,
-                     epics_pv_name_prefix, auto_start):
+                     epics_pv_name_prefix, auto_start, background_mode=config.DEFAULT_BACKGROUND_MODE,
+                     background_depth=config.DEFAULT_BACKGROUND_DEPTH, queue_size=config.DEFAULT_PIPELINE_QUEUE_SIZE,
+                     drop_policy=config.DEFAULT_PIPELINE_DROP_POLICY, n_workers=config.DEFAULT_N_WORKERS,
+                     max_reorder_latency=config.DEFAULT_MAX_REORDER_LATENCY,
+                     image_forwarding_mode=config.DEFAULT_IMAGE_FORWARDING_MODE,
+                     image_forwarding_decimation=config.DEFAULT_IMAGE_FORWARDING_DECIMATION,
+                     shot_classifier_mode=config.DEFAULT_SHOT_CLASSIFIER_MODE, fel_period=config.DEFAULT_FEL_PERIOD,
+                     fel_phase=config.DEFAULT_FEL_PHASE, fel_channel=None, fel_event_code=None,
+                     fel_intensity_threshold=None, roi_bounds_policy=config.DEFAULT_ROI_BOUNDS_POLICY,
+                     calibration_directory=config.DEFAULT_CALIBRATION_DIRECTORY,
+                     step_length=config.DEFAULT_EDGE_STEP_LENGTH, edge_type=config.DEFAULT_EDGE_TYPE,
+                     refinement=config.DEFAULT_EDGE_REFINEMENT, peak_fit=config.DEFAULT_EDGE_PEAK_FIT,
+                     forward_channels=None, raw_receive=config.DEFAULT_RAW_RECEIVE,
+                     catch_up_mode=config.DEFAULT_CATCH_UP_MODE, catch_up_max_lag=config.DEFAULT_CATCH_UP_MAX_LAG,
+                     output_queue_size=config.DEFAULT_OUTPUT_QUEUE_SIZE,
+                     output_drop_policy=config.DEFAULT_OUTPUT_DROP_POLICY,
+                     output_high_water_mark=config.DEFAULT_OUTPUT_HIGH_WATER_MARK):
 
     _logger.info("Receiving data from %s and outputting data on port %s and images on port %s.",
                  input_stream, data_output_stream_port, image_output_stream_port)
     _logger.info("Looking for image with Epics PV name prefix '%s'.", epics_pv_name_prefix)
+    _logger.info("Using pipeline queues of size %s with drop policy '%s'.", queue_size, drop_policy)
+    _logger.info("Using output queues of size %s with drop policy '%s' and data output high-water mark %s.",
+                 output_queue_size, output_drop_policy, output_high_water_mark)
+    _logger.info("Decoding only the used input channels set to %s.", raw_receive)
 
     input_stream_host, input_stream_port = get_host_port_from_stream_address(input_stream)
 
@@ -25,10 +52,46 @@ def start_processing(input_stream, data_output_stream_port, image_output_stream_
                                             input_stream_port=input_stream_port,
                                             data_output_stream_port=data_output_stream_port,
                                             image_output_stream_port=image_output_stream_port,
-                                            epics_pv_name_prefix=epics_pv_name_prefix)
+                                            epics_pv_name_prefix=epics_pv_name_prefix,
+                                            queue_size=queue_size,
+                                            drop_policy=drop_policy,
+                                            n_workers=n_workers,
+                                            max_reorder_latency=max_reorder_latency,
+                                            raw_receive=raw_receive,
+                                            output_queue_size=output_queue_size,
+                                            output_drop_policy=output_drop_policy,
+                                            output_high_water_mark=output_high_water_mark)
 
     _logger.info("Auto start set to %s.", auto_start)
+    _logger.info("Using background mode '%s' with depth %s.", background_mode, background_depth)
+    _logger.info("Using image forwarding mode '%s' with decimation %s.", image_forwarding_mode,
+                 image_forwarding_decimation)
+    _logger.info("Using shot classifier mode '%s'.", shot_classifier_mode)
+    _logger.info("Forwarding the input channels %s.", forward_channels)
+    _logger.info("Using catch up mode '%s' with max lag %s.", catch_up_mode, catch_up_max_lag)
+    _logger.info("Using ROI bounds policy '%s'.", roi_bounds_policy)
+    _logger.info("Using calibration directory %s.", calibration_directory)
+    _logger.info("Using edge finder step length %s, edge type '%s', refinement %s and peak fit %s.", step_length,
+                 edge_type, refinement, peak_fit)
     manager = ProcessingManager(stream_processor=stream_processor,
+                                background_parameters={"mode": background_mode, "depth": background_depth},
+                                image_forwarding_parameters={"mode": image_forwarding_mode,
+                                                             "decimation": image_forwarding_decimation},
+                                shot_classifier_parameters={"mode": shot_classifier_mode,
+                                                            "period": fel_period,
+                                                            "phase": fel_phase,
+                                                            "channel": fel_channel,
+                                                            "event_code": fel_event_code,
+                                                            "threshold": fel_intensity_threshold},
+                                roi_bounds_policy=roi_bounds_policy,
+                                edge_finder_parameters={"step_length": step_length,
+                                                        "edge_type": edge_type,
+                                                        "refinement": refinement,
+                                                        "peak_fit": peak_fit},
+                                calibration_directory=calibration_directory,
+                                channel_forwarding_parameters={"channels": forward_channels}
+                                if forward_channels is not None else None,
+                                catch_up_parameters={"mode": catch_up_mode, "max_lag": catch_up_max_lag},
                                 auto_start=auto_start)
 
     app = bottle.Bottle()
@@ -42,10 +105,75 @@ def start_processing(input_stream, data_output_stream_port, image_output_stream_
         pass
 
 
+def start_multi_camera_processing(cameras, rest_api_interface, rest_api_port, auto_start):
+    """
+    Run the processing of multiple cameras in this process, with a common REST interface.
+    :param cameras: List of camera configurations, as returned by utils.load_cameras_config.
+    :param auto_start: Default auto start, for cameras which do not specify it.
+    """
+
+    managers = {}
+
+    for camera in cameras:
+        camera_name = camera["name"]
+
+        _logger.info("Camera '%s' receiving data from %s and outputting data on port %s and images on port %s.",
+                     camera_name, camera["input_stream"], camera["data_output_stream_port"],
+                     camera["image_output_stream_port"])
+
+        input_stream_host, input_stream_port = get_host_port_from_stream_address(camera["input_stream"])
+
+        stream_processor = get_stream_processor(input_stream_host=input_stream_host,
+                                                input_stream_port=input_stream_port,
+                                                data_output_stream_port=camera["data_output_stream_port"],
+                                                image_output_stream_port=camera["image_output_stream_port"],
+                                                epics_pv_name_prefix=camera["prefix"],
+                                                queue_size=camera["queue_size"],
+                                                drop_policy=camera["drop_policy"],
+                                                n_workers=camera["n_workers"],
+                                                max_reorder_latency=camera["max_reorder_latency"],
+                                                raw_receive=camera["raw_receive"],
+                                                output_queue_size=camera["output_queue_size"],
+                                                output_drop_policy=camera["output_drop_policy"],
+                                                output_high_water_mark=camera["output_high_water_mark"])
+
+        camera_auto_start = auto_start if camera["auto_start"] is None else camera["auto_start"]
+
+        _logger.info("Camera '%s' auto start set to %s.", camera_name, camera_auto_start)
+        managers[camera_name] = ProcessingManager(stream_processor=stream_processor,
+                                                  roi_signal=camera["roi_signal"],
+                                                  roi_background=camera["roi_background"],
+                                                  rois=camera["rois"],
+                                                  background_parameters=camera["background"],
+                                                  image_forwarding_parameters=camera["image_forwarding"],
+                                                  channel_forwarding_parameters=camera["channel_forwarding"],
+                                                  catch_up_parameters=camera["catch_up"],
+                                                  shot_classifier_parameters=camera["shot_classifier"],
+                                                  roi_bounds_policy=camera["roi_bounds_policy"],
+                                                  edge_finder_parameters=camera["edge_finder"],
+                                                  calibration_directory=camera["calibration_directory"],
+                                                  auto_start=camera_auto_start)
+
+    app = bottle.Bottle()
+
+    register_rest_interface(app, managers)
+
+    try:
+        _logger.info("Starting REST interface for %d cameras on interface %s and port %s.",
+                     len(managers), rest_api_interface, rest_api_port)
+        bottle.run(app=app, host=rest_api_interface, port=rest_api_port, debug=True)
+    finally:
+        for manager in managers.values():
+            manager.stop()
+
+
 def main():
     parser = argparse.ArgumentParser(description='PSEN camera processing.')
-    parser.add_argument('input_stream', help="Input bsread stream to process.")
-    parser.add_argument('prefix', help="Epics PV prefix of the image.")
+    parser.add_argument('input_stream', nargs='?', help="Input bsread stream to process.")
+    parser.add_argument('prefix', nargs='?', help="Epics PV prefix of the image.")
+
+    parser.add_argument('-c', '--cameras_config', help="JSON file with the cameras to process in this process. "
+                                                       "Replaces the input_stream and prefix arguments.")
 
     parser.add_argument('-o', '--data_output_stream_port', type=int, default=config.DEFAULT_DATA_OUTPUT_STREAM_PORT,
                         help="Output data bsread stream port.")
@@ -56,6 +184,67 @@ def main():
     parser.add_argument('--rest_api_interface', default=config.DEFAULT_REST_API_INTERFACE,
                         help="Hostname interface to bind to")
 
+    parser.add_argument("--background_mode", default=config.DEFAULT_BACKGROUND_MODE, choices=BACKGROUND_MODES,
+                        help="Background estimation from the non FEL shots.")
+    parser.add_argument("--background_depth", type=int, default=config.DEFAULT_BACKGROUND_DEPTH,
+                        help="Number of non FEL shots used for the background.")
+
+    parser.add_argument("--image_forwarding_mode", default=config.DEFAULT_IMAGE_FORWARDING_MODE,
+                        choices=IMAGE_FORWARDING_MODES, help="Which images are sent to the image output stream.")
+    parser.add_argument("--image_forwarding_decimation", type=int, default=config.DEFAULT_IMAGE_FORWARDING_DECIMATION,
+                        help="Forward every Nth image in the 'decimate' image forwarding mode.")
+    parser.add_argument("--forward_channels", nargs="*", default=config.DEFAULT_FORWARDED_CHANNELS,
+                        help="Glob patterns of the input channels forwarded to the data output stream, e.g. '*'.")
+
+    parser.add_argument("--shot_classifier_mode", default=config.DEFAULT_SHOT_CLASSIFIER_MODE,
+                        choices=SHOT_CLASSIFIER_MODES, help="How FEL shots are told apart from background shots.")
+    parser.add_argument("--fel_period", type=int, default=config.DEFAULT_FEL_PERIOD,
+                        help="FEL shots are the pulse ids with pulse_id %% fel_period == fel_phase ('modulo' mode).")
+    parser.add_argument("--fel_phase", type=int, default=config.DEFAULT_FEL_PHASE,
+                        help="Phase of the FEL shots ('modulo' mode).")
+    parser.add_argument("--fel_channel", help="Input channel which is true for FEL shots ('channel' mode).")
+    parser.add_argument("--fel_event_code", type=int,
+                        help="Index of the FEL event code, if the FEL channel is an event code array.")
+    parser.add_argument("--fel_intensity_threshold", type=float,
+                        help="Signal ROI intensity above which a shot is a FEL shot ('intensity' mode).")
+
+    parser.add_argument("--roi_bounds_policy", default=config.DEFAULT_ROI_BOUNDS_POLICY, choices=ROI_BOUNDS_POLICIES,
+                        help="What to do with ROIs which do not fit in the images of the input stream.")
+    parser.add_argument("--step_length", type=int, default=config.DEFAULT_EDGE_STEP_LENGTH,
+                        help="Length of the step searched for by the edge finder, in pixels.")
+    parser.add_argument("--edge_type", default=config.DEFAULT_EDGE_TYPE, choices=EDGE_TYPES,
+                        help="Type of the edge.")
+    parser.add_argument("--refinement", type=float, default=config.DEFAULT_EDGE_REFINEMENT,
+                        help="Sub-pixel step of the edge search.")
+    parser.add_argument("--peak_fit", default=config.DEFAULT_EDGE_PEAK_FIT, choices=PEAK_FITS,
+                        help="Fit the cross-correlation maximum for sub-pixel edge positions.")
+
+    parser.add_argument("--calibration_directory", default=config.DEFAULT_CALIBRATION_DIRECTORY,
+                        help="Directory where the dark and flat field frames are saved and loaded from.")
+
+    parser.add_argument("--queue_size", type=int, default=config.DEFAULT_PIPELINE_QUEUE_SIZE,
+                        help="Size of the queues between the receive, compute and send stages.")
+    parser.add_argument("--drop_policy", default=config.DEFAULT_PIPELINE_DROP_POLICY, choices=DROP_POLICIES,
+                        help="What to do with new frames when a pipeline queue is full.")
+    parser.add_argument("--output_queue_size", type=int, default=config.DEFAULT_OUTPUT_QUEUE_SIZE,
+                        help="Size of the queues in front of the data and image output streams.")
+    parser.add_argument("--output_drop_policy", default=config.DEFAULT_OUTPUT_DROP_POLICY, choices=DROP_POLICIES,
+                        help="What to do with new results when an output queue is full.")
+    parser.add_argument("--output_high_water_mark", type=int, default=config.DEFAULT_OUTPUT_HIGH_WATER_MARK,
+                        help="Maximum number of messages buffered by the data output stream for slow consumers.")
+    parser.add_argument("--n_workers", type=int, default=config.DEFAULT_N_WORKERS,
+                        help="Number of threads processing images in parallel.")
+    parser.add_argument("--max_reorder_latency", type=float, default=config.DEFAULT_MAX_REORDER_LATENCY,
+                        help="Maximum time (seconds) a processed image waits for earlier images to be sent in order.")
+
+    parser.add_argument("--catch_up_mode", default=config.DEFAULT_CATCH_UP_MODE, choices=CATCH_UP_MODES,
+                        help="Frames processed while the processing is behind the input stream.")
+    parser.add_argument("--catch_up_max_lag", type=float, default=config.DEFAULT_CATCH_UP_MAX_LAG,
+                        help="Lag of the input messages (seconds) above which the processing is behind.")
+    parser.add_argument("--decode_all_channels", dest="raw_receive", action="store_false",
+                        default=config.DEFAULT_RAW_RECEIVE,
+                        help="Decode all the channels of the input stream, not only the ones used by the processing.")
+
     parser.add_argument("--log_level", default=config.DEFAULT_LOGGING_LEVEL,
                         choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
                         help="Log level to use.")
@@ -67,13 +256,52 @@ def main():
 
     _logger.info("Using log level %s.", arguments.log_level)
 
+    if arguments.cameras_config:
+        _logger.info("Loading cameras from %s.", arguments.cameras_config)
+
+        start_multi_camera_processing(cameras=load_cameras_config(arguments.cameras_config),
+                                      rest_api_interface=arguments.rest_api_interface,
+                                      rest_api_port=arguments.rest_api_port,
+                                      auto_start=arguments.auto_start)
+        return
+
+    if not arguments.input_stream or not arguments.prefix:
+        parser.error("input_stream and prefix are required when no cameras_config is given.")
+
     start_processing(input_stream=arguments.input_stream,
                      data_output_stream_port=arguments.data_output_stream_port,
                      image_output_stream_port=arguments.image_output_stream_port,
                      rest_api_interface=arguments.rest_api_interface,
                      rest_api_port=arguments.rest_api_port,
                      epics_pv_name_prefix=arguments.prefix,
-                     auto_start=arguments.auto_start)
+                     auto_start=arguments.auto_start,
+                     background_mode=arguments.background_mode,
+                     background_depth=arguments.background_depth,
+                     queue_size=arguments.queue_size,
+                     drop_policy=arguments.drop_policy,
+                     n_workers=arguments.n_workers,
+                     max_reorder_latency=arguments.max_reorder_latency,
+                     image_forwarding_mode=arguments.image_forwarding_mode,
+                     image_forwarding_decimation=arguments.image_forwarding_decimation,
+                     forward_channels=arguments.forward_channels,
+                     shot_classifier_mode=arguments.shot_classifier_mode,
+                     fel_period=arguments.fel_period,
+                     fel_phase=arguments.fel_phase,
+                     fel_channel=arguments.fel_channel,
+                     fel_event_code=arguments.fel_event_code,
+                     fel_intensity_threshold=arguments.fel_intensity_threshold,
+                     roi_bounds_policy=arguments.roi_bounds_policy,
+                     calibration_directory=arguments.calibration_directory,
+                     step_length=arguments.step_length,
+                     edge_type=arguments.edge_type,
+                     refinement=arguments.refinement,
+                     peak_fit=arguments.peak_fit,
+                     raw_receive=arguments.raw_receive,
+                     catch_up_mode=arguments.catch_up_mode,
+                     catch_up_max_lag=arguments.catch_up_max_lag,
+                     output_queue_size=arguments.output_queue_size,
+                     output_drop_policy=arguments.output_drop_policy,
+                     output_high_water_mark=arguments.output_high_water_mark)
 
 
 if __name__ == "__main__":
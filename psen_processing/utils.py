@@ -1,7 +1,23 @@
-def validate_roi(roi):
+import json
+import re
+
+from psen_processing import config
+from psen_processing.background import BACKGROUND_MODES
+from psen_processing.calibration import Calibration
+from psen_processing.catch_up import CATCH_UP_MODES
+from psen_processing.classification import SHOT_CLASSIFIER_MODES
+from psen_processing.edge_finder import EDGE_TYPES, PEAK_FITS
+from psen_processing.forwarding import IMAGE_FORWARDING_MODES
+from psen_processing.pipeline import DROP_POLICIES
+from psen_processing.profiles import ROI_PROJECTIONS
+from psen_processing.rois import ROI_BOUNDS_POLICIES, RoiConfig
+
+
+def validate_roi(roi, image_shape=None):
     """
     Check if the ROI parameters are valid: List with 0 or 4 elements. Sizes at least 1, and offsets at least 0.
     :param roi: [offset_x, size_x, offset_y, size_y]
+    :param image_shape: Shape of the image (height, width) the ROI must fit in, None if not known.
     :raises ValueError: When ROI is not valid, it raises a ValueError.
     """
 
@@ -20,6 +36,57 @@ def validate_roi(roi):
     if roi[1] < 1 or roi[3] < 1:
         raise ValueError("ROI sizes (second and fourth elements) must be at least 1, but %s was given." % roi)
 
+    if image_shape is not None:
+        height, width = image_shape
+
+        if roi[0] + roi[1] > width or roi[2] + roi[3] > height:
+            raise ValueError("ROI must fit in the image of width %d and height %d (offset + size at most the image "
+                             "size), but %s was given." % (width, height, roi))
+
+
+def validate_named_roi(name, roi_parameters, image_shape=None):
+    """
+    Check if the named ROI is valid.
+    :param name: Name of the ROI, used in the output channel names: letters, digits, "_" and "-". The names "signal"
+    and "background" are reserved for the signal and background ROIs.
+    :param roi_parameters: Dictionary {"roi": [offset_x, size_x, offset_y, size_y], "projection": "x"|"y"|"sum",
+    "edge_finding": bool, "moments": bool}
+    :param image_shape: Shape of the image (height, width) the ROI must fit in, None if not known.
+    :raises ValueError: When the ROI is not valid, it raises a ValueError.
+    """
+    if not isinstance(name, str) or not re.match(r"^[A-Za-z0-9_\-]+$", name) or name in ("signal", "background"):
+        raise ValueError("ROI name must be made of letters, digits, '_' and '-' and cannot be 'signal' or "
+                         "'background', but %s was given." % name)
+
+    if not isinstance(roi_parameters, dict):
+        raise ValueError("ROI %s must be a dictionary, but %s was given." % (name, roi_parameters))
+
+    unknown_keys = set(roi_parameters) - {"roi", "projection", "edge_finding", "moments"}
+    if unknown_keys:
+        raise ValueError("ROI %s has unknown keys %s." % (name, sorted(unknown_keys)))
+
+    roi = roi_parameters.get("roi")
+    validate_roi(roi, image_shape)
+
+    if not roi:
+        raise ValueError("ROI %s must not be empty." % name)
+
+    projection = roi_parameters.get("projection")
+    if projection not in ROI_PROJECTIONS:
+        raise ValueError("Projection of ROI %s must be one of %s, but %s was given." % (name, ROI_PROJECTIONS,
+                                                                                        projection))
+
+    edge_finding = roi_parameters.get("edge_finding")
+    if not isinstance(edge_finding, bool):
+        raise ValueError("Edge finding of ROI %s must be true or false, but %s was given." % (name, edge_finding))
+
+    if edge_finding and projection == "sum":
+        raise ValueError("Edge finding of ROI %s needs an 'x' or 'y' projection." % name)
+
+    moments = roi_parameters.get("moments")
+    if not isinstance(moments, bool):
+        raise ValueError("Moments of ROI %s must be true or false, but %s was given." % (name, moments))
+
 
 def get_host_port_from_stream_address(stream_address):
     """
@@ -33,12 +100,297 @@ def get_host_port_from_stream_address(stream_address):
     return source_host, int(source_port)
 
 
-def append_message_data(message, destination):
+def append_message_data(message, destination, channel_names=None):
     """
     Append the data from the original bsread message to the destination dictionary.
     :param message: Original bsread message to parse.
     :param destination: Destination dictionary - where to copy the data to.
+    :param channel_names: Names of the channels to append, None for all of them.
     :return:
     """
-    for value_name, bsread_value in message.data.data.items():
-        destination[value_name] = bsread_value.value
+    message_data = message.data.data
+
+    # The received values are referenced, not copied.
+    for value_name in (message_data if channel_names is None else channel_names):
+        destination[value_name] = message_data[value_name].value
+
+
+def validate_background_parameters(background_parameters):
+    """
+    Check if the background parameters are valid.
+    :param background_parameters: Dictionary {"mode": "average"|"ema"|"median", "depth": int}
+    :raises ValueError: When the parameters are not valid, it raises a ValueError.
+    """
+    mode = background_parameters.get("mode")
+    if mode not in BACKGROUND_MODES:
+        raise ValueError("Background mode must be one of %s, but %s was given." % (BACKGROUND_MODES, mode))
+
+    depth = background_parameters.get("depth")
+    if not isinstance(depth, int) or isinstance(depth, bool) or not 1 <= depth <= config.BACKGROUND_MAX_DEPTH:
+        raise ValueError("Background depth must be an integer between 1 and %d, but %s was given." %
+                         (config.BACKGROUND_MAX_DEPTH, depth))
+
+
+def validate_image_forwarding_parameters(image_forwarding_parameters):
+    """
+    Check if the image forwarding parameters are valid.
+    :param image_forwarding_parameters: Dictionary {"mode": "all"|"off"|"decimate"|"fel"|"roi", "decimation": int}
+    :raises ValueError: When the parameters are not valid, it raises a ValueError.
+    """
+    mode = image_forwarding_parameters.get("mode")
+    if mode not in IMAGE_FORWARDING_MODES:
+        raise ValueError("Image forwarding mode must be one of %s, but %s was given." % (IMAGE_FORWARDING_MODES, mode))
+
+    decimation = image_forwarding_parameters.get("decimation")
+    if not isinstance(decimation, int) or isinstance(decimation, bool) or decimation < 1:
+        raise ValueError("Image forwarding decimation must be a positive integer, but %s was given." % decimation)
+
+
+def validate_channel_forwarding_parameters(channel_forwarding_parameters):
+    """
+    Check if the channel forwarding parameters are valid.
+    :param channel_forwarding_parameters: Dictionary {"channels": [glob pattern, ...]}
+    :raises ValueError: When the parameters are not valid, it raises a ValueError.
+    """
+    channels = channel_forwarding_parameters.get("channels")
+    if not isinstance(channels, list) or not all(isinstance(channel, str) and channel for channel in channels):
+        raise ValueError("Forwarded channels must be a list of channel name patterns, but %s was given." % channels)
+
+
+def validate_catch_up_parameters(catch_up_parameters):
+    """
+    Check if the catch up parameters are valid.
+    :param catch_up_parameters: Dictionary {"mode": "off"|"newest"|"fel", "max_lag": float}
+    :raises ValueError: When the parameters are not valid, it raises a ValueError.
+    """
+    mode = catch_up_parameters.get("mode")
+    if mode not in CATCH_UP_MODES:
+        raise ValueError("Catch up mode must be one of %s, but %s was given." % (CATCH_UP_MODES, mode))
+
+    max_lag = catch_up_parameters.get("max_lag")
+    if isinstance(max_lag, bool) or not isinstance(max_lag, (int, float)) or max_lag <= 0:
+        raise ValueError("Catch up max lag must be a positive number of seconds, but %s was given." % max_lag)
+
+
+def validate_shot_classifier_parameters(shot_classifier_parameters):
+    """
+    Check if the shot classifier parameters are valid.
+    :param shot_classifier_parameters: Dictionary {"mode": "modulo"|"channel"|"intensity", "period": int,
+    "phase": int, "channel": str, "event_code": int or None, "threshold": float}
+    :raises ValueError: When the parameters are not valid, it raises a ValueError.
+    """
+    def is_integer(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    mode = shot_classifier_parameters.get("mode")
+    if mode not in SHOT_CLASSIFIER_MODES:
+        raise ValueError("Shot classifier mode must be one of %s, but %s was given." % (SHOT_CLASSIFIER_MODES, mode))
+
+    period = shot_classifier_parameters.get("period")
+    if not is_integer(period) or period < 1:
+        raise ValueError("Shot classifier period must be a positive integer, but %s was given." % period)
+
+    phase = shot_classifier_parameters.get("phase")
+    if not is_integer(phase) or not 0 <= phase < period:
+        raise ValueError("Shot classifier phase must be an integer between 0 and period - 1 (%d), but %s was given." %
+                         (period - 1, phase))
+
+    channel = shot_classifier_parameters.get("channel")
+    if mode == "channel" and (not isinstance(channel, str) or not channel):
+        raise ValueError("Shot classifier channel must be a channel name in 'channel' mode, but %s was given." %
+                         channel)
+
+    event_code = shot_classifier_parameters.get("event_code")
+    if event_code is not None and (not is_integer(event_code) or event_code < 0):
+        raise ValueError("Shot classifier event code must be a non negative integer or None, but %s was given." %
+                         event_code)
+
+    threshold = shot_classifier_parameters.get("threshold")
+    if mode == "intensity" and (not isinstance(threshold, (int, float)) or isinstance(threshold, bool)):
+        raise ValueError("Shot classifier threshold must be a number in 'intensity' mode, but %s was given." %
+                         threshold)
+
+
+def validate_edge_finder_parameters(edge_finder_parameters):
+    """
+    Check if the edge finder parameters are valid.
+    :param edge_finder_parameters: Dictionary {"step_length": int, "edge_type": "falling"|"rising", "refinement": float,
+    "peak_fit": None|"parabolic"|"gaussian"}
+    :raises ValueError: When the parameters are not valid, it raises a ValueError.
+    """
+    unknown_parameters = set(edge_finder_parameters) - {"step_length", "edge_type", "refinement", "peak_fit"}
+    if unknown_parameters:
+        raise ValueError("Unknown edge finder parameters %s." % sorted(unknown_parameters))
+
+    step_length = edge_finder_parameters.get("step_length")
+    if not isinstance(step_length, int) or isinstance(step_length, bool) or step_length < 2:
+        raise ValueError("Edge finder step length must be an integer of at least 2, but %s was given." % step_length)
+
+    edge_type = edge_finder_parameters.get("edge_type")
+    if edge_type not in EDGE_TYPES:
+        raise ValueError("Edge finder edge type must be one of %s, but %s was given." % (EDGE_TYPES, edge_type))
+
+    refinement = edge_finder_parameters.get("refinement")
+    if not isinstance(refinement, (int, float)) or isinstance(refinement, bool) or \
+            not config.EDGE_FINDER_MIN_REFINEMENT <= refinement <= 1:
+        raise ValueError("Edge finder refinement must be a number between %s and 1, but %s was given." %
+                         (config.EDGE_FINDER_MIN_REFINEMENT, refinement))
+
+    peak_fit = edge_finder_parameters.get("peak_fit")
+    if peak_fit is not None and peak_fit not in PEAK_FITS:
+        raise ValueError("Edge finder peak fit must be None or one of %s, but %s was given." % (PEAK_FITS, peak_fit))
+
+
+def validate_calibration_parameters(calibration_parameters):
+    """
+    Check if the calibration parameters are valid.
+    :param calibration_parameters: Dictionary {"enabled": bool}.
+    :raises ValueError: When the parameters are not valid, it raises a ValueError.
+    """
+    if not isinstance(calibration_parameters, dict):
+        raise ValueError("Calibration parameters must be a dictionary, but %s was given." % calibration_parameters)
+
+    unknown_parameters = set(calibration_parameters) - {"enabled"}
+    if unknown_parameters:
+        raise ValueError("Unknown calibration parameters %s, only 'enabled' can be set." % sorted(unknown_parameters))
+
+    if "enabled" in calibration_parameters and not isinstance(calibration_parameters["enabled"], bool):
+        raise ValueError("Calibration enabled must be a bool, but %s was given." % calibration_parameters["enabled"])
+
+
+def get_default_processing_parameters():
+    """
+    Get the processing parameters the stream processor starts with. The "image_shape" is set by the stream processor
+    when it receives the first image, or an image with a different shape. The "calibration_recorder" is set by the
+    manager while a calibration frame is recorded.
+    :return: Dictionary with the default processing parameters.
+    """
+    return {"background": {"mode": config.DEFAULT_BACKGROUND_MODE,
+                           "depth": config.DEFAULT_BACKGROUND_DEPTH},
+            "image_forwarding": {"mode": config.DEFAULT_IMAGE_FORWARDING_MODE,
+                                 "decimation": config.DEFAULT_IMAGE_FORWARDING_DECIMATION},
+            "channel_forwarding": {"channels": list(config.DEFAULT_FORWARDED_CHANNELS)},
+            "catch_up": {"mode": config.DEFAULT_CATCH_UP_MODE,
+                         "max_lag": config.DEFAULT_CATCH_UP_MAX_LAG},
+            "shot_classifier": {"mode": config.DEFAULT_SHOT_CLASSIFIER_MODE,
+                                "period": config.DEFAULT_FEL_PERIOD,
+                                "phase": config.DEFAULT_FEL_PHASE,
+                                "channel": None,
+                                "event_code": None,
+                                "threshold": None},
+            "rois": RoiConfig(),
+            "image_shape": None,
+            "calibration": Calibration(),
+            "calibration_recorder": None}
+
+
+def load_cameras_config(filename):
+    """
+    Load and validate the cameras of a multi camera host from a JSON file. The file contains a list of cameras:
+    [{"name": "SARES11-SPEC125-M2",                   (optional, defaults to the prefix)
+      "input_stream": "tcp://daqsf-sioc-cs-82:9010",
+      "prefix": "SARES11-SPEC125-M2",
+      "data_output_stream_port": 8895,
+      "image_output_stream_port": 8896,
+      "roi_signal": [0, 100, 0, 100],                 (optional)
+      "roi_background": [100, 100, 0, 100],           (optional)
+      "rois": {"peak": {"roi": [0, 50, 0, 100]}},     (optional)
+      "background": {"mode": "average", "depth": 4},  (optional)
+      "image_forwarding": {"mode": "all"},            (optional)
+      "channel_forwarding": {"channels": ["*"]},      (optional)
+      "catch_up": {"mode": "newest"},                 (optional)
+      "shot_classifier": {"mode": "modulo"},          (optional)
+      "edge_finder": {"step_length": 50},             (optional)
+      "roi_bounds_policy": "reject",                  (optional)
+      "calibration_directory": "/calibration/M2",     (optional)
+      "queue_size": 10,                               (optional)
+      "drop_policy": "block",                         (optional)
+      "output_queue_size": 10,                        (optional)
+      "output_drop_policy": "drop_oldest",            (optional)
+      "output_high_water_mark": 100,                  (optional)
+      "n_workers": 1,                                 (optional)
+      "max_reorder_latency": 0.5,                     (optional)
+      "raw_receive": true,                            (optional)
+      "auto_start": true}, ...]                       (optional)
+    :param filename: JSON file to load.
+    :return: List of camera configurations, with the optional values filled in.
+    :raises ValueError: When the configuration is not valid, it raises a ValueError.
+    """
+    with open(filename) as input_file:
+        cameras = json.load(input_file)
+
+    if not isinstance(cameras, list) or not cameras:
+        raise ValueError("Cameras config must be a non empty list, but %s was given." % cameras)
+
+    required_keys = ("input_stream", "prefix", "data_output_stream_port", "image_output_stream_port")
+
+    camera_names = set()
+    output_ports = set()
+    calibration_directories = set()
+
+    for camera in cameras:
+
+        missing_keys = [key for key in required_keys if key not in camera]
+        if missing_keys:
+            raise ValueError("Camera %s is missing the keys %s." % (camera, missing_keys))
+
+        camera.setdefault("name", camera["prefix"])
+        camera.setdefault("roi_signal", [])
+        camera.setdefault("roi_background", [])
+        camera.setdefault("rois", None)
+        camera.setdefault("background", None)
+        camera.setdefault("image_forwarding", None)
+        camera.setdefault("channel_forwarding", None)
+        camera.setdefault("catch_up", None)
+        camera.setdefault("shot_classifier", None)
+        camera.setdefault("edge_finder", None)
+        camera.setdefault("roi_bounds_policy", config.DEFAULT_ROI_BOUNDS_POLICY)
+        camera.setdefault("calibration_directory", config.DEFAULT_CALIBRATION_DIRECTORY)
+        camera.setdefault("queue_size", config.DEFAULT_PIPELINE_QUEUE_SIZE)
+        camera.setdefault("drop_policy", config.DEFAULT_PIPELINE_DROP_POLICY)
+        camera.setdefault("output_queue_size", config.DEFAULT_OUTPUT_QUEUE_SIZE)
+        camera.setdefault("output_drop_policy", config.DEFAULT_OUTPUT_DROP_POLICY)
+        camera.setdefault("output_high_water_mark", config.DEFAULT_OUTPUT_HIGH_WATER_MARK)
+        camera.setdefault("n_workers", config.DEFAULT_N_WORKERS)
+        camera.setdefault("max_reorder_latency", config.DEFAULT_MAX_REORDER_LATENCY)
+        camera.setdefault("raw_receive", config.DEFAULT_RAW_RECEIVE)
+        camera.setdefault("auto_start", None)
+
+        if camera["name"] in camera_names:
+            raise ValueError("Camera name '%s' is used more than once." % camera["name"])
+        camera_names.add(camera["name"])
+
+        for port_name in ("data_output_stream_port", "image_output_stream_port"):
+            if camera[port_name] in output_ports:
+                raise ValueError("Output port %s of camera '%s' is used more than once." %
+                                 (camera[port_name], camera["name"]))
+            output_ports.add(camera[port_name])
+
+        # Each camera has its own dark and flat field.
+        if camera["calibration_directory"] is not None:
+            if camera["calibration_directory"] in calibration_directories:
+                raise ValueError("Calibration directory %s of camera '%s' is used more than once." %
+                                 (camera["calibration_directory"], camera["name"]))
+            calibration_directories.add(camera["calibration_directory"])
+
+        validate_roi(camera["roi_signal"])
+        validate_roi(camera["roi_background"])
+
+        if camera["roi_bounds_policy"] not in ROI_BOUNDS_POLICIES:
+            raise ValueError("ROI bounds policy of camera '%s' must be one of %s, but %s was given." %
+                             (camera["name"], ROI_BOUNDS_POLICIES, camera["roi_bounds_policy"]))
+
+        if camera["drop_policy"] not in DROP_POLICIES:
+            raise ValueError("Drop policy of camera '%s' must be one of %s, but %s was given." %
+                             (camera["name"], DROP_POLICIES, camera["drop_policy"]))
+
+        if camera["output_drop_policy"] not in DROP_POLICIES:
+            raise ValueError("Output drop policy of camera '%s' must be one of %s, but %s was given." %
+                             (camera["name"], DROP_POLICIES, camera["output_drop_policy"]))
+
+        n_workers = camera["n_workers"]
+        if not isinstance(n_workers, int) or isinstance(n_workers, bool) or n_workers < 1:
+            raise ValueError("Number of workers of camera '%s' must be a positive integer, but %s was given." %
+                             (camera["name"], n_workers))
+
+    return cameras
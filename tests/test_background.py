@@ -0,0 +1,92 @@
+import unittest
+
+import numpy
+
+from psen_processing.background import BackgroundModel, get_background_estimates
+
+
+class TestBackgroundModel(unittest.TestCase):
+
+    def test_average(self):
+        background = BackgroundModel(mode="average", depth=3)
+        self.assertIsNone(background.get())
+
+        profiles = [numpy.full(10, value, dtype="uint64") for value in (1, 2, 3, 4, 5, 6, 7)]
+
+        for index, profile in enumerate(profiles):
+            background.add(profile)
+
+            expected = numpy.mean(profiles[max(0, index - 2):index + 1], axis=0)
+            numpy.testing.assert_allclose(background.get(), expected)
+
+        self.assertEqual(len(background), 3)
+
+    def test_median(self):
+        background = BackgroundModel(mode="median", depth=3)
+
+        for value in (1, 100, 2, 3):
+            background.add(numpy.full(5, value))
+
+        numpy.testing.assert_array_equal(background.get(), numpy.full(5, 3))
+
+    def test_ema(self):
+        background = BackgroundModel(mode="ema", depth=3)
+
+        background.add(numpy.full(5, 10.0))
+        numpy.testing.assert_allclose(background.get(), numpy.full(5, 10))
+
+        background.add(numpy.full(5, 20.0))
+        numpy.testing.assert_allclose(background.get(), numpy.full(5, 15))
+
+    def test_reset_on_shape_change(self):
+        background = BackgroundModel(mode="average", depth=4)
+
+        background.add(numpy.ones(10))
+        background.add(numpy.ones(10))
+        self.assertEqual(len(background), 2)
+
+        background.update_shape((10,))
+        self.assertEqual(len(background), 2)
+
+        background.update_shape((20,))
+        self.assertEqual(len(background), 0)
+        self.assertIsNone(background.get())
+
+        background.add(numpy.full(20, 3))
+        numpy.testing.assert_allclose(background.get(), numpy.full(20, 3))
+
+    def test_configure(self):
+        background = BackgroundModel(mode="average", depth=4)
+        background.add(numpy.ones(10))
+
+        background.configure("average", 4)
+        background.update_shape((10,))
+        self.assertEqual(len(background), 1)
+
+        background.configure("average", 200)
+        self.assertEqual(len(background), 1)
+
+        # The new parameters are applied by the next update.
+        background.update_shape((10,))
+        self.assertEqual(background.depth, 200)
+        self.assertEqual(len(background), 0)
+
+        for value in range(1000):
+            background.add(numpy.full(10, value))
+
+        numpy.testing.assert_allclose(background.get(), numpy.full(10, numpy.mean(range(800, 1000))))
+
+    def test_batch_estimates(self):
+        random = numpy.random.RandomState(0)
+        profiles = random.uniform(size=(20, 8))
+
+        for mode in ("average", "ema", "median"):
+            background = BackgroundModel(mode=mode, depth=5)
+            expected = [numpy.full(8, numpy.nan)]
+
+            for profile in profiles:
+                background.add(profile)
+                expected.append(background.get().copy())
+
+            estimates = get_background_estimates(profiles, numpy.arange(21), mode, 5)
+            numpy.testing.assert_allclose(estimates, expected)
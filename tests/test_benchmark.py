@@ -0,0 +1,39 @@
+import unittest
+
+from psen_processing.benchmark import benchmark_edge_refinement, benchmark_find_edge, benchmark_process_batch, \
+    benchmark_process_image, compare_results, get_latency_statistics, get_synthetic_frames
+from psen_processing.processor import get_roi_x_profile
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def test_latency_statistics(self):
+        statistics = get_latency_statistics([0.001] * 99 + [0.1])
+
+        self.assertAlmostEqual(statistics["p50_us"], 1000)
+        self.assertAlmostEqual(statistics["max_us"], 100000)
+        self.assertDictEqual(get_latency_statistics([]), {})
+
+    def test_replay(self):
+        roi_signal = [0, 200, 10, 20]
+        pulse_ids, images = get_synthetic_frames(8, (40, 200), "uint16", roi_signal)
+
+        results = {"process_image": benchmark_process_image(pulse_ids, images, roi_signal, [0, 100, 30, 10], 1),
+                   "process_batch": benchmark_process_batch(pulse_ids, images, roi_signal, [], 50, 1, 1),
+                   "find_edge": benchmark_find_edge([get_roi_x_profile(image, roi_signal) for image in images],
+                                                    50, 0.5, 1)}
+
+        self.assertGreater(results["process_image"]["frames_per_second"], 0)
+        self.assertSetEqual(set(results["process_image"]["stages"]), {"profiles", "background", "edge_finding"})
+        self.assertEqual(results["process_image"]["stages"]["profiles"]["count"], 8)
+        self.assertGreater(results["process_batch"]["frames_per_second"], 0)
+        self.assertGreater(results["find_edge"]["batch_profiles_per_second"], 0)
+
+        edge_refinement = benchmark_edge_refinement(512, 100, 5, 0, [1, 0.1], 1, n_profiles=10)["methods"]
+        self.assertSetEqual(set(edge_refinement), {"refinement_1", "refinement_0.1", "parabolic", "gaussian"})
+        self.assertLess(edge_refinement["parabolic"]["max_error"], edge_refinement["refinement_1"]["max_error"])
+
+        comparison = compare_results(results, results)
+        self.assertDictEqual(comparison["process_image"], {"frames_per_second": 1})
+        self.assertDictEqual(comparison["find_edge"], {"single_profile_per_second": 1,
+                                                       "batch_profiles_per_second": 1})
@@ -0,0 +1,93 @@
+import tempfile
+import unittest
+
+import numpy
+
+from psen_processing.calibration import Calibration, CalibrationRecorder, load_calibration_frames, \
+    save_calibration_frame
+
+
+class TestCalibration(unittest.TestCase):
+
+    def test_correct(self):
+        random = numpy.random.RandomState(0)
+        image = random.randint(0, 4096, size=(20, 30)).astype("uint16")
+
+        dark = random.uniform(90, 110, size=(20, 30)).astype("float32")
+        flat = dark + random.uniform(500, 1500, size=(20, 30)).astype("float32")
+        flat[3, 4] = dark[3, 4]
+
+        calibration = Calibration(dark, flat)
+        self.assertEqual(calibration.shape, (20, 30))
+
+        # Dead pixels get no signal, the others are normalized to the mean response.
+        self.assertEqual(calibration.gain[3, 4], 0)
+        self.assertAlmostEqual(float(((flat - dark) * calibration.gain)[calibration.gain > 0].std()), 0, places=2)
+
+        rows, columns = slice(2, 10), slice(5, 25)
+        corrected = calibration.correct(image[rows, columns], rows, columns, numpy.empty((8, 20), dtype="float32"))
+
+        numpy.testing.assert_allclose(corrected, ((image - dark) * calibration.gain)[rows, columns], rtol=1e-5)
+
+        dark_only = Calibration(dark=dark)
+        self.assertIsNone(dark_only.gain)
+        numpy.testing.assert_allclose(dark_only.correct(image, slice(None), slice(None),
+                                                        numpy.empty(image.shape, dtype="float32")), image - dark)
+
+    def test_is_active(self):
+        dark = numpy.zeros((20, 30), dtype="float32")
+
+        self.assertFalse(Calibration().is_active((20, 30)))
+        self.assertTrue(Calibration(dark).is_active((20, 30)))
+        self.assertFalse(Calibration(dark).is_active((30, 20)))
+        self.assertFalse(Calibration(dark, enabled=False).is_active((20, 30)))
+
+        # Frames of different shapes cannot be applied together.
+        self.assertIsNone(Calibration(dark, numpy.ones((10, 10))).shape)
+
+        calibration = Calibration(dark).replace(enabled=False)
+        self.assertIs(calibration.dark, dark)
+        self.assertFalse(calibration.enabled)
+
+        with self.assertRaisesRegex(AttributeError, "immutable"):
+            calibration.enabled = True
+
+    def test_recorder(self):
+        recorded = []
+
+        recorder = CalibrationRecorder("dark", 3, lambda calibration_type, frame: recorded.append((calibration_type,
+                                                                                                    frame)))
+
+        recorder.add(numpy.full((4, 5), 100, dtype="uint16"))
+
+        # A new image shape restarts the recording.
+        for value in (1, 2, 6):
+            self.assertFalse(recorder.done)
+            recorder.add(numpy.full((5, 4), value, dtype="uint16"))
+
+        self.assertTrue(recorder.done)
+        self.assertDictEqual(recorder.get_status(), {"type": "dark", "n_frames": 3, "n_recorded": 3})
+
+        self.assertEqual(len(recorded), 1)
+        self.assertEqual(recorded[0][0], "dark")
+        numpy.testing.assert_array_equal(recorded[0][1], numpy.full((5, 4), 3, dtype="float32"))
+
+    def test_save_load(self):
+        self.assertDictEqual(load_calibration_frames(None), {})
+
+        with tempfile.TemporaryDirectory() as directory:
+            frame = numpy.arange(12, dtype="float32").reshape((3, 4))
+
+            saved_frame = save_calibration_frame(directory + "/camera", "flat", frame)
+            numpy.testing.assert_array_equal(saved_frame, frame)
+
+            frames = load_calibration_frames(directory + "/camera")
+            self.assertListEqual(list(frames), ["flat"])
+            self.assertIsInstance(frames["flat"], numpy.memmap)
+            numpy.testing.assert_array_equal(frames["flat"], frame)
+
+            del saved_frame, frames
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from psen_processing.catch_up import CatchUp, get_message_lag
+
+
+class TestCatchUp(unittest.TestCase):
+
+    def test_message_lag(self):
+        self.assertAlmostEqual(get_message_lag((1000, 500000000), now=1002), 1.5)
+        self.assertIsNone(get_message_lag((None, None), now=1002))
+
+    def test_newest(self):
+        catch_up = CatchUp()
+        parameters = {"mode": "newest", "max_lag": 1.0}
+
+        # The lag is relative to the smallest lag, so a constant clock offset is not a lag.
+        self.assertTrue(catch_up.process(0, 10.0, False, None, parameters))
+        self.assertTrue(catch_up.process(1, 10.5, False, None, parameters))
+        self.assertEqual(catch_up.lag, 0.5)
+
+        # Behind: skipped until the lag is under half of the max lag.
+        self.assertFalse(catch_up.process(2, 11.5, False, None, parameters))
+        self.assertFalse(catch_up.process(3, 10.8, False, None, parameters))
+        self.assertTrue(catch_up.process(4, 10.2, False, None, parameters))
+
+        # A full compute queue is a backlog too.
+        self.assertFalse(catch_up.process(5, 10.0, True, None, parameters))
+        self.assertTrue(catch_up.process(6, 10.0, False, None, parameters))
+
+        self.assertDictEqual(catch_up.get_summary(), {"catch_up_active": False,
+                                                      "catch_up_activations": 2,
+                                                      "skipped_pulse_ids": 3,
+                                                      "last_skipped_pulse_id": 5,
+                                                      "input_lag": 0.0})
+
+    def test_fel(self):
+        catch_up = CatchUp()
+        parameters = {"mode": "fel", "max_lag": 1.0}
+
+        catch_up.process(0, 0.0, False, False, parameters)
+
+        processed = [pulse_id for pulse_id in range(1, 9) if catch_up.process(pulse_id, 2.0, False, pulse_id % 4 == 0,
+                                                                             parameters)]
+
+        # Only the FEL shots are processed while catching up, shots which cannot be classified are skipped.
+        self.assertListEqual(processed, [4, 8])
+        self.assertFalse(catch_up.process(9, 2.0, False, None, parameters))
+
+    def test_off(self):
+        catch_up = CatchUp()
+
+        self.assertFalse(catch_up.process(0, 0.0, True, None, {"mode": "newest", "max_lag": 1.0}))
+        self.assertTrue(catch_up.process(1, 5.0, True, None, {"mode": "off", "max_lag": 1.0}))
+        self.assertFalse(catch_up.active)
+        self.assertEqual(catch_up.lag, 5.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
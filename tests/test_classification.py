@@ -0,0 +1,93 @@
+import unittest
+
+import numpy
+
+from psen_processing.classification import classify_shot, classify_shots, get_classifier_channels
+from psen_processing.utils import get_default_processing_parameters
+
+
+class TestClassification(unittest.TestCase):
+
+    def get_shot_classifier(self, **parameters):
+        shot_classifier = get_default_processing_parameters()["shot_classifier"]
+        shot_classifier.update(parameters)
+
+        return shot_classifier
+
+    def test_modulo(self):
+        shot_classifier = self.get_shot_classifier()
+        self.assertListEqual([pulse_id for pulse_id in range(10) if classify_shot(pulse_id, None, {}, shot_classifier)],
+                             [0, 4, 8])
+
+        shot_classifier = self.get_shot_classifier(period=3, phase=1)
+        self.assertListEqual([pulse_id for pulse_id in range(10) if classify_shot(pulse_id, None, {}, shot_classifier)],
+                             [1, 4, 7])
+
+        self.assertListEqual(get_classifier_channels(shot_classifier), [])
+
+    def test_channel(self):
+        shot_classifier = self.get_shot_classifier(mode="channel", channel="SAR-CVME-TIFALL4:EvtSet")
+        self.assertListEqual(get_classifier_channels(shot_classifier), ["SAR-CVME-TIFALL4:EvtSet"])
+
+        self.assertTrue(classify_shot(0, None, {"SAR-CVME-TIFALL4:EvtSet": 1}, shot_classifier))
+        self.assertFalse(classify_shot(0, None, {"SAR-CVME-TIFALL4:EvtSet": 0}, shot_classifier))
+        self.assertIsNone(classify_shot(0, None, {}, shot_classifier))
+
+        shot_classifier["event_code"] = 2
+        event_codes = numpy.zeros(256, dtype="uint8")
+
+        self.assertFalse(classify_shot(0, None, {"SAR-CVME-TIFALL4:EvtSet": event_codes}, shot_classifier))
+        event_codes[2] = 1
+        self.assertTrue(classify_shot(0, None, {"SAR-CVME-TIFALL4:EvtSet": event_codes}, shot_classifier))
+
+        shot_classifier["event_code"] = 300
+        self.assertIsNone(classify_shot(0, None, {"SAR-CVME-TIFALL4:EvtSet": event_codes}, shot_classifier))
+
+    def test_array_channel(self):
+        shot_classifier = self.get_shot_classifier(mode="channel", channel="EVT")
+
+        # Event code arrays without event code cannot be classified.
+        self.assertIsNone(classify_shot(0, None, {"EVT": numpy.array([1, 0, 1])}, shot_classifier))
+        self.assertTrue(classify_shot(0, None, {"EVT": numpy.array([1])}, shot_classifier))
+
+        fel_shots, background_shots = classify_shots(numpy.arange(4), None, {"EVT": numpy.ones((4, 3))},
+                                                     shot_classifier)
+        self.assertListEqual(list(fel_shots), [False] * 4)
+        self.assertListEqual(list(background_shots), [False] * 4)
+
+        shot_classifier["event_code"] = 1
+        fel_shots, _ = classify_shots(numpy.arange(2), None, {"EVT": numpy.array([[0, 1, 0], [1, 0, 1]])},
+                                      shot_classifier)
+        self.assertListEqual(list(fel_shots), [True, False])
+
+    def test_intensity(self):
+        shot_classifier = self.get_shot_classifier(mode="intensity", threshold=1000)
+
+        self.assertTrue(classify_shot(0, numpy.full(100, 11), {}, shot_classifier))
+        self.assertFalse(classify_shot(0, numpy.full(100, 10), {}, shot_classifier))
+        self.assertIsNone(classify_shot(0, None, {}, shot_classifier))
+
+    def test_batch(self):
+        pulse_ids = numpy.arange(100, 120)
+        signal_profiles = numpy.random.RandomState(0).uniform(size=(20, 10))
+        channels = {"FEL": numpy.arange(20) % 3 == 0}
+
+        for shot_classifier in (self.get_shot_classifier(period=5, phase=2),
+                                self.get_shot_classifier(mode="channel", channel="FEL"),
+                                self.get_shot_classifier(mode="intensity", threshold=5)):
+
+            fel_shots, background_shots = classify_shots(pulse_ids, signal_profiles, channels, shot_classifier)
+
+            expected = [classify_shot(pulse_id, signal_profile, {"FEL": fel}, shot_classifier)
+                        for pulse_id, signal_profile, fel in zip(pulse_ids, signal_profiles, channels["FEL"])]
+
+            numpy.testing.assert_array_equal(fel_shots, expected)
+            numpy.testing.assert_array_equal(background_shots, numpy.logical_not(expected))
+
+        fel_shots, background_shots = classify_shots(pulse_ids, None, {}, self.get_shot_classifier(mode="channel",
+                                                                                                   channel="FEL"))
+        self.assertFalse(fel_shots.any() or background_shots.any())
+
+
+if __name__ == '__main__':
+    unittest.main()
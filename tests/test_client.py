@@ -8,7 +8,7 @@ from bsread import source, PULL, json
 from multiprocessing import Process
 
 from psen_processing import config, PsenProcessingClient
-from psen_processing.start_processing import start_processing
+from psen_processing.start_processing import start_processing, start_multi_camera_processing
 
 
 class TestClient(unittest.TestCase):
@@ -74,17 +74,113 @@ class TestClient(unittest.TestCase):
         client.set_roi_background(roi_background)
         self.assertListEqual(client.get_roi_background(), roi_background)
 
+        self.assertDictEqual(client.get_rois(), {})
+
+        self.assertDictEqual(client.set_roi("peak", [0, 50, 0, 100]), {"roi": [0, 50, 0, 100], "projection": "x",
+                                                                       "edge_finding": False, "moments": False})
+        self.assertEqual(client.set_roi("peak", projection="y")["projection"], "y")
+
+        with self.assertRaisesRegex(ValueError, "Projection of ROI"):
+            client.set_roi("peak", projection="z")
+
+        client.set_rois({"total": {"roi": [0, 1024, 0, 1024], "projection": "sum"}})
+        self.assertListEqual(list(client.get_rois()), ["total"])
+        self.assertEqual(client.get_roi("total")["projection"], "sum")
+
+        self.assertDictEqual(client.delete_roi("total"), {})
+
+        self.assertDictEqual(client.get_background_parameters(), {"mode": config.DEFAULT_BACKGROUND_MODE,
+                                                                  "depth": config.DEFAULT_BACKGROUND_DEPTH})
+
+        client.set_background_parameters({"mode": "ema", "depth": 100})
+        self.assertDictEqual(client.get_background_parameters(), {"mode": "ema", "depth": 100})
+
+        with self.assertRaisesRegex(ValueError, "Background mode"):
+            client.set_background_parameters({"mode": "unknown"})
+
+        self.assertDictEqual(client.get_image_forwarding_parameters(),
+                             {"mode": config.DEFAULT_IMAGE_FORWARDING_MODE,
+                              "decimation": config.DEFAULT_IMAGE_FORWARDING_DECIMATION})
+
+        client.set_image_forwarding_parameters({"mode": "decimate", "decimation": 5})
+        self.assertDictEqual(client.get_image_forwarding_parameters(), {"mode": "decimate", "decimation": 5})
+
+        client.set_image_forwarding_parameters({"mode": "all"})
+
+        self.assertDictEqual(client.get_channel_forwarding_parameters(), {"channels": []})
+        self.assertDictEqual(client.set_channel_forwarding_parameters({"channels": ["*:EvtSet"]}),
+                             {"channels": ["*:EvtSet"]})
+        client.set_channel_forwarding_parameters({"channels": []})
+
+        self.assertDictEqual(client.get_catch_up_parameters(), {"mode": "off", "max_lag": 1.0})
+        self.assertDictEqual(client.set_catch_up_parameters({"mode": "fel", "max_lag": 0.2}),
+                             {"mode": "fel", "max_lag": 0.2})
+        self.assertDictEqual(client.set_catch_up_parameters({"mode": "newest"}), {"mode": "newest", "max_lag": 0.2})
+
+        with self.assertRaisesRegex(ValueError, "Catch up mode"):
+            client.set_catch_up_parameters({"mode": "oldest"})
+
+        client.set_catch_up_parameters({"mode": "off", "max_lag": 1.0})
+
+        self.assertEqual(client.get_shot_classifier_parameters()["period"], config.DEFAULT_FEL_PERIOD)
+        self.assertEqual(client.set_shot_classifier_parameters({"phase": 2})["phase"], 2)
+        client.set_shot_classifier_parameters({"phase": config.DEFAULT_FEL_PHASE})
+
+        self.assertEqual(client.get_edge_finder_parameters()["step_length"], config.DEFAULT_EDGE_STEP_LENGTH)
+        self.assertEqual(client.set_edge_finder_parameters({"peak_fit": "parabolic"})["peak_fit"], "parabolic")
+
+        with self.assertRaisesRegex(ValueError, "Edge finder refinement"):
+            client.set_edge_finder_parameters({"refinement": 2})
+
+        client.set_edge_finder_parameters({"peak_fit": None})
+
+        self.assertDictEqual(client.get_calibration(), {"enabled": True, "recording": None,
+                                                        "dark": None, "flat": None})
+        self.assertFalse(client.set_calibration_parameters({"enabled": False})["enabled"])
+        self.assertDictEqual(client.record_calibration("dark", n_frames=10)["recording"],
+                             {"type": "dark", "n_frames": 10, "n_recorded": 0})
+
+        with self.assertRaisesRegex(ValueError, "Calibration type"):
+            client.record_calibration("bright")
+
+        self.assertIsNone(client.delete_calibration("dark")["recording"])
+        client.set_calibration_parameters({"enabled": True})
+
         self.assertDictEqual(client.get_statistics(), {})
 
         client.start()
         self.assertEqual(client.get_status(), "processing")
 
         statistics = client.get_statistics()
-        self.assertEqual(len(statistics), 4)
+        self.assertEqual(len(statistics), 24)
         self.assertTrue("processing_start_time" in statistics)
         self.assertTrue("last_sent_pulse_id" in statistics)
         self.assertTrue("last_sent_time" in statistics)
         self.assertTrue("n_processed_images" in statistics)
+        self.assertTrue("compute_queue_occupancy" in statistics)
+        self.assertTrue("compute_queue_dropped" in statistics)
+        self.assertTrue("data_output_queue_occupancy" in statistics)
+        self.assertTrue("data_output_queue_dropped" in statistics)
+        self.assertTrue("image_output_queue_occupancy" in statistics)
+        self.assertTrue("image_output_queue_dropped" in statistics)
+        self.assertTrue("reorder_buffer_occupancy" in statistics)
+        self.assertTrue("reorder_buffer_dropped" in statistics)
+        self.assertTrue("frames_per_second" in statistics)
+        self.assertTrue("data_output_dropped" in statistics)
+        self.assertTrue("image_output_dropped" in statistics)
+        self.assertTrue("data_output_layout_changes" in statistics)
+        self.assertTrue("pulse_id_gaps" in statistics)
+        self.assertTrue("missing_pulse_ids" in statistics)
+        self.assertTrue("latency" in statistics)
+
+        # Nothing was received yet, so nothing was skipped.
+        self.assertFalse(statistics["catch_up_active"])
+        self.assertEqual(statistics["catch_up_activations"], 0)
+        self.assertEqual(statistics["skipped_pulse_ids"], 0)
+        self.assertIsNone(statistics["last_skipped_pulse_id"])
+        self.assertIsNone(statistics["input_lag"])
+
+        self.assertIn("psen_processing_latency_seconds_count{stage=\"profiles\"}", client.get_metrics())
 
         processed_data = []
 
@@ -239,3 +335,67 @@ class TestClient(unittest.TestCase):
 
         for index, data in enumerate(processed_data):
             self.assertEqual(data.data.pulse_id, index)
+
+    def test_multi_camera(self):
+        cameras = [{"name": "first", "input_stream": "tcp://localhost:11000", "prefix": self.pv_name_prefix,
+                    "data_output_stream_port": 13000, "image_output_stream_port": 13001,
+                    "roi_signal": [], "roi_background": [], "background": None, "image_forwarding": None,
+                    "shot_classifier": None,
+                    "auto_start": False,
+                    "rois": None, "channel_forwarding": None, "edge_finder": None, "roi_bounds_policy": "reject",
+                    "calibration_directory": None, "raw_receive": True, "catch_up": None,
+                    "output_queue_size": 10, "output_drop_policy": "drop_oldest", "output_high_water_mark": 100,
+                    "queue_size": 10, "drop_policy": "block", "n_workers": 1, "max_reorder_latency": 0.5},
+                   {"name": "second", "input_stream": "tcp://localhost:11010", "prefix": "OTHER_CAMERA",
+                    "data_output_stream_port": 13010, "image_output_stream_port": 13011,
+                    "roi_signal": [0, 100, 0, 100], "roi_background": [], "background": None,
+                    "image_forwarding": None, "shot_classifier": None, "auto_start": False,
+                    "rois": None, "channel_forwarding": None, "edge_finder": None, "roi_bounds_policy": "reject",
+                    "calibration_directory": None, "raw_receive": True, "catch_up": None,
+                    "output_queue_size": 10, "output_drop_policy": "drop_oldest", "output_high_water_mark": 100,
+                    "queue_size": 10, "drop_policy": "block", "n_workers": 1, "max_reorder_latency": 0.5}]
+
+        def process_cameras():
+            start_multi_camera_processing(cameras=cameras,
+                                          rest_api_interface="0.0.0.0",
+                                          rest_api_port=10010,
+                                          auto_start=False)
+
+        multi_camera_process = Process(target=process_cameras)
+        multi_camera_process.start()
+        sleep(1)
+
+        try:
+            self.assertDictEqual(PsenProcessingClient("http://localhost:10010/").get_cameras(),
+                                 {"first": "stopped", "second": "stopped"})
+
+            first_client = PsenProcessingClient("http://localhost:10010/", camera="first")
+            second_client = PsenProcessingClient("http://localhost:10010/", camera="second")
+
+            self.assertListEqual(first_client.get_roi_signal(), [])
+            self.assertListEqual(second_client.get_roi_signal(), [0, 100, 0, 100])
+
+            first_client.set_roi_signal([0, 1024, 0, 1024])
+            self.assertListEqual(first_client.get_roi_signal(), [0, 1024, 0, 1024])
+            self.assertListEqual(second_client.get_roi_signal(), [0, 100, 0, 100])
+
+            first_client.start()
+            self.assertEqual(first_client.get_status(), "processing")
+            self.assertEqual(second_client.get_status(), "stopped")
+
+            processed_data = []
+
+            with source(host="localhost", port=13000, mode=PULL, receive_timeout=1000) as input_stream:
+                self.sending_process.start()
+                sleep(0.5)
+
+                for index in range(self.n_images):
+                    processed_data.append(input_stream.receive())
+
+            self.assertEqual(first_client.get_statistics()["n_processed_images"], self.n_images)
+
+            first_client.stop()
+            self.assertEqual(first_client.get_status(), "stopped")
+
+        finally:
+            multi_camera_process.terminate()
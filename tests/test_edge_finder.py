@@ -0,0 +1,130 @@
+import unittest
+
+import numpy
+
+from psen_processing import config
+from psen_processing.benchmark import get_synthetic_edges
+from psen_processing.edge_finder import find_edge, get_step_kernel, get_fft_length, fit_peaks
+
+
+def reference_find_edge(data, step_length=50, edge_type='falling', refinement=1):
+    # Original per-row implementation, used to validate the vectorized one.
+    def _interp(fp, xp, x):
+        return numpy.interp(x, xp, fp)
+
+    data_length = data.shape[1]
+    refined_data = numpy.apply_along_axis(_interp, axis=1, arr=data,
+                                          x=numpy.arange(0, data_length - 1, refinement),
+                                          xp=numpy.arange(data_length))
+
+    step_waveform = numpy.ones(shape=(step_length,))
+    if edge_type == 'rising':
+        step_waveform[: int(step_length / 2)] = -1
+    elif edge_type == 'falling':
+        step_waveform[int(step_length / 2):] = -1
+
+    step_waveform = numpy.interp(x=numpy.arange(0, step_length - 1, refinement),
+                                 xp=numpy.arange(step_length),
+                                 fp=step_waveform)
+
+    xcorr = numpy.apply_along_axis(numpy.correlate, 1, refined_data, v=step_waveform, mode='valid')
+    edge_position = numpy.argmax(xcorr, axis=1).astype(float) * refinement
+    xcorr_amplitude = numpy.amax(xcorr, axis=1)
+
+    edge_position += numpy.floor(step_length / 2)
+
+    return {'edge_pos': edge_position, 'xcorr_ampl': xcorr_amplitude}
+
+
+def get_step_profiles(n_profiles, length, edge_positions, edge_type='falling'):
+    random = numpy.random.RandomState(0)
+    profiles = random.normal(scale=0.05, size=(n_profiles, length))
+
+    for profile, edge_position in zip(profiles, edge_positions):
+        if edge_type == 'falling':
+            profile[:edge_position] += 1
+        else:
+            profile[edge_position:] += 1
+
+    return profiles
+
+
+class TestEdgeFinder(unittest.TestCase):
+
+    def test_matches_reference(self):
+        edge_positions = [300, 512, 700, 1500]
+        profiles = get_step_profiles(len(edge_positions), 2048, edge_positions)
+
+        for refinement in (1, 0.5, 0.1):
+            for step_length in (20, 50, 200):
+                expected = reference_find_edge(profiles, step_length=step_length, refinement=refinement)
+                result = find_edge(profiles, step_length=step_length, refinement=refinement)
+
+                numpy.testing.assert_array_equal(result["edge_pos"], expected["edge_pos"])
+                numpy.testing.assert_allclose(result["xcorr_ampl"], expected["xcorr_ampl"], rtol=1e-9)
+
+    def test_edge_types(self):
+        profiles = get_step_profiles(1, 1024, [400], edge_type="rising")
+
+        result = find_edge(profiles, edge_type="rising")
+        self.assertLessEqual(abs(result["edge_pos"][0] - 400), 1)
+
+        expected = reference_find_edge(profiles, edge_type="rising")
+        numpy.testing.assert_array_equal(result["edge_pos"], expected["edge_pos"])
+
+    def test_single_profile(self):
+        profile = get_step_profiles(1, 1024, [600])[0]
+
+        result = find_edge(profile)
+
+        self.assertTrue(numpy.isscalar(result["edge_pos"]))
+        self.assertLessEqual(abs(result["edge_pos"] - 600), 1)
+
+    def test_short_profile(self):
+        result = find_edge(numpy.ones(shape=(2, 10)))
+
+        self.assertTrue(numpy.all(numpy.isnan(result["edge_pos"])))
+        self.assertTrue(numpy.all(numpy.isnan(result["xcorr_ampl"])))
+
+    def test_peak_fit(self):
+        profiles, edge_positions = get_synthetic_edges(20, 1024, edge_width=5, noise=0)
+
+        native_errors = find_edge(profiles, step_length=100)["edge_pos"] - edge_positions
+        self.assertGreater(numpy.max(numpy.abs(native_errors)), 0.3)
+
+        for peak_fit in ("parabolic", "gaussian"):
+            result = find_edge(profiles, step_length=100, peak_fit=peak_fit)
+
+            numpy.testing.assert_allclose(result["edge_pos"], edge_positions, atol=0.01)
+            numpy.testing.assert_array_equal(result["xcorr_ampl"], find_edge(profiles, step_length=100)["xcorr_ampl"])
+
+        rising_profiles, edge_positions = get_synthetic_edges(20, 1024, edge_width=5, noise=0, edge_type="rising")
+        numpy.testing.assert_allclose(find_edge(rising_profiles, step_length=100, edge_type="rising",
+                                                peak_fit="parabolic")["edge_pos"], edge_positions, atol=0.01)
+
+    def test_fit_peaks(self):
+        x = numpy.arange(10, dtype=float)
+        xcorr = numpy.array([10 - (x - 4.3) ** 2, numpy.exp(-(x - 6.8) ** 2), x, numpy.ones(10)])
+        peak_index = numpy.argmax(xcorr, axis=1)
+
+        offsets = fit_peaks(xcorr, peak_index, "parabolic")
+        self.assertAlmostEqual(offsets[0], 0.3)
+        # Maxima at the end of the cross-correlation, and flat ones, are not fitted.
+        self.assertListEqual(list(offsets[2:]), [0, 0])
+
+        self.assertAlmostEqual(fit_peaks(xcorr, peak_index, "gaussian")[1], -0.2)
+        self.assertAlmostEqual(fit_peaks(xcorr, peak_index, "parabolic", n_points=5)[0], 0.3)
+
+    def test_kernel_cache(self):
+        kernel = get_step_kernel(50, "falling", 0.5)
+
+        self.assertIs(kernel, get_step_kernel(50, "falling", 0.5))
+        self.assertFalse(kernel.flags.writeable)
+
+        self.assertGreater(len(get_step_kernel(200, "falling", 1)), config.EDGE_FINDER_FFT_THRESHOLD)
+
+    def test_fft_length(self):
+        self.assertEqual(get_fft_length(2048), 2048)
+        self.assertEqual(get_fft_length(2047), 2048)
+        self.assertEqual(get_fft_length(1001), 1024)
+        self.assertEqual(get_fft_length(7), 8)
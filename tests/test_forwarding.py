@@ -0,0 +1,62 @@
+import unittest
+
+import numpy
+
+from psen_processing.forwarding import get_forwarded_channels, get_forwarded_image, get_rois_union
+from psen_processing.rois import RoiConfig
+
+
+class TestForwarding(unittest.TestCase):
+
+    def test_rois_union(self):
+        self.assertListEqual(get_rois_union([[], []]), [])
+        self.assertListEqual(get_rois_union([[10, 20, 30, 40], []]), [10, 20, 30, 40])
+        self.assertListEqual(get_rois_union([[10, 20, 30, 40], [0, 5, 100, 10]]), [0, 30, 30, 80])
+
+    def test_forwarded_channels(self):
+        channel_names = ("CAMERA:FPICTURE", "CAMERA:ENERGY", "SAR-CVME-TIFALL4:EvtSet", "camera:lower")
+
+        self.assertEqual(get_forwarded_channels(("*",), channel_names, "CAMERA:FPICTURE"),
+                         ("CAMERA:ENERGY", "SAR-CVME-TIFALL4:EvtSet", "camera:lower"))
+        self.assertEqual(get_forwarded_channels(("CAMERA:*", "*EvtSet"), channel_names, "CAMERA:FPICTURE"),
+                         ("CAMERA:ENERGY", "SAR-CVME-TIFALL4:EvtSet"))
+        self.assertEqual(get_forwarded_channels((), channel_names, "CAMERA:FPICTURE"), ())
+
+        # The patterns are matched once per set of input channels.
+        self.assertIs(get_forwarded_channels(("CAMERA:*",), channel_names, "CAMERA:FPICTURE"),
+                      get_forwarded_channels(("CAMERA:*",), channel_names, "CAMERA:FPICTURE"))
+
+    def test_forwarding_modes(self):
+        image = numpy.arange(100 * 200, dtype="uint16").reshape((100, 200))
+
+        def forward(sequence, fel_shot, mode, decimation=10, roi_signal=None, roi_background=None, named_rois=None):
+            return get_forwarded_image(sequence, fel_shot, image, "image",
+                                       RoiConfig(roi_signal, roi_background, named_rois),
+                                       {"mode": mode, "decimation": decimation})
+
+        self.assertIs(forward(0, True, "all")["image"], image)
+        self.assertIsNone(forward(0, True, "off"))
+
+        forwarded = [sequence for sequence in range(10) if forward(sequence, False, "decimate", decimation=3)]
+        self.assertListEqual(forwarded, [0, 3, 6, 9])
+
+        self.assertIsNone(forward(0, False, "fel"))
+        self.assertIs(forward(1, True, "fel")["image"], image)
+
+        # Without ROIs, the whole image is forwarded.
+        self.assertDictEqual(forward(0, True, "roi"), {"image": image})
+
+        data = forward(0, True, "roi", roi_signal=[10, 20, 30, 40], roi_background=[50, 10, 5, 5])
+        numpy.testing.assert_array_equal(data["image"], image[5:70, 10:60])
+        numpy.testing.assert_array_equal(data["image.image_roi"], [10, 50, 5, 65])
+
+        # Named ROIs outside of the signal and background ROIs widen the crop.
+        named_rois = {"peak": {"roi": [150, 20, 80, 10], "projection": "x", "edge_finding": False, "moments": False}}
+        data = forward(0, True, "roi", roi_signal=[10, 20, 30, 40], roi_background=[50, 10, 5, 5],
+                       named_rois=named_rois)
+        numpy.testing.assert_array_equal(data["image"], image[5:90, 10:170])
+        numpy.testing.assert_array_equal(data["image.image_roi"], [10, 160, 5, 85])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,14 @@
+import json
+import os
+import tempfile
 import unittest
 from time import sleep
 
+import numpy
+
 from psen_processing import config
 from psen_processing.manager import ProcessingManager
-from psen_processing.utils import validate_roi
+from psen_processing.utils import validate_roi, load_cameras_config
 
 
 class TestProcessingManager(unittest.TestCase):
@@ -12,7 +17,7 @@ class TestProcessingManager(unittest.TestCase):
         test_roi_signal = []
         test_roi_background = []
 
-        def processor(running_flag, roi_signal, roi_background, statistics):
+        def processor(running_flag, statistics, processing_parameters):
             nonlocal test_roi_signal
             nonlocal test_roi_background
 
@@ -20,8 +25,9 @@ class TestProcessingManager(unittest.TestCase):
 
             while running_flag.is_set():
 
-                test_roi_signal = roi_signal
-                test_roi_background = roi_background
+                roi_config = processing_parameters["rois"]
+                test_roi_signal = list(roi_config.roi_signal)
+                test_roi_background = list(roi_config.roi_background)
 
                 statistics["counter"] = statistics.get("counter", 0) + 1
 
@@ -49,6 +55,10 @@ class TestProcessingManager(unittest.TestCase):
             sleep(0.1)
             self.assertListEqual(test_roi_background, roi_background)
 
+            # Every change is a new version of the ROI config, and the old configs are never modified.
+            self.assertEqual(manager.get_roi_version(), 2)
+            self.assertListEqual(manager.get_roi_signal(), roi_signal)
+
             manager.stop()
             self.assertEqual(manager.get_status(), "stopped")
 
@@ -62,7 +72,7 @@ class TestProcessingManager(unittest.TestCase):
 
     def test_exception_when_starting(self):
 
-        def processor(running_flag, roi_signal, roi_background, statistics):
+        def processor(running_flag, statistics, processing_parameters):
             sleep(config.PROCESSOR_START_TIMEOUT + 0.2)
 
         with self.assertRaisesRegex(RuntimeError, "Cannot start processing"):
@@ -90,3 +100,359 @@ class TestProcessingManager(unittest.TestCase):
 
         with self.assertRaisesRegex(ValueError, "ROI must be an instance of a list"):
             validate_roi(None)
+
+        validate_roi([10, 190, 20, 80], image_shape=(100, 200))
+
+        with self.assertRaisesRegex(ValueError, "ROI must fit in the image"):
+            validate_roi([10, 191, 20, 80], image_shape=(100, 200))
+
+        with self.assertRaisesRegex(ValueError, "ROI must fit in the image"):
+            validate_roi([10, 190, 21, 80], image_shape=(100, 200))
+
+    def test_roi_bounds_policy(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        with self.assertRaisesRegex(ValueError, "ROI bounds policy"):
+            ProcessingManager(processor, roi_bounds_policy="ignore")
+
+        manager = ProcessingManager(processor, roi_signal=[0, 1000, 0, 1000])
+
+        # The image shape is not known yet, the stream processor clips the ROIs.
+        self.assertIsNone(manager.get_image_shape())
+        self.assertListEqual(manager.get_roi_signal(), [0, 1000, 0, 1000])
+
+        manager.processing_parameters["image_shape"] = (100, 200)
+
+        with self.assertRaisesRegex(ValueError, "ROI must fit in the image"):
+            manager.set_roi_signal([150, 100, 0, 100])
+
+        self.assertEqual(manager.get_roi_version(), 0)
+
+        manager.set_roi_signal([50, 100, 0, 100])
+        self.assertEqual(manager.get_roi_version(), 1)
+
+        manager = ProcessingManager(processor, roi_bounds_policy="clip")
+        manager.processing_parameters["image_shape"] = (100, 200)
+
+        # The ROI is kept as it was set, and only clipped for the images it does not fit in.
+        manager.set_roi_signal([150, 100, 0, 100])
+        manager.set_roi_background([0, 10, 0, 10])
+        self.assertListEqual(manager.get_roi_signal(), [150, 100, 0, 100])
+
+        roi_config = manager.processing_parameters["rois"]
+        self.assertIsNone(roi_config.image_shape)
+        self.assertEqual(roi_config.resolve((100, 200)).roi_signal, (150, 50, 0, 100))
+        self.assertEqual(roi_config.resolve((100, 400)).roi_signal, (150, 100, 0, 100))
+
+    def test_named_rois(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        manager = ProcessingManager(processor, rois={"peak": {"roi": [0, 10, 0, 10]}})
+
+        self.assertDictEqual(manager.get_rois(), {"peak": {"roi": [0, 10, 0, 10], "projection": "x",
+                                                           "edge_finding": False, "moments": False}})
+
+        manager.set_roi("peak", {"edge_finding": True})
+        manager.set_roi("total", {"roi": [0, 100, 0, 100], "projection": "sum"})
+
+        self.assertTrue(manager.get_roi("peak")["edge_finding"])
+        self.assertListEqual(list(manager.get_rois()), ["peak", "total"])
+        self.assertEqual(manager.processing_parameters["rois"].projections, ("x", "x", "x", "sum"))
+
+        with self.assertRaisesRegex(ValueError, "needs an 'x' or 'y' projection"):
+            manager.set_roi("total", {"edge_finding": True})
+
+        with self.assertRaisesRegex(ValueError, "ROI name"):
+            manager.set_roi("signal", {"roi": [0, 10, 0, 10]})
+
+        with self.assertRaisesRegex(ValueError, "must not be empty"):
+            manager.set_roi("new", {})
+
+        with self.assertRaisesRegex(ValueError, "unknown keys"):
+            manager.set_roi("peak", {"size": 10})
+
+        manager.delete_roi("peak")
+        self.assertListEqual(list(manager.get_rois()), ["total"])
+
+        with self.assertRaisesRegex(ValueError, "does not exist"):
+            manager.delete_roi("peak")
+
+        manager.set_rois(None)
+        self.assertDictEqual(manager.get_rois(), {})
+
+    def test_edge_finder_parameters(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        manager = ProcessingManager(processor, edge_finder_parameters={"step_length": 100})
+        self.assertDictEqual(manager.get_edge_finder_parameters(), {"step_length": 100, "edge_type": "falling",
+                                                                    "refinement": 1, "peak_fit": None})
+
+        manager.set_edge_finder_parameters({"edge_type": "rising", "peak_fit": "gaussian"})
+        self.assertEqual(manager.get_edge_finder_parameters()["step_length"], 100)
+        self.assertEqual(manager.processing_parameters["rois"].edge_finder["peak_fit"], "gaussian")
+        self.assertEqual(manager.get_roi_version(), 2)
+
+        with self.assertRaisesRegex(ValueError, "step length"):
+            manager.set_edge_finder_parameters({"step_length": 1})
+
+        with self.assertRaisesRegex(ValueError, "edge type"):
+            manager.set_edge_finder_parameters({"edge_type": "up"})
+
+        with self.assertRaisesRegex(ValueError, "refinement"):
+            manager.set_edge_finder_parameters({"refinement": 0.001})
+
+        with self.assertRaisesRegex(ValueError, "peak fit"):
+            manager.set_edge_finder_parameters({"peak_fit": "cubic"})
+
+        with self.assertRaisesRegex(ValueError, "Unknown edge finder parameters"):
+            manager.set_edge_finder_parameters({"length": 10})
+
+        self.assertEqual(manager.get_roi_version(), 2)
+
+        # A ROI change keeps the edge finder parameters.
+        manager.set_roi_signal([0, 10, 0, 10])
+        self.assertEqual(manager.get_edge_finder_parameters()["edge_type"], "rising")
+
+    def test_calibration(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = ProcessingManager(processor, calibration_directory=directory)
+
+            self.assertDictEqual(manager.get_calibration(), {"enabled": True, "recording": None,
+                                                             "dark": None, "flat": None})
+
+            with self.assertRaisesRegex(ValueError, "Calibration type"):
+                manager.record_calibration("bright")
+
+            with self.assertRaisesRegex(ValueError, "Number of calibration frames"):
+                manager.record_calibration("dark", n_frames=0)
+
+            manager.record_calibration("dark", n_frames=2)
+            self.assertDictEqual(manager.get_calibration()["recording"], {"type": "dark", "n_frames": 2,
+                                                                          "n_recorded": 0})
+
+            # The receive stage of the stream processor feeds the recorder.
+            for _ in range(2):
+                manager.processing_parameters["calibration_recorder"].add(numpy.full((20, 30), 10, dtype="uint16"))
+
+            # The frame is saved and applied in its own thread, not in the receive stage.
+            manager.calibration_thread.join()
+
+            calibration = manager.get_calibration()
+            self.assertIsNone(calibration["recording"])
+            self.assertDictEqual(calibration["dark"], {"shape": [20, 30],
+                                                       "filename": os.path.join(directory, "dark.npy")})
+            self.assertTrue(manager.processing_parameters["calibration"].is_active((20, 30)))
+
+            # The receive stage does not wait for the save, and a frame replaced by a newer recording is discarded.
+            with manager.calibration_save_lock:
+                manager.record_calibration("flat", n_frames=1)
+                manager.processing_parameters["calibration_recorder"].add(numpy.full((20, 30), 20, dtype="uint16"))
+                manager.record_calibration("flat", n_frames=1)
+
+            manager.calibration_thread.join()
+            self.assertIsNone(manager.get_calibration()["flat"])
+            self.assertFalse(os.path.exists(os.path.join(directory, "flat.npy")))
+
+            manager.set_calibration_parameters({"enabled": False})
+            self.assertFalse(manager.processing_parameters["calibration"].is_active((20, 30)))
+
+            with self.assertRaisesRegex(ValueError, "Calibration enabled"):
+                manager.set_calibration_parameters({"enabled": "yes"})
+
+            # The saved frames are loaded at startup.
+            new_manager = ProcessingManager(processor, calibration_directory=directory)
+            self.assertEqual(new_manager.processing_parameters["calibration"].shape, (20, 30))
+
+            new_manager.delete_calibration("dark")
+            self.assertIsNone(new_manager.get_calibration()["dark"])
+            self.assertFalse(os.path.exists(os.path.join(directory, "dark.npy")))
+
+    def test_calibration_rerecording(self):
+        n_corrected = 0
+
+        def processor(running_flag, statistics, processing_parameters):
+            nonlocal n_corrected
+
+            running_flag.set()
+            out = numpy.zeros((10, 10), dtype=config.CALIBRATION_DTYPE)
+
+            while running_flag.is_set():
+                calibration = processing_parameters["calibration"]
+
+                if calibration.dark is not None:
+                    calibration.correct(numpy.zeros((10, 10)), slice(0, 10), slice(0, 10), out)
+                    n_corrected += 1
+
+        with tempfile.TemporaryDirectory() as directory:
+            manager = ProcessingManager(processor, calibration_directory=directory)
+            manager.start()
+
+            # The processing keeps reading the mapped dark frame while a smaller one replaces it.
+            for shape in [(1000, 1000), (20, 30), (500, 500)]:
+                manager.record_calibration("dark", n_frames=1)
+                manager.processing_parameters["calibration_recorder"].add(numpy.full(shape, 10, dtype="uint16"))
+                manager.calibration_thread.join()
+
+                sleep(0.05)
+
+            manager.stop()
+
+            self.assertGreater(n_corrected, 0)
+            self.assertEqual(manager.processing_parameters["calibration"].shape, (500, 500))
+            self.assertListEqual(os.listdir(directory), ["dark.npy"])
+
+    def test_background_parameters(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        manager = ProcessingManager(processor, background_parameters={"depth": 100})
+        self.assertDictEqual(manager.get_background_parameters(), {"mode": config.DEFAULT_BACKGROUND_MODE,
+                                                                   "depth": 100})
+
+        manager.set_background_parameters({"mode": "median"})
+        self.assertDictEqual(manager.get_background_parameters(), {"mode": "median", "depth": 100})
+
+        manager.set_background_parameters(None)
+        self.assertDictEqual(manager.get_background_parameters(), {"mode": "median", "depth": 100})
+
+        with self.assertRaisesRegex(ValueError, "Background mode"):
+            manager.set_background_parameters({"mode": "unknown"})
+
+        with self.assertRaisesRegex(ValueError, "Background depth"):
+            manager.set_background_parameters({"depth": 0})
+
+        with self.assertRaisesRegex(ValueError, "Background parameters must be a dictionary"):
+            manager.set_background_parameters([1, 2])
+
+        self.assertDictEqual(manager.get_background_parameters(), {"mode": "median", "depth": 100})
+        self.assertIs(manager.processing_parameters["background"], manager.get_background_parameters())
+
+    def test_image_forwarding_parameters(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        manager = ProcessingManager(processor, image_forwarding_parameters={"mode": "fel"})
+        self.assertDictEqual(manager.get_image_forwarding_parameters(),
+                             {"mode": "fel", "decimation": config.DEFAULT_IMAGE_FORWARDING_DECIMATION})
+
+        manager.set_image_forwarding_parameters({"mode": "decimate", "decimation": 3})
+        self.assertDictEqual(manager.get_image_forwarding_parameters(), {"mode": "decimate", "decimation": 3})
+
+        with self.assertRaisesRegex(ValueError, "Image forwarding mode"):
+            manager.set_image_forwarding_parameters({"mode": "unknown"})
+
+        with self.assertRaisesRegex(ValueError, "Image forwarding decimation"):
+            manager.set_image_forwarding_parameters({"decimation": 0})
+
+        self.assertDictEqual(manager.get_image_forwarding_parameters(), {"mode": "decimate", "decimation": 3})
+
+    def test_channel_forwarding_parameters(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        manager = ProcessingManager(processor)
+        self.assertDictEqual(manager.get_channel_forwarding_parameters(), {"channels": []})
+
+        manager.set_channel_forwarding_parameters({"channels": ["*:EvtSet", "SARES11-*"]})
+        self.assertListEqual(manager.processing_parameters["channel_forwarding"]["channels"], ["*:EvtSet", "SARES11-*"])
+
+        with self.assertRaisesRegex(ValueError, "Forwarded channels"):
+            manager.set_channel_forwarding_parameters({"channels": "*"})
+
+        with self.assertRaisesRegex(ValueError, "Forwarded channels"):
+            manager.set_channel_forwarding_parameters({"channels": [""]})
+
+    def test_catch_up_parameters(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        manager = ProcessingManager(processor, catch_up_parameters={"mode": "newest"})
+        self.assertDictEqual(manager.get_catch_up_parameters(),
+                             {"mode": "newest", "max_lag": config.DEFAULT_CATCH_UP_MAX_LAG})
+
+        manager.set_catch_up_parameters({"max_lag": 0.2})
+        self.assertDictEqual(manager.processing_parameters["catch_up"], {"mode": "newest", "max_lag": 0.2})
+
+        with self.assertRaisesRegex(ValueError, "Catch up mode"):
+            manager.set_catch_up_parameters({"mode": "oldest"})
+
+        with self.assertRaisesRegex(ValueError, "Catch up max lag"):
+            manager.set_catch_up_parameters({"max_lag": 0})
+
+    def test_shot_classifier_parameters(self):
+
+        def processor(running_flag, statistics, processing_parameters):
+            pass
+
+        manager = ProcessingManager(processor, shot_classifier_parameters={"period": 2, "phase": 1})
+        self.assertEqual(manager.get_shot_classifier_parameters()["mode"], config.DEFAULT_SHOT_CLASSIFIER_MODE)
+        self.assertEqual(manager.get_shot_classifier_parameters()["period"], 2)
+
+        with self.assertRaisesRegex(ValueError, "Shot classifier phase"):
+            manager.set_shot_classifier_parameters({"period": 1})
+
+        with self.assertRaisesRegex(ValueError, "Shot classifier channel"):
+            manager.set_shot_classifier_parameters({"mode": "channel"})
+
+        with self.assertRaisesRegex(ValueError, "Shot classifier threshold"):
+            manager.set_shot_classifier_parameters({"mode": "intensity"})
+
+        manager.set_shot_classifier_parameters({"mode": "channel", "channel": "SAR-CVME-TIFALL4:EvtSet",
+                                                "event_code": 200})
+        self.assertEqual(manager.get_shot_classifier_parameters()["channel"], "SAR-CVME-TIFALL4:EvtSet")
+        self.assertEqual(manager.get_shot_classifier_parameters()["period"], 2)
+
+    def test_load_cameras_config(self):
+        cameras = [{"input_stream": "tcp://localhost:9010", "prefix": "FIRST",
+                    "data_output_stream_port": 8895, "image_output_stream_port": 8896},
+                   {"name": "second", "input_stream": "tcp://localhost:9020", "prefix": "SECOND",
+                    "data_output_stream_port": 8897, "image_output_stream_port": 8898,
+                    "roi_signal": [0, 10, 0, 10], "auto_start": True}]
+
+        def load(cameras_config):
+            with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as output_file:
+                json.dump(cameras_config, output_file)
+
+            try:
+                return load_cameras_config(output_file.name)
+            finally:
+                os.remove(output_file.name)
+
+        loaded_cameras = load(cameras)
+
+        self.assertEqual(loaded_cameras[0]["name"], "FIRST")
+        self.assertListEqual(loaded_cameras[0]["roi_signal"], [])
+        self.assertIsNone(loaded_cameras[0]["auto_start"])
+
+        self.assertEqual(loaded_cameras[1]["name"], "second")
+        self.assertListEqual(loaded_cameras[1]["roi_signal"], [0, 10, 0, 10])
+        self.assertTrue(loaded_cameras[1]["auto_start"])
+
+        with self.assertRaisesRegex(ValueError, "missing the keys"):
+            load([{"prefix": "FIRST"}])
+
+        with self.assertRaisesRegex(ValueError, "used more than once"):
+            load([cameras[0], cameras[0]])
+
+        with self.assertRaisesRegex(ValueError, "non empty list"):
+            load([])
+
+        with self.assertRaisesRegex(ValueError, "Output drop policy of camera 'FIRST'"):
+            load([dict(cameras[0], output_drop_policy="drop_all")])
+
+        with self.assertRaisesRegex(ValueError, "Number of workers of camera 'FIRST'"):
+            load([dict(cameras[0], n_workers=0)])
@@ -0,0 +1,122 @@
+import unittest
+from threading import Thread
+
+from psen_processing.metrics import LatencyHistogram, ProcessingMetrics, ProcessingStatistics, RateMeter, \
+    format_prometheus_metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = LatencyHistogram(buckets=(0.001, 0.01))
+
+        for latency in (0.0005, 0.001, 0.005, 0.5):
+            histogram.observe(latency)
+
+        summary = histogram.get_summary()
+
+        self.assertEqual(summary["count"], 4)
+        self.assertAlmostEqual(summary["sum"], 0.5065)
+        self.assertListEqual(summary["buckets"], [[0.001, 2], [0.01, 3], ["+Inf", 4]])
+
+    def test_histogram_threads(self):
+        histogram = LatencyHistogram()
+
+        def observe():
+            for _ in range(10000):
+                histogram.observe(0.001)
+
+        threads = [Thread(target=observe) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(histogram.get_summary()["count"], 40000)
+
+    def test_rate_meter(self):
+        rate_meter = RateMeter(max_window=10)
+
+        for second in range(100, 110):
+            for index in range(second - 100):
+                rate_meter.mark(second + index * 0.01)
+
+        self.assertEqual(rate_meter.get_rate(1, now=110.5), 9)
+        self.assertEqual(rate_meter.get_rate(10, now=110.5), 4.5)
+        self.assertEqual(rate_meter.get_rate(1, now=200), 0)
+
+    def test_pulse_id_gaps(self):
+        metrics = ProcessingMetrics()
+
+        for pulse_id in (10, 11, 12, 15, 16, 20):
+            metrics.check_pulse_id(pulse_id)
+
+        self.assertEqual(metrics.pulse_id_gaps, 2)
+        self.assertEqual(metrics.missing_pulse_ids, 5)
+
+    def test_statistics_snapshot(self):
+        statistics = ProcessingStatistics()
+        self.assertDictEqual(statistics.snapshot(), {})
+
+        statistics["counter"] = 1
+        self.assertDictEqual(statistics.snapshot(), {"counter": 1})
+
+        statistics.start(sources=[lambda: {"send_queue_occupancy": 3}])
+
+        snapshot = statistics.snapshot()
+        self.assertIsNone(snapshot["last_sent_pulse_id"])
+        self.assertIsNone(snapshot["last_sent_time"])
+        self.assertEqual(snapshot["n_processed_images"], 0)
+        self.assertEqual(snapshot["send_queue_occupancy"], 3)
+        self.assertEqual(snapshot["counter"], 1)
+
+        for pulse_id in range(10, 15):
+            statistics.frame_sent(pulse_id)
+
+        snapshot = statistics.snapshot()
+        self.assertEqual(snapshot["last_sent_pulse_id"], 14)
+        self.assertEqual(snapshot["n_processed_images"], 5)
+        self.assertGreaterEqual(snapshot["last_sent_time"], snapshot["processing_start_time"])
+
+        statistics.start()
+        self.assertEqual(statistics.snapshot()["n_processed_images"], 0)
+
+    def test_consistent_snapshot(self):
+        statistics = ProcessingStatistics()
+        statistics.start()
+
+        def send():
+            for pulse_id in range(50000):
+                statistics.frame_sent(pulse_id)
+
+        thread = Thread(target=send)
+        thread.start()
+
+        while thread.is_alive():
+            snapshot = statistics.snapshot()
+
+            if snapshot["last_sent_pulse_id"] is not None:
+                self.assertEqual(snapshot["n_processed_images"], snapshot["last_sent_pulse_id"] + 1)
+
+        thread.join()
+
+    def test_prometheus_format(self):
+        metrics = ProcessingMetrics()
+        metrics.observe("profiles", 0.002)
+
+        statistics = {"processing_start_time": "2018-01-01 00:00:00", "n_processed_images": 5}
+        statistics.update(metrics.get_summary())
+
+        lines = format_prometheus_metrics([({"camera": "A"}, statistics), ({"camera": "B"}, statistics)]).splitlines()
+
+        self.assertIn("# TYPE psen_processing_n_processed_images_total counter", lines)
+        self.assertIn('psen_processing_n_processed_images_total{camera="B"} 5', lines)
+        self.assertIn("# TYPE psen_processing_pulse_id_gaps_total counter", lines)
+        self.assertIn("# TYPE psen_processing_frames_per_second gauge", lines)
+        self.assertIn('psen_processing_latency_seconds_count{camera="A",stage="profiles"} 1', lines)
+        self.assertIn('psen_processing_frames_per_second{camera="A",window="10s"} 0.0', lines)
+        self.assertFalse(any("processing_start_time" in line for line in lines))
+
+        # Each metric is declared once, with all its samples following the declaration.
+        declared = [line.split()[2] for line in lines if line.startswith("# TYPE")]
+        self.assertEqual(len(declared), len(set(declared)))
@@ -0,0 +1,49 @@
+import unittest
+
+import numpy
+
+from psen_processing.output import OutputLayout, get_output_layout_key, get_value_type
+from psen_processing.rois import RoiConfig
+
+
+class TestOutput(unittest.TestCase):
+
+    def test_value_types(self):
+        self.assertEqual(get_value_type(numpy.zeros(10, dtype="uint32")), (numpy.dtype("uint32").str, (10,)))
+        self.assertEqual(get_value_type(numpy.float64(1)), (numpy.dtype("float64").str, ()))
+        self.assertEqual(get_value_type(1.5), ("float", ()))
+        self.assertEqual(get_value_type("parameters"), ("str", ()))
+
+    def test_output_layout(self):
+        image = numpy.zeros((100, 200), dtype="uint16")
+        roi_config = RoiConfig([0, 100, 0, 100], [])
+
+        data = {"CAMERA.roi_signal_x_profile": numpy.zeros(100, dtype="uint32")}
+        forwarded_data = {"CAMERA:ENERGY": 5.0}
+
+        layout_key = get_output_layout_key(roi_config, image, None, data, forwarded_data)
+        layout = OutputLayout(layout_key, dict(forwarded_data, **data))
+
+        self.assertEqual(len(layout), 2)
+        self.assertEqual(layout.channels[1], ("CAMERA.roi_signal_x_profile", numpy.dtype("uint32").str, (100,)))
+
+        # The same configuration gives the same key for every image.
+        self.assertEqual(get_output_layout_key(roi_config, image.copy(), None, dict(data), dict(forwarded_data)),
+                         layout_key)
+
+        # Any change of the configuration changes the layout.
+        changed_keys = [get_output_layout_key(roi_config.replace(roi_signal=[0, 50, 0, 100]), image, None, data,
+                                              forwarded_data),
+                        get_output_layout_key(roi_config, image.astype("float32"), None, data, forwarded_data),
+                        get_output_layout_key(roi_config, image[:50], None, data, forwarded_data),
+                        get_output_layout_key(roi_config, image, object(), data, forwarded_data),
+                        get_output_layout_key(roi_config, image, None, {}, forwarded_data),
+                        get_output_layout_key(roi_config, image, None, data, {}),
+                        get_output_layout_key(roi_config, image, None, data, {"CAMERA:ENERGY": numpy.zeros(2)})]
+
+        for changed_key in changed_keys:
+            self.assertNotEqual(changed_key, layout_key)
+
+
+if __name__ == '__main__':
+    unittest.main()
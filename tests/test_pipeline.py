@@ -0,0 +1,161 @@
+import unittest
+from threading import Event, Thread
+from time import sleep
+
+from psen_processing.pipeline import StageQueue, StageThread, put_while_running, Sequencer, ReorderBuffer
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_drop_oldest(self):
+        stage_queue = StageQueue(2, "drop_oldest")
+
+        for item in range(4):
+            self.assertTrue(stage_queue.put(item))
+
+        self.assertEqual(len(stage_queue), 2)
+        self.assertEqual(stage_queue.n_dropped, 2)
+        self.assertEqual(stage_queue.get(), 2)
+        self.assertEqual(stage_queue.get(), 3)
+        self.assertIsNone(stage_queue.get(timeout=0.01))
+
+    def test_drop_newest(self):
+        stage_queue = StageQueue(2, "drop_newest")
+
+        self.assertListEqual([stage_queue.put(item) for item in range(4)], [True, True, False, False])
+
+        self.assertEqual(stage_queue.n_dropped, 2)
+        self.assertEqual(stage_queue.get(), 0)
+        self.assertEqual(stage_queue.get(), 1)
+
+    def test_block(self):
+        stage_queue = StageQueue(1, "block")
+
+        self.assertTrue(stage_queue.put(0))
+        self.assertFalse(stage_queue.put(1, timeout=0.01))
+        self.assertEqual(stage_queue.n_dropped, 0)
+
+        def consume():
+            sleep(0.1)
+            stage_queue.get()
+
+        consumer = Thread(target=consume)
+        consumer.start()
+
+        self.assertTrue(stage_queue.put(1, timeout=1))
+        consumer.join()
+
+        self.assertEqual(stage_queue.get(), 1)
+
+    def test_put_while_running(self):
+        stage_queue = StageQueue(1, "block")
+        running_flag = Event()
+        running_flag.set()
+
+        self.assertTrue(put_while_running(stage_queue, 0, running_flag, timeout=0.01))
+
+        def stop():
+            sleep(0.1)
+            running_flag.clear()
+
+        Thread(target=stop).start()
+
+        # Must return once the running flag is cleared, even if the queue stays full.
+        self.assertFalse(put_while_running(stage_queue, 1, running_flag, timeout=0.01))
+
+    def test_invalid_parameters(self):
+        with self.assertRaisesRegex(ValueError, "Drop policy"):
+            StageQueue(1, "unknown")
+
+        with self.assertRaisesRegex(ValueError, "Queue size"):
+            StageQueue(0)
+
+    def test_stage_error(self):
+        running_flag = Event()
+        running_flag.set()
+
+        def failing_stage():
+            raise RuntimeError("Stage failed.")
+
+        stage = StageThread("failing", failing_stage, running_flag)
+        stage.start()
+        stage.join()
+
+        self.assertFalse(running_flag.is_set())
+        self.assertIsInstance(stage.error, RuntimeError)
+
+    def test_sequencer(self):
+        sequencer = Sequencer()
+        order = []
+
+        def worker(sequence):
+            # Later sequences start first, but must wait for their turn.
+            sleep(0.01 * (5 - sequence))
+
+            with sequencer.turn(sequence):
+                order.append(sequence)
+
+        workers = [Thread(target=worker, args=(sequence,)) for sequence in range(5)]
+
+        for thread in workers:
+            thread.start()
+
+        for thread in workers:
+            thread.join()
+
+        self.assertListEqual(order, list(range(5)))
+
+    def test_sequencer_stop(self):
+        running_flag = Event()
+        running_flag.set()
+
+        sequencer = Sequencer(running_flag, timeout=0.01)
+        order = []
+
+        def worker():
+            # Sequence 0 never takes its turn.
+            with sequencer.turn(1):
+                order.append(1)
+
+        thread = Thread(target=worker)
+        thread.start()
+
+        sleep(0.05)
+        self.assertListEqual(order, [])
+
+        # Clearing the running flag releases the waiting workers.
+        running_flag.clear()
+        thread.join(timeout=1)
+
+        self.assertFalse(thread.is_alive())
+        self.assertListEqual(order, [1])
+
+    def test_reorder_buffer(self):
+        output = []
+        reorder_buffer = ReorderBuffer(output.append, max_latency=10)
+
+        reorder_buffer.add(1, "b")
+        reorder_buffer.add(2, "c")
+        self.assertListEqual(output, [])
+        self.assertEqual(len(reorder_buffer), 2)
+
+        reorder_buffer.add(0, "a")
+        self.assertListEqual(output, ["a", "b", "c"])
+        self.assertEqual(len(reorder_buffer), 0)
+
+    def test_reorder_buffer_latency(self):
+        output = []
+        reorder_buffer = ReorderBuffer(output.append, max_latency=0.05)
+
+        reorder_buffer.add(1, "b")
+        reorder_buffer.flush()
+        self.assertListEqual(output, [])
+
+        sleep(0.1)
+        reorder_buffer.flush()
+        self.assertListEqual(output, ["b"])
+
+        # Too late, the results after it were already sent.
+        reorder_buffer.add(0, "a")
+        self.assertListEqual(output, ["b"])
+        self.assertEqual(reorder_buffer.n_dropped, 1)
@@ -7,7 +7,14 @@ from multiprocessing import Process, Event
 from bsread import source, PULL, json
 
 from psen_processing import config
-from psen_processing.processor import get_roi_x_profile, process_image, get_stream_processor
+from psen_processing.background import BackgroundModel
+from psen_processing.calibration import Calibration
+from psen_processing.metrics import ProcessingStatistics
+from psen_processing.pipeline import StageQueue, StageThread
+from psen_processing.processor import get_roi_x_profile, process_image, process_frame, process_batch, \
+    get_stream_processor
+from psen_processing.rois import RoiConfig
+from psen_processing.utils import get_default_processing_parameters
 
 
 class TestProcessing(unittest.TestCase):
@@ -42,19 +49,25 @@ class TestProcessing(unittest.TestCase):
         roi_signal = [0, 1024, 0, 1024]
         roi_background = []
 
-        processed_data = process_image(image, image_property_name, roi_signal, roi_background)
+        processed_data = process_image(0, image, image_property_name, roi_signal, roi_background, BackgroundModel())
 
         self.assertSetEqual(set(processed_data.keys()), {image_property_name + ".processing_parameters",
-                                                         image_property_name + ".roi_signal_x_profile"})
+                                                         image_property_name + ".fel_shot",
+                                                         image_property_name + ".roi_signal_x_profile",
+                                                         image_property_name + ".edge_position",
+                                                         image_property_name + ".cross_correlation_amplitude"})
 
         roi_signal = [0, 1024, 0, 1024]
         roi_background = [0, 100, 0, 100]
 
-        processed_data = process_image(image, image_property_name, roi_signal, roi_background)
+        processed_data = process_image(0, image, image_property_name, roi_signal, roi_background, BackgroundModel())
 
         self.assertSetEqual(set(processed_data.keys()), {image_property_name + ".processing_parameters",
+                                                         image_property_name + ".fel_shot",
                                                          image_property_name + ".roi_signal_x_profile",
-                                                         image_property_name + ".roi_background_x_profile"})
+                                                         image_property_name + ".roi_background_x_profile",
+                                                         image_property_name + ".edge_position",
+                                                         image_property_name + ".cross_correlation_amplitude"})
 
         self.assertEqual(len(processed_data[image_property_name + ".roi_signal_x_profile"]), 1024)
         self.assertListEqual(list(processed_data[image_property_name + ".roi_signal_x_profile"]), [1024] * 1024)
@@ -62,6 +75,293 @@ class TestProcessing(unittest.TestCase):
         self.assertEqual(len(processed_data[image_property_name + ".roi_background_x_profile"]), 100)
         self.assertListEqual(list(processed_data[image_property_name + ".roi_background_x_profile"]), [100] * 100)
 
+    def test_independent_background(self):
+        image = numpy.zeros(shape=(100, 200), dtype="uint16")
+        image[:, :100] = 10
+
+        image_property_name = "TESTING_IMAGE"
+        roi_signal = [0, 200, 0, 100]
+
+        first_background = BackgroundModel()
+        second_background = BackgroundModel()
+
+        for pulse_id in range(1, 4):
+            process_image(pulse_id, numpy.zeros_like(image), image_property_name, roi_signal, [], first_background)
+
+        first_data = process_image(4, image, image_property_name, roi_signal, [], first_background)
+        second_data = process_image(4, image, image_property_name, roi_signal, [], second_background)
+
+        self.assertEqual(len(first_background), 3)
+        self.assertEqual(len(second_background), 0)
+
+        self.assertEqual(first_data[image_property_name + ".edge_position"], 100)
+        self.assertTrue(numpy.isnan(second_data[image_property_name + ".edge_position"]))
+
+        first_processor = get_stream_processor("localhost", 10000, 11000, 11001, "FIRST")
+        second_processor = get_stream_processor("localhost", 10000, 11000, 11001, "SECOND")
+
+        self.assertIsNot(first_processor.background, second_processor.background)
+
+    def test_shot_classifier(self):
+        image = numpy.zeros(shape=(100, 200), dtype="uint16")
+        image[:, :100] = 10
+
+        image_property_name = "TESTING_IMAGE"
+        roi_signal = [0, 200, 0, 100]
+
+        shot_classifier = {"mode": "channel", "period": 4, "phase": 0, "channel": "FEL", "event_code": None,
+                           "threshold": None}
+
+        background = BackgroundModel()
+        for pulse_id in range(4):
+            process_image(pulse_id, numpy.zeros_like(image), image_property_name, roi_signal, [], background,
+                          shot_classifier=shot_classifier, channels={"FEL": 0})
+
+        # Shots without the classifier channel neither update the background nor find edges.
+        data = process_image(4, image, image_property_name, roi_signal, [], background,
+                             shot_classifier=shot_classifier, channels={})
+        self.assertNotIn(image_property_name + ".fel_shot", data)
+        self.assertTrue(numpy.isnan(data[image_property_name + ".edge_position"]))
+
+        data = process_image(5, image, image_property_name, roi_signal, [], background,
+                             shot_classifier=shot_classifier, channels={"FEL": 1})
+
+        self.assertEqual(len(background), 4)
+        self.assertTrue(data[image_property_name + ".fel_shot"])
+        self.assertEqual(data[image_property_name + ".edge_position"], 100)
+
+    def test_process_batch(self):
+        random = numpy.random.RandomState(0)
+        images = random.randint(0, 50, size=(40, 50, 300)).astype("uint16")
+        for index in range(0, 40, 4):
+            images[index, :, :100 + index] += 100
+
+        image_property_name = "TESTING_IMAGE"
+        roi_signal = [0, 300, 0, 40]
+        roi_background = [0, 100, 40, 10]
+
+        for mode in ("average", "ema", "median"):
+            background = BackgroundModel(mode, 3)
+            expected = [process_image(pulse_id, image, image_property_name, roi_signal, roi_background, background)
+                        for pulse_id, image in enumerate(images)]
+
+            result = process_batch(numpy.arange(40), images, roi_signal, roi_background,
+                                   {"mode": mode, "depth": 3}, chunk_size=7)
+
+            for suffix in ("edge_position", "cross_correlation_amplitude", "roi_signal_x_profile",
+                           "roi_background_x_profile", "fel_shot"):
+                numpy.testing.assert_allclose(result[suffix],
+                                              [data[image_property_name + "." + suffix] for data in expected])
+
+        self.assertTrue(numpy.isnan(result["edge_position"][0]))
+        self.assertEqual(result["edge_position"][4], 104)
+
+        with self.assertRaisesRegex(ValueError, "3D array"):
+            process_batch([0, 1], images, roi_signal, roi_background)
+
+    def test_named_rois(self):
+        image_property_name = "JUST_TESTING" + config.EPICS_PV_SUFFIX_IMAGE
+        roi_signal = [0, 200, 0, 100]
+
+        named_rois = {"edge": {"roi": roi_signal, "projection": "x", "edge_finding": True, "moments": False},
+                      "rows": {"roi": [10, 20, 30, 40], "projection": "y", "edge_finding": False, "moments": False},
+                      "total": {"roi": [0, 10, 0, 10], "projection": "sum", "edge_finding": False, "moments": False}}
+
+        roi_config = RoiConfig(roi_signal, [], named_rois)
+        background = BackgroundModel()
+        roi_backgrounds = {}
+
+        for pulse_id in range(8):
+            image = numpy.full(shape=(100, 200), fill_value=10, dtype="uint16")
+            if pulse_id % 4 == 0:
+                image[:, :120] += 100
+
+            processed_data = process_frame(pulse_id, image, image_property_name, roi_config, background,
+                                           roi_backgrounds=roi_backgrounds)
+
+        self.assertListEqual(list(processed_data[image_property_name + ".roi_rows_y_profile"]), [200] * 40)
+        self.assertEqual(processed_data[image_property_name + ".roi_total_sum"], 1000)
+
+        # The named ROI with the same ROI as the signal has the same background and edge.
+        numpy.testing.assert_array_equal(processed_data[image_property_name + ".roi_edge_x_profile"],
+                                         processed_data[image_property_name + ".roi_signal_x_profile"])
+
+        image[:, :120] += 100
+        fel_data = process_frame(8, image, image_property_name, roi_config, background,
+                                 roi_backgrounds=roi_backgrounds)
+
+        self.assertAlmostEqual(fel_data[image_property_name + ".edge_position"], 120, delta=1)
+        self.assertEqual(fel_data[image_property_name + ".roi_edge_edge_position"],
+                         fel_data[image_property_name + ".edge_position"])
+        self.assertListEqual(list(roi_backgrounds), [("edge", tuple(roi_signal))])
+
+        # Backgrounds of removed ROIs are dropped.
+        process_frame(9, image, image_property_name, RoiConfig(roi_signal, []), background,
+                      roi_backgrounds=roi_backgrounds)
+        self.assertDictEqual(roi_backgrounds, {})
+
+    def test_edge_finder_parameters(self):
+        image_property_name = "JUST_TESTING" + config.EPICS_PV_SUFFIX_IMAGE
+
+        background_image = numpy.full(shape=(100, 200), fill_value=10, dtype="uint16")
+        fel_image = background_image.copy()
+        fel_image[:, 80:] += 100
+
+        def get_edge_position(edge_finder):
+            roi_config = RoiConfig([0, 200, 0, 100], [], edge_finder=edge_finder)
+            background = BackgroundModel()
+
+            process_frame(1, background_image, image_property_name, roi_config, background)
+            processed_data = process_frame(4, fel_image, image_property_name, roi_config, background)
+
+            self.assertEqual(json.loads(processed_data[image_property_name + ".processing_parameters"])["edge_finder"],
+                             roi_config.edge_finder)
+
+            return processed_data[image_property_name + ".edge_position"]
+
+        self.assertAlmostEqual(get_edge_position({"step_length": 20, "edge_type": "rising", "refinement": 1,
+                                                  "peak_fit": None}), 80, delta=1)
+
+        # A rising edge is not found with the default falling step.
+        self.assertGreater(abs(get_edge_position(None) - 80), 5)
+
+    def test_roi_moments(self):
+        image_property_name = "JUST_TESTING" + config.EPICS_PV_SUFFIX_IMAGE
+
+        image = numpy.zeros(shape=(100, 200), dtype="uint16")
+        image[40:60, 100] = 1
+        image[40:60, 110] = 1
+        image[50, 105] = 7
+
+        named_rois = {"beam": {"roi": [50, 100, 20, 60], "projection": "sum", "edge_finding": False, "moments": True}}
+        processed_data = process_frame(0, image, image_property_name, RoiConfig([], [], named_rois),
+                                       BackgroundModel())
+
+        channel_prefix = image_property_name + ".roi_beam_"
+
+        self.assertEqual(processed_data[channel_prefix + "sum"], 47)
+        self.assertEqual(processed_data[channel_prefix + "intensity"], 47)
+        self.assertEqual(processed_data[channel_prefix + "max_pixel"], 7)
+        self.assertEqual(len(processed_data[channel_prefix + "x_profile"]), 100)
+        self.assertEqual(len(processed_data[channel_prefix + "y_profile"]), 60)
+
+        # Symmetric around (105, 50) in image coordinates.
+        self.assertAlmostEqual(processed_data[channel_prefix + "x_center"], 105)
+        self.assertAlmostEqual(processed_data[channel_prefix + "y_center"], (sum(range(40, 60)) * 2 + 50 * 7) / 47)
+        self.assertAlmostEqual(processed_data[channel_prefix + "x_rms"], numpy.sqrt(40 * 25 / 47))
+
+        # No intensity in the ROI.
+        processed_data = process_frame(0, numpy.zeros_like(image), image_property_name,
+                                       RoiConfig([], [], named_rois), BackgroundModel())
+        self.assertTrue(numpy.isnan(processed_data[channel_prefix + "x_center"]))
+
+    def test_resolve_rois(self):
+        stream_processor = get_stream_processor("localhost", 10000, 11000, 11001, "JUST_TESTING")
+        processing_parameters = get_default_processing_parameters()
+
+        roi_config = RoiConfig([0, 2000, 0, 50], [])
+
+        resolved_config = stream_processor.resolve_rois(roi_config, (100, 200), processing_parameters)
+        self.assertEqual(resolved_config.roi_signal, (0, 200, 0, 50))
+        self.assertEqual(processing_parameters["image_shape"], (100, 200))
+
+        # The resolved config is reused for the next images of the same shape.
+        self.assertIs(stream_processor.resolve_rois(roi_config, (100, 200), processing_parameters), resolved_config)
+        self.assertEqual(stream_processor.resolve_rois(roi_config, (100, 100), processing_parameters).roi_signal,
+                         (0, 100, 0, 50))
+
+    def test_calibration(self):
+        image_property_name = "JUST_TESTING" + config.EPICS_PV_SUFFIX_IMAGE
+
+        image = numpy.full((100, 200), 12, dtype="uint16")
+        calibration = Calibration(dark=numpy.full((100, 200), 10, dtype="float32"))
+
+        named_rois = {"total": {"roi": [0, 200, 0, 100], "projection": "sum", "edge_finding": False, "moments": False}}
+        processed_data = process_frame(0, image, image_property_name, RoiConfig([], [], named_rois),
+                                       BackgroundModel(), calibration=calibration)
+
+        self.assertEqual(processed_data[image_property_name + ".roi_total_sum"], 2 * 100 * 200)
+
+        # Calibrations are only used for images of their shape.
+        stream_processor = get_stream_processor("localhost", 10000, 11000, 11001, "JUST_TESTING")
+
+        self.assertIs(stream_processor.get_calibration(calibration, (100, 200)), calibration)
+        self.assertIsNone(stream_processor.get_calibration(calibration, (200, 100)))
+        self.assertIsNone(stream_processor.get_calibration(calibration.replace(enabled=False), (100, 200)))
+
+    def test_output_layout(self):
+        stream_processor = get_stream_processor("localhost", 10000, 11000, 11001, "JUST_TESTING")
+
+        layout = stream_processor.get_output_layout(("version", 0), {"JUST_TESTING:ENERGY": 5.0})
+
+        # The layout is reused until the configuration changes.
+        self.assertIs(stream_processor.get_output_layout(("version", 0), {"JUST_TESTING:ENERGY": 6.0}), layout)
+        self.assertIsNot(stream_processor.get_output_layout(("version", 1), {"JUST_TESTING:ENERGY": 6.0}), layout)
+
+    def test_output_queues(self):
+        stream_processor = get_stream_processor("localhost", 10000, 11000, 11001, "JUST_TESTING", output_queue_size=2,
+                                                output_drop_policy="drop_oldest")
+
+        stream_processor.data_output_queue = StageQueue(2, "drop_oldest")
+        stream_processor.image_output_queue = StageQueue(2, "drop_oldest")
+
+        running_flag = Event()
+        running_flag.set()
+
+        # Without a consumer, the oldest results are dropped instead of blocking the processing.
+        for pulse_id in range(5):
+            stream_processor.queue_output((pulse_id, None, {}, None, {"image": pulse_id} if pulse_id % 2 else None),
+                                          running_flag)
+
+        self.assertEqual([stream_processor.data_output_queue.get()[0] for _ in range(2)], [3, 4])
+        self.assertEqual(stream_processor.data_output_queue.n_dropped, 3)
+
+        self.assertEqual(len(stream_processor.image_output_queue), 2)
+        self.assertEqual(stream_processor.image_output_queue.n_dropped, 0)
+
+    def test_failing_frame(self):
+        stream_processor = get_stream_processor("localhost", 10000, 11000, 11001, "JUST_TESTING", n_workers=2)
+        processing_parameters = get_default_processing_parameters()
+
+        running_flag = Event()
+        running_flag.set()
+        stream_processor.reset_pipeline(running_flag)
+
+        # The first frame fails before the processing, the second one waits for its background turn.
+        stream_processor.compute_queue.put((0, (None, None), None, {}, {}))
+        stream_processor.compute_queue.put((1, (None, None), numpy.zeros((100, 200), dtype="uint16"), {}, {}))
+
+        workers = [StageThread("compute_%d" % index,
+                               lambda: stream_processor.compute(running_flag, processing_parameters), running_flag)
+                   for index in range(2)]
+
+        for worker in workers:
+            worker.start()
+
+        for worker in workers:
+            worker.join(timeout=5)
+
+        # The failing frame stops the processing, and no worker is left waiting.
+        self.assertFalse(running_flag.is_set())
+        self.assertFalse(any(worker.is_alive() for worker in workers))
+        self.assertEqual(sum(isinstance(worker.error, AttributeError) for worker in workers), 1)
+
+    def test_decoded_channels(self):
+        image_property_name = "JUST_TESTING" + config.EPICS_PV_SUFFIX_IMAGE
+        channel_names = (image_property_name, "JUST_TESTING:ENERGY", "EVENT:FEL", "OTHER:ENERGY")
+
+        stream_processor = get_stream_processor("localhost", 10000, 11000, 11001, "JUST_TESTING")
+        processing_parameters = get_default_processing_parameters()
+
+        self.assertEqual(stream_processor.get_decoded_channels(channel_names, processing_parameters),
+                         (image_property_name,))
+
+        processing_parameters["shot_classifier"] = {"mode": "channel", "channel": "EVENT:FEL"}
+        processing_parameters["channel_forwarding"] = {"channels": ["JUST_TESTING:*"]}
+
+        self.assertEqual(stream_processor.get_decoded_channels(channel_names, processing_parameters),
+                         (image_property_name, "EVENT:FEL", "JUST_TESTING:ENERGY"))
+
     def test_stream_processor(self):
         pv_name_prefix = "JUST_TESTING"
         n_images = 5
@@ -71,7 +371,9 @@ class TestProcessing(unittest.TestCase):
         image = numpy.zeros(shape=(1024, 1024), dtype="uint16")
         image += 1
 
-        data_to_send = {pv_name_prefix + config.EPICS_PV_SUFFIX_IMAGE: image}
+        data_to_send = {pv_name_prefix + config.EPICS_PV_SUFFIX_IMAGE: image,
+                        "JUST_TESTING:ENERGY": 5.0,
+                        "OTHER:ENERGY": 6.0}
 
         def send_data():
             sleep(1)
@@ -86,7 +388,11 @@ class TestProcessing(unittest.TestCase):
                                                     image_output_stream_port=11001,
                                                     epics_pv_name_prefix=pv_name_prefix)
 
-            stream_processor(event, original_roi_signal, original_roi_background, {})
+            processing_parameters = get_default_processing_parameters()
+            processing_parameters["rois"] = RoiConfig(original_roi_signal, original_roi_background)
+            processing_parameters["channel_forwarding"] = {"channels": [pv_name_prefix + ":*"]}
+
+            stream_processor(event, ProcessingStatistics(), processing_parameters)
 
         running_event = Event()
 
@@ -111,12 +417,18 @@ class TestProcessing(unittest.TestCase):
 
         self.assertEqual(len(data_received), n_images)
 
+        # Only the selected input channels are forwarded, the image is only sent on the image stream.
+        self.assertEqual(data_received[0].data.data["JUST_TESTING:ENERGY"].value, 5.0)
+        self.assertNotIn("OTHER:ENERGY", data_received[0].data.data)
+        self.assertNotIn(pv_name_prefix + config.EPICS_PV_SUFFIX_IMAGE, data_received[0].data.data)
+
         parameters = data_received[0].data.data[pv_name_prefix + config.EPICS_PV_SUFFIX_IMAGE +
                                                 ".processing_parameters"].value
         processing_parameters = json.loads(parameters)
 
         self.assertEqual(processing_parameters["roi_signal"], original_roi_signal)
         self.assertEqual(processing_parameters["roi_background"], original_roi_background)
+        self.assertEqual(processing_parameters["roi_version"], 0)
 
         roi_signal = data_received[0].data.data[pv_name_prefix + config.EPICS_PV_SUFFIX_IMAGE +
                                                 ".roi_signal_x_profile"].value
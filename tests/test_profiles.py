@@ -0,0 +1,118 @@
+import unittest
+
+import numpy
+
+from psen_processing.calibration import Calibration
+from psen_processing.profiles import ProfileEngine, get_roi_x_profile, get_accumulator_dtype, get_profile_plan, \
+    get_batch_x_profiles, get_profile_moments
+
+
+class TestProfiles(unittest.TestCase):
+
+    def test_matches_reference(self):
+        random = numpy.random.RandomState(0)
+        image = random.randint(0, 65535, size=(50, 60)).astype("uint16")
+
+        profile_engine = ProfileEngine()
+
+        for _ in range(500):
+            rois = [[int(random.randint(0, 70)), int(random.randint(1, 70)),
+                     int(random.randint(0, 60)), int(random.randint(1, 60))] for _ in range(3)]
+            rois.append([])
+
+            profiles = profile_engine.get_x_profiles(image, rois)
+
+            self.assertIsNone(profiles[-1])
+
+            for roi, profile in zip(rois[:-1], profiles):
+                numpy.testing.assert_array_equal(profile, get_roi_x_profile(image, roi))
+
+    def test_shared_rows(self):
+        image = numpy.ones(shape=(100, 100), dtype="uint16")
+
+        plan = get_profile_plan(((0, 50, 10, 20), (40, 60, 10, 20)), image.shape)
+
+        # Both ROIs cover the same rows and overlapping columns - a single sum over the image.
+        self.assertEqual(len(plan.operations), 1)
+
+        signal_profile, background_profile = ProfileEngine().get_x_profiles(image, [[0, 50, 10, 20],
+                                                                                    [40, 60, 10, 20]])
+
+        self.assertListEqual(list(signal_profile), [20] * 50)
+        self.assertListEqual(list(background_profile), [20] * 60)
+
+    def test_projections(self):
+        random = numpy.random.RandomState(0)
+        image = random.randint(0, 65535, size=(50, 60)).astype("uint16")
+
+        profile_engine = ProfileEngine()
+
+        for _ in range(500):
+            rois = [[int(random.randint(0, 70)), int(random.randint(1, 70)),
+                     int(random.randint(0, 60)), int(random.randint(1, 60))] for _ in range(4)]
+            projections = [["x", "y", "sum"][random.randint(0, 3)] for _ in range(4)]
+
+            for roi, projection, result in zip(rois, projections,
+                                               profile_engine.get_projections(image, rois, projections)):
+                offset_x, size_x, offset_y, size_y = roi
+                roi_image = image[offset_y:offset_y + size_y, offset_x:offset_x + size_x].astype("uint64")
+
+                expected = {"x": roi_image.sum(0), "y": roi_image.sum(1), "sum": roi_image.sum()}[projection]
+                numpy.testing.assert_array_equal(result, expected)
+
+    def test_moments(self):
+        random = numpy.random.RandomState(0)
+        image = random.randint(0, 65535, size=(50, 60)).astype("uint16")
+
+        roi = [10, 30, 5, 20]
+        roi_image = image[5:25, 10:40]
+
+        x_profile, y_profile, intensity, max_pixel = ProfileEngine().get_projections(image, [roi], ["moments"])[0]
+
+        numpy.testing.assert_array_equal(x_profile, roi_image.sum(0))
+        numpy.testing.assert_array_equal(y_profile, roi_image.sum(1))
+        self.assertEqual(intensity, roi_image.sum(dtype="uint64"))
+        self.assertEqual(max_pixel, roi_image.max())
+
+        center, rms = get_profile_moments(numpy.array([0, 1, 2, 1, 0]), 10)
+        self.assertAlmostEqual(center, 12)
+        self.assertAlmostEqual(rms, numpy.sqrt(0.5))
+
+    def test_calibration(self):
+        random = numpy.random.RandomState(0)
+        image = random.randint(0, 4096, size=(50, 60)).astype("uint16")
+
+        dark = random.uniform(90, 110, size=(50, 60)).astype("float32")
+        flat = dark + random.uniform(500, 1500, size=(50, 60)).astype("float32")
+
+        calibration = Calibration(dark, flat)
+        corrected_image = (image - dark) * calibration.gain
+
+        rois = [[10, 30, 5, 20], [20, 30, 0, 10], [0, 10, 40, 10]]
+        projections = ["x", "y", "moments"]
+
+        profiles = ProfileEngine().get_projections(image, rois, projections, calibration)
+
+        numpy.testing.assert_allclose(profiles[0], corrected_image[5:25, 10:40].sum(0), rtol=1e-4)
+        numpy.testing.assert_allclose(profiles[1], corrected_image[0:10, 20:50].sum(1), rtol=1e-4)
+
+        x_profile, y_profile, intensity, max_pixel = profiles[2]
+        numpy.testing.assert_allclose(y_profile, corrected_image[40:50, 0:10].sum(1), rtol=1e-4)
+        self.assertAlmostEqual(intensity / corrected_image[40:50, 0:10].sum(), 1, places=4)
+        self.assertAlmostEqual(max_pixel / corrected_image[40:50, 0:10].max(), 1, places=5)
+
+    def test_accumulator_dtype(self):
+        self.assertEqual(get_accumulator_dtype(numpy.dtype("uint16"), 2160), numpy.dtype("uint32"))
+        self.assertEqual(get_accumulator_dtype(numpy.dtype("uint32"), 2160), numpy.dtype("uint64"))
+        self.assertEqual(get_accumulator_dtype(numpy.dtype("int16"), 2160), numpy.dtype("int32"))
+        self.assertEqual(get_accumulator_dtype(numpy.dtype("float32"), 2160), numpy.dtype("float64"))
+
+    def test_batch_x_profiles(self):
+        random = numpy.random.RandomState(0)
+        images = random.randint(0, 65535, size=(7, 50, 60)).astype("uint16")
+
+        for roi in ([0, 60, 0, 50], [10, 20, 5, 30], [50, 20, 40, 20]):
+            profiles = get_batch_x_profiles(images, roi, chunk_size=3)
+
+            self.assertEqual(profiles.dtype, numpy.dtype("uint32"))
+            numpy.testing.assert_array_equal(profiles, [get_roi_x_profile(image, roi) for image in images])
@@ -0,0 +1,102 @@
+import json
+import unittest
+
+import numpy
+
+from psen_processing.receiver import RawMessageHandler
+
+
+class MockReceiver(object):
+    """
+    Multipart message receiver, as passed by bsread to the receive handlers.
+    """
+
+    def __init__(self, frames):
+        self.frames = list(frames)
+
+    def next(self, as_json=False):
+        frame = self.frames.pop(0)
+        return json.loads(frame.decode()) if as_json else frame
+
+    def has_more(self):
+        return bool(self.frames)
+
+
+def get_message_frames(pulse_id, channels, values, header_hash="hash_1", data_header=None):
+    main_header = {"htype": "bsr_m-1.1", "pulse_id": pulse_id, "global_timestamp": {"sec": 1000, "ns": 10},
+                   "hash": header_hash}
+
+    if data_header is None:
+        data_header = json.dumps({"htype": "bsr_d-1.1", "channels": channels}).encode()
+
+    frames = [json.dumps(main_header).encode(), data_header]
+
+    for value in values:
+        frames.extend((value, numpy.array([1000, 10], dtype="int64").tobytes()))
+
+    return frames
+
+
+class TestReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.image = numpy.arange(200, dtype="uint16").reshape((10, 20))
+
+        self.channels = [{"name": "CAMERA:FPICTURE", "type": "uint16", "shape": [20, 10]},
+                         {"name": "CAMERA:ENERGY", "type": "double", "encoding": "big"},
+                         {"name": "CAMERA:NAME", "type": "string"},
+                         {"name": "CAMERA:SPECTRUM", "type": "float32", "shape": [5]},
+                         {"name": "CAMERA:MISSING", "type": "int32"}]
+
+        self.values = [self.image.tobytes(), numpy.array([1.5], dtype=">f8").tobytes(), b"camera",
+                       numpy.arange(5, dtype="float32").tobytes(), b""]
+
+    def test_decode_requested_channels(self):
+        requested = []
+        handler = RawMessageHandler(lambda channel_names: requested.append(channel_names) or
+                                    ("CAMERA:FPICTURE", "CAMERA:ENERGY"))
+
+        message = handler.receive(MockReceiver(get_message_frames(10, self.channels, self.values)))
+
+        self.assertEqual(requested, [tuple(channel["name"] for channel in self.channels)])
+        self.assertEqual(message.data.pulse_id, 10)
+        self.assertEqual(message.data.global_timestamp, 1000)
+        self.assertEqual(message.data.global_timestamp_offset, 10)
+
+        self.assertSetEqual(set(message.data.data), {"CAMERA:FPICTURE", "CAMERA:ENERGY"})
+        self.assertEqual(message.data.data["CAMERA:ENERGY"].value, 1.5)
+
+        # The image is a view of the received frame, in numpy order.
+        image = message.data.data["CAMERA:FPICTURE"].value
+        self.assertEqual(image.shape, (10, 20))
+        numpy.testing.assert_array_equal(image, self.image)
+        self.assertFalse(image.flags.writeable)
+
+    def test_decode_all_types(self):
+        handler = RawMessageHandler(lambda channel_names: channel_names)
+        data = handler.receive(MockReceiver(get_message_frames(10, self.channels, self.values))).data.data
+
+        self.assertEqual(data["CAMERA:NAME"].value, "camera")
+        numpy.testing.assert_array_equal(data["CAMERA:SPECTRUM"].value, numpy.arange(5, dtype="float32"))
+        self.assertIsNone(data["CAMERA:MISSING"].value)
+
+    def test_data_header_cache(self):
+        handler = RawMessageHandler(lambda channel_names: ("CAMERA:ENERGY",))
+        handler.receive(MockReceiver(get_message_frames(10, self.channels, self.values)))
+
+        # The data header is not parsed again while the hash does not change.
+        frames = get_message_frames(11, self.channels, self.values, data_header=b"not parsed")
+        self.assertEqual(handler.receive(MockReceiver(frames)).data.data["CAMERA:ENERGY"].value, 1.5)
+
+        channels = [{"name": "CAMERA:ENERGY", "type": "float32"}]
+        frames = get_message_frames(12, channels, [numpy.array([2.5], dtype="float32").tobytes()],
+                                    header_hash="hash_2")
+        self.assertEqual(handler.receive(MockReceiver(frames)).data.data["CAMERA:ENERGY"].value, 2.5)
+
+        with self.assertRaisesRegex(ValueError, "Compression"):
+            channels = [{"name": "CAMERA:ENERGY", "type": "float32", "compression": "zip"}]
+            handler.receive(MockReceiver(get_message_frames(13, channels, [b""], header_hash="hash_3")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import unittest
+
+import numpy
+
+from psen_processing.rois import RoiConfig, clip_roi, get_roi_slices
+
+
+class TestRois(unittest.TestCase):
+
+    def test_roi_slices(self):
+        self.assertIsNone(get_roi_slices([]))
+
+        image = numpy.arange(100 * 200).reshape((100, 200))
+        numpy.testing.assert_array_equal(image[get_roi_slices([10, 20, 30, 40])], image[30:70, 10:30])
+
+    def test_clip_roi(self):
+        self.assertListEqual(clip_roi([], (100, 200)), [])
+        self.assertListEqual(clip_roi([10, 20, 30, 40], (100, 200)), [10, 20, 30, 40])
+        self.assertListEqual(clip_roi([190, 20, 90, 40], (100, 200)), [190, 10, 90, 10])
+        self.assertListEqual(clip_roi([200, 20, 0, 40], (100, 200)), [])
+        self.assertListEqual(clip_roi([0, 20, 100, 40], (100, 200)), [])
+
+    def test_resolve(self):
+        roi_config = RoiConfig([10, 20, 30, 40], [150, 100, 0, 100], version=3)
+        self.assertIsNone(roi_config.image_shape)
+
+        resolved_config = roi_config.resolve((100, 200))
+
+        self.assertEqual(resolved_config.image_shape, (100, 200))
+        self.assertEqual(resolved_config.version, 3)
+        self.assertEqual(resolved_config.rois, ((10, 20, 30, 40), (150, 50, 0, 100)))
+        self.assertEqual(json.loads(resolved_config.processing_parameters)["roi_background"], [150, 50, 0, 100])
+
+        # A new ROI has to be resolved again.
+        self.assertIsNone(resolved_config.replace(roi_signal=[0, 1, 0, 1]).image_shape)
+
+    def test_roi_config(self):
+        roi_config = RoiConfig([10, 20, 30, 40], [])
+
+        self.assertEqual(roi_config.version, 0)
+        self.assertEqual(roi_config.rois, ((10, 20, 30, 40), ()))
+        self.assertListEqual(roi_config.crop, [10, 20, 30, 40])
+        self.assertDictEqual(json.loads(roi_config.processing_parameters),
+                             {"roi_signal": [10, 20, 30, 40], "roi_background": [], "rois": {},
+                              "edge_finder": {"step_length": 50, "edge_type": "falling", "refinement": 1,
+                                              "peak_fit": None},
+                              "roi_version": 0})
+
+        with self.assertRaisesRegex(AttributeError, "immutable"):
+            roi_config.roi_signal = (0, 1, 0, 1)
+
+        new_config = roi_config.replace(roi_background=[50, 10, 5, 5])
+
+        self.assertEqual(new_config.version, 1)
+        self.assertEqual(new_config.rois, ((10, 20, 30, 40), (50, 10, 5, 5)))
+        self.assertListEqual(new_config.crop, [10, 50, 5, 65])
+        self.assertEqual(json.loads(new_config.processing_parameters)["roi_version"], 1)
+
+        # The old config is not changed.
+        self.assertEqual(roi_config.roi_background, ())
+        self.assertIsNone(RoiConfig().crop_slices)
+
+    def test_edge_finder(self):
+        roi_config = RoiConfig([10, 20, 30, 40], []).resolve((100, 200))
+
+        new_config = roi_config.replace(edge_finder={"step_length": 100, "edge_type": "rising", "refinement": 1,
+                                                     "peak_fit": "parabolic"})
+
+        self.assertEqual(new_config.version, 1)
+        self.assertEqual(new_config.rois, roi_config.rois)
+        self.assertEqual(json.loads(new_config.processing_parameters)["edge_finder"]["step_length"], 100)
+
+        # The edge finder parameters are kept by the ROI changes.
+        self.assertEqual(new_config.replace(roi_signal=[]).resolve((100, 200)).edge_finder["edge_type"], "rising")
+
+
+    def test_named_rois(self):
+        named_rois = {"peak": {"roi": [100, 10, 0, 5], "projection": "y", "edge_finding": True, "moments": False},
+                      "total": {"roi": [0, 300, 0, 100], "projection": "sum", "edge_finding": False, "moments": True}}
+
+        roi_config = RoiConfig([10, 20, 30, 40], [], named_rois)
+
+        self.assertEqual(roi_config.rois, ((10, 20, 30, 40), (), (100, 10, 0, 5), (0, 300, 0, 100)))
+        self.assertEqual(roi_config.projections, ("x", "x", "y", "moments"))
+        self.assertListEqual(roi_config.crop, [0, 300, 0, 100])
+        self.assertDictEqual(roi_config.get_named_rois(), named_rois)
+        self.assertDictEqual(json.loads(roi_config.processing_parameters)["rois"], named_rois)
+
+        new_config = roi_config.replace(roi_signal=[])
+        self.assertDictEqual(new_config.get_named_rois(), named_rois)
+
+        resolved_config = roi_config.resolve((100, 200))
+        self.assertEqual(resolved_config.get_named_rois()["total"]["roi"], [0, 200, 0, 100])
+
+        self.assertEqual(roi_config.resolve((100, 50)).get_named_rois()["peak"]["roi"], [])
+
+
+if __name__ == '__main__':
+    unittest.main()